@@ -0,0 +1,170 @@
+# Benchmark ModalOrLocal volume operations against an in-process FakeVolume with injected latency and bandwidth (no Modal account needed).
+# Run with e.g. 'python benchmarks/bench_fake_volume.py --files 1000 10000 --latency-ms 2'
+# Results (wall time and RPC counts per benchmark) are printed and saved as json, by default to benchmarks/results/<git commit>.json
+# Pass '--compare benchmarks/results/<other commit>.json' to print the change against an earlier run.
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Any, Callable, Dict, List
+
+from modal_or_local import ModalOrLocal, ModalOrLocalDir, volume_registry
+from modal_or_local.fake_volume import FakeVolume
+from modal_or_local.modal_or_local_copy import copy_dir
+
+MOUNT_DIR = "/bench_mnt_dir"
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def make_tree(volume: FakeVolume, root: str, file_count: int, files_per_dir: int, fanout: int, file_size: int) -> List[str]:
+    """Fill volume with file_count files under root, files_per_dir to a directory, in a tree with fanout subdirectories per level.
+    Returns the relative (to root) paths of the files created"""
+    content = os.urandom(file_size)
+    relative_paths = []
+    dir_count = (file_count + files_per_dir - 1) // files_per_dir
+    for dir_index in range(dir_count):
+        # Spell the directory index in base fanout to get a balanced tree, e.g. d1/d4/d0
+        parts = []
+        n = dir_index
+        while True:
+            parts.append(f"d{n % fanout}")
+            n //= fanout
+            if n == 0:
+                break
+        dir_relative_path = "/".join(reversed(parts))
+        for file_index in range(min(files_per_dir, file_count - dir_index * files_per_dir)):
+            relative_path = f"{dir_relative_path}/f{file_index}.bin"
+            volume.put(f"{root}/{relative_path}", content)
+            relative_paths.append(relative_path)
+    return relative_paths
+
+
+def run(name: str, volumes: List[FakeVolume], fn: Callable[[], Any]) -> Dict[str, Any]:
+    """Time fn() and collect the RPCs it made on the given volumes"""
+    for volume in volumes:
+        volume.reset_counters()
+    start = time.perf_counter()
+    fn()
+    wall_seconds = time.perf_counter() - start
+    rpcs: Dict[str, int] = {}
+    for volume in volumes:
+        for rpc, count in volume.calls.items():
+            rpcs[rpc] = rpcs.get(rpc, 0) + count
+    result = {"wall_seconds": wall_seconds, "rpcs": rpcs, "rpc_total": sum(rpcs.values())}
+    print(f"  {name:<32} {wall_seconds:9.3f} s  {result['rpc_total']:>8} RPCs  {rpcs}")
+    return result
+
+
+def bench_tree(file_count: int, args: argparse.Namespace) -> Dict[str, Any]:
+    source_volume = FakeVolume(latency_seconds=args.latency_ms / 1000, bandwidth_bytes_per_second=args.bandwidth_mbps * 1e6 / 8)
+    destination_volume = FakeVolume(latency_seconds=args.latency_ms / 1000, bandwidth_bytes_per_second=args.bandwidth_mbps * 1e6 / 8)
+    volume_registry.register_volume("bench_source", source_volume)
+    volume_registry.register_volume("bench_destination", destination_volume)
+    source = ModalOrLocal(volume_name="bench_source", volume_mount_dir=MOUNT_DIR)
+    destination = ModalOrLocal(volume_name="bench_destination", volume_mount_dir=MOUNT_DIR)
+
+    relative_paths = make_tree(source_volume, "tree", file_count, args.files_per_dir, args.fanout, args.file_size)
+    tree_dir = f"{MOUNT_DIR}/tree"
+    print(f"{file_count} files in {len(source_volume._children)} directories, {args.latency_ms} ms latency, {args.bandwidth_mbps} Mbit/s")
+
+    # Copies are limited to a subtree so large trees finish in reasonable time
+    copy_subdir = Counter(path.split("/")[0] for path in relative_paths).most_common(1)[0][0]
+    source_subtree = ModalOrLocalDir(f"{tree_dir}/{copy_subdir}", modal_or_local=source)
+    destination_subtree = ModalOrLocalDir(f"{MOUNT_DIR}/copied", modal_or_local=destination)
+    sample = random.Random(0).sample(relative_paths, min(args.samples, len(relative_paths)))
+
+    results = {"file_count": file_count, "copied_subtree_files": sum(1 for p in relative_paths if p.startswith(copy_subdir + "/"))}
+    results["walk"] = run("walk", [source_volume], lambda: sum(1 for _ in source.walk(tree_dir)))
+    results["walk_parallel"] = run(
+        f"walk (workers={args.walk_workers})", [source_volume], lambda: sum(1 for _ in source.walk(tree_dir, workers=args.walk_workers))
+    )
+    results["walk_unordered"] = run(
+        "walk (unordered)", [source_volume], lambda: sum(1 for _ in source.walk(tree_dir, workers=args.walk_workers, ordered=False))
+    )
+    results["walk_one_listing"] = run("walk (prune=False)", [source_volume], lambda: sum(1 for _ in source.walk(tree_dir, prune=False)))
+    results["listdir"] = run("listdir (root)", [source_volume], lambda: source.listdir(tree_dir))
+    results["get_FileEntry"] = run(
+        f"get_FileEntry x{len(sample)}", [source_volume], lambda: [source.get_FileEntry(f"{tree_dir}/{p}") for p in sample]
+    )
+    results["copy_dir"] = run(
+        "copy_dir (subtree)",
+        [source_volume, destination_volume],
+        lambda: copy_dir(source, source_subtree.dir_full_path, destination, f"{MOUNT_DIR}/copy_dir_target"),
+    )
+    results["copy_changed_files_from"] = run(
+        "copy_changed_files_from (new)", [source_volume, destination_volume], lambda: destination_subtree.copy_changed_files_from(source_subtree)
+    )
+    results["copy_changed_files_from_unchanged"] = run(
+        "copy_changed_files_from (same)", [source_volume, destination_volume], lambda: destination_subtree.copy_changed_files_from(source_subtree)
+    )
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True, cwd=BENCHMARKS_DIR
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any]):
+    """Print wall time and RPC count changes against a baseline results file"""
+    print(f"\nCompared to {baseline.get('commit')} ({baseline.get('date')}):")
+    baseline_runs = {run["file_count"]: run for run in baseline.get("runs", [])}
+    for run in results["runs"]:
+        base = baseline_runs.get(run["file_count"])
+        if not base:
+            continue
+        for name, stats in run.items():
+            if not isinstance(stats, dict) or name not in base:
+                continue
+            before, after = base[name], stats
+            ratio = after["wall_seconds"] / before["wall_seconds"] if before["wall_seconds"] else float("nan")
+            print(
+                f"  {run['file_count']:>7} files {name:<34} {before['wall_seconds']:8.3f} s -> {after['wall_seconds']:8.3f} s ({ratio:5.2f}x)"
+                f"  RPCs {before['rpc_total']} -> {after['rpc_total']}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ModalOrLocal against a latency-injecting fake volume")
+    parser.add_argument("--files", type=int, nargs="+", default=[1000, 10000], help="Tree sizes to benchmark, e.g. 1000 10000 100000")
+    parser.add_argument("--files-per-dir", type=int, default=20)
+    parser.add_argument("--fanout", type=int, default=8, help="Subdirectories per directory level")
+    parser.add_argument("--file-size", type=int, default=1024)
+    parser.add_argument("--latency-ms", type=float, default=1.0, help="Simulated latency of every volume call")
+    parser.add_argument("--bandwidth-mbps", type=float, default=1000.0, help="Simulated bandwidth for file content")
+    parser.add_argument("--walk-workers", type=int, default=16, help="Concurrent listings for the parallel walks")
+    parser.add_argument("--samples", type=int, default=100, help="Number of files to get_FileEntry")
+    parser.add_argument("--output", default=None, help="Results json path, default benchmarks/results/<git commit>.json")
+    parser.add_argument("--compare", default=None, help="Earlier results json to compare against")
+    args = parser.parse_args()
+
+    results = {
+        "commit": git_commit(),
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "parameters": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "runs": [bench_tree(file_count, args) for file_count in args.files],
+    }
+
+    output = args.output or os.path.join(BENCHMARKS_DIR, "results", f"{results['commit']}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=4)
+    print(f"\nWrote {output}")
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
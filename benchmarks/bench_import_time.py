@@ -0,0 +1,75 @@
+# Measure the import time of 'from modal_or_local import ModalOrLocal' (which imports modal and the backends) with 'python -X importtime'
+# in a fresh interpreter, and fail if it exceeds a threshold. 'import modal_or_local' alone is nearly free since submodules are imported
+# lazily, so it is not what is timed. The modules taking longest are listed so a regression can be traced to the import that caused it.
+# Run with 'python benchmarks/bench_import_time.py [--threshold-ms 750] [--runs 5] [--top 15]'. Exits with status 1 on a regression.
+import argparse
+import os
+import re
+import subprocess
+import sys
+from statistics import median
+from typing import Dict, List, Tuple
+
+DEFAULT_STATEMENT = "from modal_or_local import ModalOrLocal"
+
+DEFAULT_THRESHOLD_MS = 750.0
+"""About twice the ~380 ms -X importtime reports for the default statement on a developer machine, ~280 ms of it importing modal"""
+
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)$")
+"""A line of -X importtime output: self and cumulative microseconds, then the module name indented by its nesting"""
+
+
+def import_times(statement: str) -> Tuple[float, Dict[str, Tuple[float, float]]]:
+    """Run the statement in a fresh interpreter with -X importtime. Returns the total milliseconds spent importing and the
+    (self, cumulative) milliseconds of each module imported"""
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [repo_dir, os.environ.get("PYTHONPATH")])))
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", statement], capture_output=True, text=True, env=env, check=True)
+
+    total_ms = 0.0
+    modules: Dict[str, Tuple[float, float]] = {}
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, module = match.groups()
+        modules[module] = (int(self_us) / 1000, int(cumulative_us) / 1000)
+        if len(indent) == 1:
+            # Imported by the statement itself rather than by another module, so not counted in anything else's cumulative time
+            total_ms += int(cumulative_us) / 1000
+    return total_ms, modules
+
+
+def slowest(runs: List[Dict[str, Tuple[float, float]]], top: int) -> List[Tuple[str, float, float]]:
+    """Return (module, median self ms, median cumulative ms) for the top modules by median self time across the runs"""
+    names = set().union(*runs)
+    medians = [
+        (name, median(run.get(name, (0.0, 0.0))[0] for run in runs), median(run.get(name, (0.0, 0.0))[1] for run in runs))
+        for name in names
+    ]
+    return sorted(medians, key=lambda m: m[1], reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import time benchmark for modal_or_local")
+    parser.add_argument("--statement", default=DEFAULT_STATEMENT)
+    parser.add_argument("--threshold-ms", type=float, default=DEFAULT_THRESHOLD_MS, help="Fail if the median import time exceeds this")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="Number of modules to list, slowest first by their own import time")
+    args = parser.parse_args()
+
+    totals, runs = zip(*(import_times(args.statement) for _ in range(args.runs)))
+    median_ms = median(totals)
+
+    print(f"{'self ms':>10} {'cumulative ms':>14}  module")
+    for module, self_ms, cumulative_ms in slowest(list(runs), args.top):
+        print(f"{self_ms:10.1f} {cumulative_ms:14.1f}  {module}")
+    print(f"{args.statement}: median {median_ms:.1f} ms over {args.runs} runs (threshold {args.threshold_ms} ms)")
+
+    if median_ms > args.threshold_ms:
+        print(f"Import time regression: {median_ms:.1f} ms > {args.threshold_ms} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
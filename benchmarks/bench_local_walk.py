@@ -0,0 +1,98 @@
+# Benchmark local/mounted filesystem metadata operations on a large tree: get_FileEntry() per file and walking with mtimes.
+# Run with e.g. 'python benchmarks/bench_local_walk.py --files 100000'
+# The tree is built once under --root (default a temp dir) and reused by later runs with the same parameters.
+# Compares against the previous implementations (Path.exists/is_file/is_dir and two stat() calls per lookup, os.walk plus
+# get_mtime() per file) which are reproduced below. Syscall counts matter most on the network filesystem behind a mounted volume.
+import argparse
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable
+
+from modal.volume import FileEntry, FileEntryType
+
+from modal_or_local import ModalOrLocal
+
+
+def make_tree(root: str, file_count: int, files_per_dir: int) -> str:
+    """Create file_count small files under root/tree_<file_count>, files_per_dir to a directory in a two level tree"""
+    tree_dir = os.path.join(root, f"tree_{file_count}_{files_per_dir}")
+    done_marker = os.path.join(tree_dir, ".complete")
+    if os.path.exists(done_marker):
+        return tree_dir
+    for index in range(file_count):
+        dir_index = index // files_per_dir
+        dir_path = os.path.join(tree_dir, f"d{dir_index // 100}", f"d{dir_index % 100}")
+        if index % files_per_dir == 0:
+            os.makedirs(dir_path, exist_ok=True)
+        with open(os.path.join(dir_path, f"f{index}.txt"), "w") as f:
+            f.write("x")
+    open(done_marker, "w").close()
+    return tree_dir
+
+
+def previous_get_FileEntry(full_path: str) -> FileEntry:
+    """get_FileEntry() for the local filesystem as it was: five syscalls per lookup"""
+    path = Path(full_path)
+    if not path.exists():
+        return None
+    entry_type = FileEntryType.FILE if path.is_file() else FileEntryType.DIRECTORY if path.is_dir() else None
+    path_to_return = str(path)
+    if path_to_return.startswith("/"):
+        path_to_return = path_to_return.replace("/", "", 1)
+    return FileEntry(path=path_to_return, type=entry_type, mtime=path.stat().st_mtime, size=path.stat().st_size)
+
+
+def timed(name: str, fn: Callable[[], int], baseline: float = None) -> float:
+    start = time.perf_counter()
+    count = fn()
+    elapsed = time.perf_counter() - start
+    speedup = f"  ({baseline / elapsed:5.2f}x faster)" if baseline else ""
+    print(f"  {name:<44} {elapsed:8.3f} s  {count:>8} entries{speedup}")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark local get_FileEntry and walk on a large tree")
+    parser.add_argument("--files", type=int, default=100000)
+    parser.add_argument("--files-per-dir", type=int, default=100)
+    parser.add_argument("--root", default=os.path.join(tempfile.gettempdir(), "modal_or_local_bench"))
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    tree_dir = make_tree(args.root, args.files, args.files_per_dir)
+    print(f"Tree of {args.files} files in {tree_dir} ready in {time.perf_counter() - start:.1f} s")
+
+    mocal = ModalOrLocal()
+    paths = [os.path.join(dirpath, f) for dirpath, _, files in os.walk(tree_dir) for f in files]
+
+    print("get_FileEntry for every file:")
+    baseline = timed("previous (exists/is_file/is_dir/stat x2)", lambda: sum(1 for p in paths if previous_get_FileEntry(p)))
+    timed("get_FileEntry (one stat)", lambda: sum(1 for p in paths if mocal.get_FileEntry(p)), baseline)
+
+    print("Walk with mtimes:")
+
+    def previous_walk_with_mtimes():
+        count = 0
+        for dirpath, dirs, files in os.walk(tree_dir):
+            for name in files + dirs:
+                previous_get_FileEntry(os.path.join(dirpath, name)).mtime
+                count += 1
+        return count
+
+    def walk_entries_with_mtimes():
+        count = 0
+        for dirpath, dir_entries, file_entries in mocal.walk_entries(tree_dir):
+            for entry in file_entries + dir_entries:
+                entry.mtime
+                count += 1
+        return count
+
+    baseline = timed("previous (os.walk + get_FileEntry per path)", previous_walk_with_mtimes)
+    timed("walk_entries (scandir, DirEntry stats)", walk_entries_with_mtimes, baseline)
+    timed("walk (names only, os.walk)", lambda: sum(len(d) + len(f) for _, d, f in mocal.walk(tree_dir)))
+
+
+if __name__ == "__main__":
+    main()
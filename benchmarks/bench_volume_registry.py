@@ -0,0 +1,57 @@
+"""
+Measure the per-instance cost of ModalOrLocal/ModalOrLocalDir for a volume and the latency of the first volume operation.
+Run with 'python benchmarks/bench_volume_registry.py' (per-instance cost only, no Modal account needed)
+or 'python benchmarks/bench_volume_registry.py --volume-name my_volume' to also time the first operation with and without prewarming.
+"""
+
+import argparse
+import time
+
+from modal_or_local import ModalOrLocal, ModalOrLocalDir, volume_registry
+
+
+def time_instances(volume_name: str, count: int) -> float:
+    """Return the mean seconds to construct a ModalOrLocalDir (and its ModalOrLocal) for the volume"""
+    start = time.perf_counter()
+    for i in range(count):
+        ModalOrLocalDir(
+            dir_full_path=f"/bench_mnt_dir/dir_{i}",
+            volume_name=volume_name,
+            volume_mount_dir="/bench_mnt_dir",
+        )
+    return (time.perf_counter() - start) / count
+
+
+def time_first_operation(volume_name: str, prewarm: bool, prewarm_head_start: float) -> float:
+    """Return the seconds taken by the first listdir on a fresh handle for the volume"""
+    volume_registry.forget_volume(volume_name)
+    mocal = ModalOrLocal(
+        volume_name=volume_name, volume_mount_dir="/bench_mnt_dir", prewarm=prewarm
+    )
+    if prewarm:
+        # Stand-in for the work a program does between construction and first use
+        time.sleep(prewarm_head_start)
+    start = time.perf_counter()
+    mocal.listdir("/bench_mnt_dir")
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--volume-name", default=None, help="Existing (or to be created) volume to time the first operation against")
+    parser.add_argument("--instances", type=int, default=10000)
+    parser.add_argument("--prewarm-head-start", type=float, default=1.0, help="Seconds between construction and first use when prewarming")
+    args = parser.parse_args()
+
+    per_instance = time_instances(args.volume_name or "bench_volume_registry", args.instances)
+    print(f"ModalOrLocalDir construction: {per_instance * 1e6:.1f} us per instance over {args.instances} instances")
+
+    if args.volume_name:
+        cold = time_first_operation(args.volume_name, prewarm=False, prewarm_head_start=0)
+        warm = time_first_operation(args.volume_name, prewarm=True, prewarm_head_start=args.prewarm_head_start)
+        print(f"First listdir without prewarm: {cold * 1000:.1f} ms")
+        print(f"First listdir with prewarm:    {warm * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,38 @@
-from .logging_config import LOGGING_CONFIG
-from .modal_image_prep import setup_image
-from .modal_or_local import ModalOrLocal
-from .modal_or_local_dir import ModalOrLocalDir
+# Submodules are imported on first attribute access (PEP 562) so 'import modal_or_local' does not import modal
+# See benchmarks/bench_import_time.py
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .logging_config import LOGGING_CONFIG
+    from .modal_image_prep import setup_image
+    from .modal_or_local import ModalOrLocal
+    from .modal_or_local_dir import ModalOrLocalDir
+
+_LAZY_ATTRIBUTES = {
+    "LOGGING_CONFIG": ".logging_config",
+    "ModalOrLocal": ".modal_or_local",
+    "ModalOrLocalDir": ".modal_or_local_dir",
+    "setup_image": ".modal_image_prep",
+}
 
 __all__ = [
-    LOGGING_CONFIG,
-    ModalOrLocal,
-    ModalOrLocalDir,
-    setup_image,
+    "LOGGING_CONFIG",
+    "ModalOrLocal",
+    "ModalOrLocalDir",
+    "setup_image",
 ]
+
+
+def __getattr__(name: str):
+    module_name = _LAZY_ATTRIBUTES.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    from importlib import import_module
+
+    value = getattr(import_module(module_name, __name__), name)
+    globals()[name] = value  # Later lookups skip __getattr__
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,762 @@
+"""
+Storage backends behind ModalOrLocal. Each backend implements the same small protocol (stat, list, open_read, open_write, remove, batch,
+create_directory) for one place files can live:
+
+    LocalFSBackend        the local filesystem
+    MountedVolumeBackend  a modal volume mounted into the container (running remotely)
+    ModalVolumeBackend    a modal volume used through the modal API (running locally)
+    InMemoryBackend       a dict in this process, for tests and benchmarks without Modal
+
+ModalOrLocal picks one with choose_backend() when it is constructed, or uses the one passed as ModalOrLocal(backend=...).
+All paths given to a backend are full paths, including the volume mount dir where there is one.
+"""
+
+import os
+import stat as stat_module
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from functools import partial
+from io import BytesIO
+from pathlib import Path
+from shutil import rmtree
+from tempfile import SpooledTemporaryFile
+from typing import Any, BinaryIO, ContextManager, Dict, Generator, Iterator, List, Optional, Set, Tuple, Union, TYPE_CHECKING
+
+import modal
+from grpclib import GRPCError, Status
+from modal.volume import FileEntry, FileEntryType
+
+from modal_or_local.parallel_walk import parallel_walk
+from modal_or_local.streams import open_chunk_reader
+
+if TYPE_CHECKING:
+    from modal_or_local import ModalOrLocal
+    from modal_or_local.concurrency import ConcurrencyController
+
+
+SourceFile = Union[str, os.PathLike, BinaryIO]
+"""What Batch.put_file() accepts: a local file path or a binary file-like object"""
+
+
+class StorageBackend(ABC):
+    """Base class for the storage operations ModalOrLocal delegates to.
+    Subclasses implement stat, list, open_read, open_write, remove, batch and create_directory; the rest have defaults built on those
+    which subclasses override where they can do better."""
+
+    name = "backend"
+    """Reported by ModalOrLocal.backend_branch() and used to label metrics"""
+    remote = False
+    """True if operations are network round trips (the volume API), so reads are worth caching and writes worth batching"""
+    needs_commit = False
+    """True if writes only become visible elsewhere once commit() is called (a mounted volume), see modal_or_local.commit_coalescer"""
+
+    def __str__(self):
+        return type(self).__name__ + "()"
+
+    @abstractmethod
+    def stat(self, full_path: str) -> Optional[FileEntry]:
+        """Return a FileEntry for the given path, or None if it does not exist. The FileEntry path is the full path without the leading slash"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def list(self, dir_full_path: str) -> List[FileEntry]:
+        """Return FileEntries (see stat()) for the entries of the given directory, not recursive"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def open_read(self, full_path: str) -> ContextManager[BinaryIO]:
+        """Context manager giving a binary file-like object to stream the content of the given file"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def open_write(self, full_path: str, force: bool = True, max_memory_bytes: Optional[int] = None) -> ContextManager[BinaryIO]:
+        """Context manager giving a binary file-like object to write the given file, creating parent directories as needed.
+        The content may only be stored when the context exits; until then at most max_memory_bytes of it (if given) are held in memory."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def remove(self, full_path: str, dne_ok: bool = False):
+        """Remove the given file or directory (recursively) without first checking that it exists.
+        Raises RuntimeError if the path does not exist, unless dne_ok is True."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def batch(self, force: bool = True) -> ContextManager[Any]:
+        """Context manager giving an object with put_file(source, full_path) to write many files at once (source is a local file path or a
+        binary file-like object). Writes may be deferred until the context exits."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def create_directory(self, dir_full_path: str):
+        """Create the given directory and any missing parents. Does nothing if it already exists"""
+        raise NotImplementedError
+
+    def list_recursive(self, dir_full_path: str) -> Iterator[FileEntry]:
+        """Yield FileEntries for everything under the given directory, at any depth"""
+        for entry in self.list(dir_full_path):
+            yield entry
+            if entry.type == FileEntryType.DIRECTORY:
+                # Joined onto the path given rather than taken from entry.path, which is made relative to /
+                yield from self.list_recursive(os.path.join(dir_full_path, os.path.basename(entry.path)))
+
+    def list_names(self, dir_full_path: str) -> List[str]:
+        """Return the names of the entries of the given directory"""
+        return [os.path.basename(entry.path) for entry in self.list(dir_full_path)]
+
+    def read(self, full_path: str) -> bytes:
+        """Return the whole content of the given file"""
+        with self.open_read(full_path) as f:
+            return f.read()
+
+    def read_range(self, full_path: str, offset: int, length: int) -> bytes:
+        """Return up to length bytes of the given file starting at offset"""
+        with self.open_read(full_path) as f:
+            if f.seekable():
+                f.seek(offset)
+            else:
+                while offset > 0:
+                    skipped = len(f.read(min(offset, 1024 * 1024)))
+                    if not skipped:
+                        return b""
+                    offset -= skipped
+            return f.read(length)
+
+    def write(self, full_path: str, content: Any, force: bool = True):
+        """Write the given bytes-like content to a file, creating parent directories as needed"""
+        with self.open_write(full_path, force=force) as f:
+            f.write(content)
+
+    def local_path(self, full_path: str) -> Optional[str]:
+        """Return a path to the file on this machine's filesystem (for mmap, np.load, ...) or None if it is not directly accessible"""
+        return None
+
+    def commit(self):
+        """Make the writes so far visible elsewhere, for backends that need it (see needs_commit)"""
+
+    def reload(self):
+        """Pick up the writes committed elsewhere, for backends that need it (see needs_commit)"""
+
+    def walk_entries(
+        self,
+        dir_full_path: str,
+        workers: int = 1,
+        ordered: bool = True,
+        prune: bool = True,
+        controller: Optional["ConcurrencyController"] = None,
+    ) -> Generator[Tuple[str, List[FileEntry], List[FileEntry]], None, None]:
+        """Like walk() but with FileEntries (see stat()) for the directories and files, so their sizes and mtimes need no further calls"""
+        yield from self._walk(dir_full_path, True, workers, ordered, prune, controller)
+
+    def walk(
+        self,
+        dir_full_path: str,
+        workers: int = 1,
+        ordered: bool = True,
+        prune: bool = True,
+        controller: Optional["ConcurrencyController"] = None,
+    ) -> Generator[Tuple[str, List[str], List[str]], None, None]:
+        """os.walk() style (dirpath, dirnames, filenames) tuples for the given directory, depth first.
+        With workers > 1 up to that many directories are listed at once (see modal_or_local.parallel_walk), or as many as controller
+        allows if one is given; if not ordered each directory is yielded as soon as it has been listed rather than in depth first order.
+        If prune is False the caller will not remove names from dirnames to skip them, so a remote backend walks from one recursive listing."""
+        yield from self._walk(dir_full_path, False, workers, ordered, prune, controller)
+
+    def _walk(
+        self,
+        dir_full_path: str,
+        entries: bool,
+        workers: int,
+        ordered: bool,
+        prune: bool,
+        controller: Optional["ConcurrencyController"] = None,
+    ) -> Generator[Tuple[str, List, List], None, None]:
+        if not prune and self.remote:
+            yield from self._walk_from_listing(dir_full_path, entries)
+            return
+
+        list_dir = partial(self._scan, entries=entries)
+        if workers > 1:
+            if controller:
+                yield from parallel_walk(
+                    partial(controller.call, "listdir", list_dir), dir_full_path, workers=controller.threads(workers), ordered=ordered
+                )
+            else:
+                yield from parallel_walk(list_dir, dir_full_path, workers=workers, ordered=ordered)
+            return
+
+        pending = [dir_full_path]
+        while pending:
+            top = pending.pop()
+            listing = list_dir(top)
+            if listing is None:
+                continue
+            dirs, files, subdirectories = listing
+            yield (top, dirs, files)
+            # Like os.walk(), directories the caller removed from dirs are not descended into
+            kept = {d if isinstance(d, str) else os.path.basename(d.path) for d in dirs}
+            pending.extend(reversed([s for s in subdirectories if os.path.basename(s) in kept]))
+
+    def _walk_from_listing(self, dir_full_path: str, entries: bool) -> Generator[Tuple[str, List, List], None, None]:
+        """Walk in the usual depth first order from a single list_recursive() of dir_full_path, grouping the entries by directory"""
+        prefix = _norm(dir_full_path).rstrip("/") + "/"
+        listings: Dict[str, Tuple[List, List]] = {"": ([], [])}  # directory relative to dir_full_path -> (dirs, files)
+        for entry in self.list_recursive(dir_full_path):
+            relative_path = ("/" + entry.path)[len(prefix) :]
+            parent, _, name = relative_path.rpartition("/")
+            dirs, files = listings.setdefault(parent, ([], []))
+            if entry.type == FileEntryType.DIRECTORY:
+                dirs.append(entry if entries else name)
+                listings.setdefault(relative_path, ([], []))
+            else:
+                files.append(entry if entries else name)
+
+        pending = [""]
+        while pending:
+            relative_dir = pending.pop()
+            dirs, files = listings[relative_dir]
+            yield (os.path.join(dir_full_path, relative_dir) if relative_dir else dir_full_path, dirs, files)
+            names = sorted(d if isinstance(d, str) else os.path.basename(d.path) for d in dirs)
+            pending.extend(reversed([os.path.join(relative_dir, name) for name in names]))
+
+    def _scan(self, dir_full_path: str, entries: bool) -> Optional[Tuple[List, List, List[str]]]:
+        """List one directory for walk()/walk_entries(): (dirs, files, full paths of the subdirectories to descend into) with FileEntries
+        if entries is True and names otherwise, or None to skip the directory"""
+        dirs = []
+        files = []
+        subdirectories = []
+        for entry in self.list(dir_full_path):
+            name = os.path.basename(entry.path)
+            if entry.type == FileEntryType.DIRECTORY:
+                dirs.append(entry if entries else name)
+                subdirectories.append(os.path.join(dir_full_path, name))
+            else:
+                files.append(entry if entries else name)
+        return dirs, files, sorted(subdirectories)
+
+
+class LocalFSBackend(StorageBackend):
+    """Files on the local filesystem"""
+
+    name = "local"
+
+    def stat(self, full_path: str) -> Optional[FileEntry]:
+        # One stat() call - on the network filesystem behind a mounted volume each syscall can be a round trip
+        try:
+            st = os.stat(full_path)
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        return _entry_from_stat(_clean_path(full_path), st)
+
+    def list(self, dir_full_path: str) -> List[FileEntry]:
+        with os.scandir(dir_full_path) as it:
+            entries = [_entry_from_dir_entry(dir_entry) for dir_entry in it]
+        return sorted(entries, key=lambda e: e.path)
+
+    def _scan(self, dir_full_path: str, entries: bool) -> Optional[Tuple[List, List, List[str]]]:
+        # In scandir order like os.walk(), taking the metadata from the DirEntry stat results. Symlinked directories are listed but not
+        # descended into, and directories that cannot be read are skipped, as os.walk() does by default
+        try:
+            it = os.scandir(dir_full_path)
+        except OSError:
+            return None
+        dirs = []
+        files = []
+        subdirectories = []
+        with it:
+            for dir_entry in it:
+                try:
+                    is_dir = dir_entry.is_dir()
+                except OSError:
+                    is_dir = False
+                item = _entry_from_dir_entry(dir_entry) if entries else dir_entry.name
+                if is_dir:
+                    dirs.append(item)
+                    if not dir_entry.is_symlink():
+                        subdirectories.append(dir_entry.path)
+                else:
+                    files.append(item)
+        return dirs, files, subdirectories
+
+    def list_recursive(self, dir_full_path: str) -> Iterator[FileEntry]:
+        # As _scan(), symlinked directories are listed but not descended into, so a symlink loop cannot recurse forever
+        with os.scandir(dir_full_path) as it:
+            dir_entries = sorted(it, key=lambda dir_entry: dir_entry.path)
+        for dir_entry in dir_entries:
+            entry = _entry_from_dir_entry(dir_entry)
+            yield entry
+            if entry.type == FileEntryType.DIRECTORY and not dir_entry.is_symlink():
+                yield from self.list_recursive(dir_entry.path)
+
+    def list_names(self, dir_full_path: str) -> List[str]:
+        return sorted(os.listdir(dir_full_path))
+
+    @contextmanager
+    def open_read(self, full_path: str) -> Iterator[BinaryIO]:
+        with open(full_path, "rb") as f:
+            yield f
+
+    @contextmanager
+    def open_write(self, full_path: str, force: bool = True, max_memory_bytes: Optional[int] = None) -> Iterator[BinaryIO]:
+        # Written to a temp file next to the target and renamed over it on a clean exit, so a write that fails part way (e.g. a copy whose
+        # source read fails or does not check out) leaves any existing file as it was
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        temp_path = os.path.join(os.path.dirname(full_path), f".{os.path.basename(full_path)}.{uuid.uuid4().hex}.tmp")
+        try:
+            with open(temp_path, "xb") as f:
+                yield f
+            os.replace(temp_path, full_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def remove(self, full_path: str, dne_ok: bool = False):
+        try:
+            if os.path.isdir(full_path) and not os.path.islink(full_path):
+                rmtree(full_path)
+            else:
+                os.remove(full_path)
+        except FileNotFoundError:
+            if not dne_ok:
+                raise RuntimeError(f"Cannot remove file that does not exist: '{full_path}'")
+
+    @contextmanager
+    def batch(self, force: bool = True) -> Iterator["_DirectBatch"]:
+        yield _DirectBatch(self)
+
+    def create_directory(self, dir_full_path: str):
+        os.makedirs(dir_full_path, exist_ok=True)
+
+    def read(self, full_path: str) -> bytes:
+        with open(full_path, "rb") as f:
+            return f.read()
+
+    def read_range(self, full_path: str, offset: int, length: int) -> bytes:
+        with open(full_path, "rb") as f:
+            return os.pread(f.fileno(), length, offset)
+
+    def write(self, full_path: str, content: Any, force: bool = True):
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, "wb") as f:
+            f.write(content)
+
+    def local_path(self, full_path: str) -> Optional[str]:
+        return full_path
+
+    def walk(
+        self,
+        dir_full_path: str,
+        workers: int = 1,
+        ordered: bool = True,
+        prune: bool = True,
+        controller: Optional["ConcurrencyController"] = None,
+    ) -> Generator[Tuple[str, List[str], List[str]], None, None]:
+        if workers > 1:
+            yield from super().walk(dir_full_path, workers=workers, ordered=ordered, prune=prune, controller=controller)
+        else:
+            yield from os.walk(dir_full_path)
+
+
+class MountedVolumeBackend(LocalFSBackend):
+    """A modal volume mounted into the container at mocal.volume_mount_dir (i.e. running remotely), used through the filesystem"""
+
+    name = "mounted_volume"
+    needs_commit = True
+
+    def __init__(self, mocal: "ModalOrLocal"):
+        self.mocal = mocal
+
+    def __str__(self):
+        return type(self).__name__ + f"(volume_name={self.mocal.volume_name}, volume_mount_dir={self.mocal.volume_mount_dir})"
+
+    def commit(self):
+        self.mocal._rpc_volume.commit()
+
+    def reload(self):
+        self.mocal._rpc_volume.reload()
+
+
+class ModalVolumeBackend(StorageBackend):
+    """A modal volume used through the modal API (i.e. running locally). Every operation is one or more RPCs through mocal._rpc_volume"""
+
+    name = "volume_api"
+    remote = True
+
+    PLACEHOLDER_FILENAME = "tmp.txt"
+    """Volumes cannot hold empty directories, so create_directory() uploads a placeholder file of this name and removes it again"""
+
+    def __init__(self, mocal: "ModalOrLocal"):
+        self.mocal = mocal
+
+    def __str__(self):
+        return type(self).__name__ + f"(volume_name={self.mocal.volume_name}, volume_mount_dir={self.mocal.volume_mount_dir})"
+
+    def volume_path(self, full_path: str) -> str:
+        """Return the path as the modal volume API expects it: relative to the volume root with no leading slash ("/" for the root)"""
+        prepped_path = self.mocal.path_without_volume_mount_dir(full_path, volume_mount_dir_required=True)
+        if prepped_path != "/" and prepped_path.startswith("/"):
+            prepped_path = prepped_path.replace("/", "", 1)
+        return prepped_path
+
+    def _mount_relative_path(self, full_path: str) -> str:
+        """Return the path relative to the volume root with a leading slash, as used for iterdir, remove_file and batch uploads"""
+        return os.path.normpath(
+            os.path.join("/", self.mocal.path_without_volume_mount_dir(full_path, volume_mount_dir_required=True))
+        )
+
+    def _entry_with_mount_dir(self, entry: FileEntry) -> FileEntry:
+        """Add the volume mount directory back onto the start of the path of an entry returned by the volume (note FileEntry is immutable)"""
+        return FileEntry(
+            path=os.path.join(self.mocal.volume_mount_dir.replace("/", "", 1), entry.path),
+            type=entry.type,
+            mtime=entry.mtime,
+            size=entry.size,
+        )
+
+    def stat(self, full_path: str) -> Optional[FileEntry]:
+        prepped_path = self.volume_path(full_path)
+
+        # Modal does not make getting a FileEntry for '/' available, so return a placeholder
+        if prepped_path == "/":
+            return FileEntry(
+                path=self.mocal.volume_mount_dir.replace("/", "", 1),
+                type=FileEntryType.DIRECTORY,
+                mtime=0,
+                size=0,
+            )
+
+        # If the full path is a file, volume.listdir() will return a single FileEntry
+        # Its also possible that there is a single file in the full_path directory, so we double check the path
+        try:
+            entries = self.mocal._rpc_volume.listdir(prepped_path)
+        except Exception as e:
+            if is_not_found_error(e):
+                # The path does not exist on the volume
+                return None
+            raise
+
+        if len(entries) == 1 and entries[0].path == prepped_path:
+            return self._entry_with_mount_dir(entries[0])
+
+        # Presuming full_path is a directory, list its parent to get the FileEntry
+        parent_dir = str(Path(prepped_path).parent)
+        if parent_dir == ".":
+            parent_dir = "/"
+        for entry in self.mocal._rpc_volume.listdir(parent_dir):
+            if entry.path == prepped_path:
+                return self._entry_with_mount_dir(entry)
+
+        # Did not find a file or directory for the given path
+        return None
+
+    def list(self, dir_full_path: str) -> List[FileEntry]:
+        return [
+            self._entry_with_mount_dir(entry)
+            for entry in self.mocal._rpc_volume.iterdir(self._mount_relative_path(dir_full_path), recursive=False)
+        ]
+
+    def list_recursive(self, dir_full_path: str) -> Iterator[FileEntry]:
+        # A single streamed listing rather than one per directory
+        for entry in self.mocal._rpc_volume.iterdir(self._mount_relative_path(dir_full_path), recursive=True):
+            yield self._entry_with_mount_dir(entry)
+
+    def list_names(self, dir_full_path: str) -> List[str]:
+        return [
+            os.path.basename(entry.path)
+            for entry in self.mocal._rpc_volume.iterdir(self._mount_relative_path(dir_full_path), recursive=False)
+        ]
+
+    @contextmanager
+    def open_read(self, full_path: str) -> Iterator[BinaryIO]:
+        # Stream the chunks from volume.read_file() rather than joining them into one bytes object
+        with open_chunk_reader(self.mocal._rpc_volume.read_file(path=self.volume_path(full_path))) as f:
+            yield f
+
+    @contextmanager
+    def open_write(self, full_path: str, force: bool = True, max_memory_bytes: Optional[int] = None) -> Iterator[BinaryIO]:
+        # batch.put_file() needs a seekable file, so spool to memory (or to disk once large) and upload on exit
+        with SpooledTemporaryFile(max_size=max_memory_bytes or self.mocal.SPOOL_MAX_MEMORY_BYTES) as f:
+            yield f
+            f.seek(0)
+            with self.mocal._rpc_volume.batch_upload(force=force) as batch:
+                batch.put_file(f, self._mount_relative_path(full_path))
+
+    def remove(self, full_path: str, dne_ok: bool = False):
+        try:
+            self.mocal._rpc_volume.remove_file(self._mount_relative_path(full_path), recursive=True)
+        except Exception as e:
+            if not is_not_found_error(e):
+                raise
+            if not dne_ok:
+                raise RuntimeError(f"Cannot remove file that does not exist: '{full_path}'") from e
+
+    @contextmanager
+    def batch(self, force: bool = True) -> Iterator["_VolumeBatch"]:
+        with self.mocal._rpc_volume.batch_upload(force=force) as batch:
+            yield _VolumeBatch(self, batch)
+
+    def create_directory(self, dir_full_path: str):
+        placeholder = os.path.join(dir_full_path, self.PLACEHOLDER_FILENAME)
+        with self.mocal._rpc_volume.batch_upload(force=True) as batch:
+            batch.put_file(
+                BytesIO(b"This is a temp file for modal.batch_upload to create a directory - it can be safely removed\n"),
+                self._mount_relative_path(placeholder),
+            )
+        self.remove(placeholder)
+
+    def read(self, full_path: str) -> bytes:
+        return b"".join(self.mocal._rpc_volume.read_file(path=self.volume_path(full_path)))
+
+    def read_range(self, full_path: str, offset: int, length: int) -> bytes:
+        # Chunks before the range are skipped without being kept and the download is stopped as soon as the range has been delivered
+        end = offset + length
+        parts = []
+        position = 0  # Offset in the file of the start of the current chunk
+        chunks = self.mocal._rpc_volume.read_file(path=self.volume_path(full_path))
+        try:
+            for chunk in chunks:
+                chunk_end = position + len(chunk)
+                if chunk_end > offset:
+                    parts.append(chunk[max(offset - position, 0) : end - position])
+                position = chunk_end
+                if position >= end:
+                    break
+        finally:
+            # Stop the remaining chunks from being fetched
+            close = getattr(chunks, "close", None)
+            if close:
+                close()
+        return b"".join(parts)
+
+    def write(self, full_path: str, content: Any, force: bool = True):
+        # Prior to https://github.com/modal-labs/modal-client/pull/1962 (modal 0.63-ish) this would fail on files bigger than 4MB
+        with self.mocal._rpc_volume.batch_upload(force=force) as batch:
+            batch.put_file(BytesIO(content), self._mount_relative_path(full_path))
+
+    def _scan(self, dir_full_path: str, entries: bool) -> Optional[Tuple[List, List, List[str]]]:
+        # One iterdir per directory, using the volume's entries directly for names rather than converting them as list() does
+        dirs = []
+        files = []
+        subdirectories = []
+        for entry in self.mocal._rpc_volume.iterdir(self._mount_relative_path(dir_full_path), recursive=False):
+            name = os.path.basename(entry.path)
+            item = self._entry_with_mount_dir(entry) if entries else name
+            if entry.type == FileEntryType.DIRECTORY:
+                dirs.append(item)
+                subdirectories.append(os.path.join(dir_full_path, name))
+            else:
+                files.append(item)
+        return dirs, files, sorted(subdirectories)
+
+
+class InMemoryBackend(StorageBackend):
+    """Files held in a dict in this process - for tests and benchmarks that should not touch Modal or the disk.
+    Behaves like a volume: writes with force=False fail with FileExistsError if the file exists, and writes create parent directories."""
+
+    name = "in_memory"
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._files: Dict[str, bytes] = {}
+        self._mtimes: Dict[str, float] = {"/": time.time()}
+        self._children: Dict[str, Set[str]] = {"/": set()}  # directory path -> names of its entries
+
+    def __str__(self):
+        return type(self).__name__ + f"(files={len(self._files)}, directories={len(self._children)})"
+
+    def stat(self, full_path: str) -> Optional[FileEntry]:
+        path = _norm(full_path)
+        with self._lock:
+            if path in self._files:
+                return FileEntry(path=path[1:], type=FileEntryType.FILE, mtime=self._mtimes[path], size=len(self._files[path]))
+            if path in self._children:
+                return FileEntry(path=path[1:], type=FileEntryType.DIRECTORY, mtime=self._mtimes[path], size=0)
+        return None
+
+    def list(self, dir_full_path: str) -> List[FileEntry]:
+        path = _norm(dir_full_path)
+        return [self.stat(os.path.join(path, name)) for name in self.list_names(path)]
+
+    def list_names(self, dir_full_path: str) -> List[str]:
+        path = _norm(dir_full_path)
+        with self._lock:
+            if path not in self._children:
+                raise FileNotFoundError(f"No such directory: '{dir_full_path}'")
+            return sorted(self._children[path])
+
+    @contextmanager
+    def open_read(self, full_path: str) -> Iterator[BinaryIO]:
+        with BytesIO(self.read(full_path)) as f:
+            yield f
+
+    @contextmanager
+    def open_write(self, full_path: str, force: bool = True, max_memory_bytes: Optional[int] = None) -> Iterator[BinaryIO]:
+        # Everything is kept in memory anyway, so max_memory_bytes does not apply
+        with BytesIO() as f:
+            yield f
+            self.write(full_path, f.getbuffer(), force=force)
+
+    def remove(self, full_path: str, dne_ok: bool = False):
+        path = _norm(full_path)
+        with self._lock:
+            if path not in self._files and path not in self._children:
+                if not dne_ok:
+                    raise RuntimeError(f"Cannot remove file that does not exist: '{full_path}'")
+                return
+            if path == "/":
+                self._files.clear()
+                self._children = {"/": set()}
+                self._mtimes = {"/": time.time()}
+                return
+            for child_path in [p for p in self._files if p.startswith(path + "/")]:
+                del self._files[child_path]
+                del self._mtimes[child_path]
+            for child_dir in [d for d in self._children if d.startswith(path + "/")]:
+                del self._children[child_dir]
+                del self._mtimes[child_dir]
+            parent, name = os.path.split(path)
+            self._children[parent].discard(name)
+            self._files.pop(path, None)
+            self._children.pop(path, None)
+            self._mtimes.pop(path, None)
+
+    @contextmanager
+    def batch(self, force: bool = True) -> Iterator["_DirectBatch"]:
+        # Like a volume batch_upload(), nothing is written if the block raises
+        batch = _DirectBatch(self, deferred=True)
+        yield batch
+        with self._lock:
+            if not force:
+                for path, _ in batch.pending:
+                    if _norm(path) in self._files:
+                        raise FileExistsError(f"{path} already exists (use force=True to overwrite)")
+            for path, content in batch.pending:
+                self.write(path, content)
+
+    def create_directory(self, dir_full_path: str):
+        with self._lock:
+            self._ensure_directory(_norm(dir_full_path), time.time())
+
+    def read(self, full_path: str) -> bytes:
+        with self._lock:
+            content = self._files.get(_norm(full_path))
+        if content is None:
+            raise FileNotFoundError(f"No such file: '{full_path}'")
+        return content
+
+    def read_range(self, full_path: str, offset: int, length: int) -> bytes:
+        return self.read(full_path)[offset : offset + length]
+
+    def write(self, full_path: str, content: Any, force: bool = True):
+        path = _norm(full_path)
+        content = bytes(content)
+        with self._lock:
+            if path in self._children:
+                raise IsADirectoryError(f"{full_path} is a directory")
+            if not force and path in self._files:
+                raise FileExistsError(f"{full_path} already exists (use force=True to overwrite)")
+            now = time.time()
+            parent, name = os.path.split(path)
+            self._ensure_directory(parent, now)
+            self._children[parent].add(name)
+            self._files[path] = content
+            self._mtimes[path] = now
+
+    def _ensure_directory(self, path: str, mtime: float):
+        if path in self._files:
+            raise NotADirectoryError(f"{path} is a file")
+        if path in self._children:
+            self._mtimes[path] = mtime
+            return
+        parent, name = os.path.split(path)
+        self._ensure_directory(parent, mtime)
+        self._children[parent].add(name)
+        self._children[path] = set()
+        self._mtimes[path] = mtime
+
+
+class _DirectBatch:
+    """Batch for backends without a batch API: put_file() writes through backend.write() immediately, or on exit if deferred"""
+
+    def __init__(self, backend: StorageBackend, deferred: bool = False):
+        self.backend = backend
+        self.deferred = deferred
+        self.pending: List[Tuple[str, bytes]] = []
+
+    def put_file(self, source: SourceFile, full_path: str):
+        if isinstance(source, (str, os.PathLike)):
+            with open(source, "rb") as f:
+                content = f.read()
+        else:
+            content = source.read()
+        if self.deferred:
+            self.pending.append((full_path, content))
+        else:
+            self.backend.write(full_path, content)
+
+
+class _VolumeBatch:
+    """Wraps a volume batch_upload() so put_file() takes full paths like the other backends"""
+
+    def __init__(self, backend: ModalVolumeBackend, batch: Any):
+        self.backend = backend
+        self._batch = batch
+
+    def put_file(self, source: SourceFile, full_path: str):
+        self._batch.put_file(source, self.backend._mount_relative_path(full_path))
+
+
+def _entry_from_stat(path: str, st: os.stat_result) -> FileEntry:
+    """FileEntry for a local path (made relative to / like the volume's paths) from its stat result"""
+    if path.startswith("/"):
+        path = path.replace("/", "", 1)
+    entry_type = (
+        FileEntryType.FILE
+        if stat_module.S_ISREG(st.st_mode)
+        else FileEntryType.DIRECTORY
+        if stat_module.S_ISDIR(st.st_mode)
+        else None
+    )
+    return FileEntry(path=path, type=entry_type, mtime=st.st_mtime, size=st.st_size)
+
+
+def _clean_path(path: str) -> str:
+    """str(Path(path)) - drops repeated slashes, '.' components and a trailing slash - without building a Path for the usual clean path"""
+    if "//" in path or "/./" in path or path.startswith("./") or path.endswith(("/", "/.")):
+        return str(Path(path))
+    return path
+
+
+def _entry_from_dir_entry(dir_entry: os.DirEntry) -> FileEntry:
+    try:
+        st = dir_entry.stat()
+    except OSError:
+        # e.g. a broken symlink
+        st = dir_entry.stat(follow_symlinks=False)
+    return _entry_from_stat(dir_entry.path, st)
+
+
+def choose_backend(mocal: "ModalOrLocal") -> StorageBackend:
+    """Return the backend for a ModalOrLocal: the local filesystem without a volume, the volume API when running locally,
+    and the mounted volume when running remotely"""
+    if not mocal.volume_name:
+        return LocalFSBackend()
+    if modal.is_local():
+        return ModalVolumeBackend(mocal)
+    return MountedVolumeBackend(mocal)
+
+
+def is_not_found_error(e: Exception) -> bool:
+    """Return true if the exception raised by a modal volume call means the path was not found"""
+    if isinstance(e, GRPCError):
+        return e.status == Status.NOT_FOUND
+    if isinstance(e, FileNotFoundError):
+        return True
+    return isinstance(e, modal.exception.NotFoundError)
+
+
+def _norm(full_path: str) -> str:
+    return os.path.normpath(os.path.join("/", full_path))
@@ -0,0 +1,238 @@
+"""
+Write-behind batching for ModalOrLocal. Use via ModalOrLocal.batch():
+
+    with mocal.batch() as b:
+        for i in range(1000):
+            b.write_json_file(f"/volume_mnt_dir/out/{i}.json", {"i": i})
+
+Writes, directory creations and removals made through the session are buffered and applied when the with block exits,
+with all uploads going through as few volume.batch_upload() calls as possible.
+"""
+
+import json
+import os
+import shutil
+import uuid
+from io import BytesIO
+from tempfile import mkdtemp
+from typing import Any, Dict, List, Optional, Set, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from modal_or_local import ModalOrLocal
+
+
+class _PendingWrite:
+    """Content waiting to be uploaded, held in memory or spilled to a local temp file"""
+
+    def __init__(self, force: bool, content: Optional[bytes] = None, spill_path: Optional[str] = None):
+        self.force = force
+        self.content = content
+        self.spill_path = spill_path
+
+    def read(self) -> bytes:
+        if self.content is not None:
+            return self.content
+        with open(self.spill_path, "rb") as f:
+            return f.read()
+
+
+class BatchSession:
+    """Buffers writes/creates/removes made through a ModalOrLocal and flushes them together on exit.
+    When the backend is not remote (local filesystem, or a mounted volume while running remotely) operations are applied immediately, and
+    on a mounted volume committed together by flush() (see ModalOrLocal.flush()).
+    """
+
+    def __init__(self, mocal: "ModalOrLocal", memory_limit_bytes: int = 256 * 1024 * 1024):
+        self.mocal = mocal
+        """The ModalOrLocal the buffered operations are applied to"""
+        self.memory_limit_bytes = memory_limit_bytes
+        """Pending content held in memory beyond this total is spilled to a local temp dir"""
+
+        self._writes: Dict[str, _PendingWrite] = {}
+        self._directories: Set[str] = set()
+        self._removals: Dict[str, bool] = {}  # path -> dne_ok, in the order removals were requested
+        self._memory_bytes = 0
+        self._spill_dir: Optional[str] = None
+        self._spill_count = 0
+        self._buffering = mocal.backend.remote
+
+    def __enter__(self) -> "BatchSession":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            # Like volume.batch_upload(), nothing is applied if the block raised
+            if exc_type is None:
+                self.flush()
+        finally:
+            self._discard()
+
+    def __str__(self):
+        return (
+            __class__.__name__
+            + f"(mocal={self.mocal}, pending_writes={len(self._writes)}, pending_directories={len(self._directories)}, pending_removals={len(self._removals)})"
+        )
+
+    def write_file(self, new_file_full_path: str, encoded_content: Any, force: bool = True):
+        """Buffer writing the encoded content to the given file. A later write to the same path replaces this one"""
+        if not self._buffering:
+            return self.mocal.write_file(new_file_full_path, encoded_content, force=force)
+
+        path = self._norm(new_file_full_path)
+        self._drop_write(path)
+        content = bytes(encoded_content)
+        if self._memory_bytes + len(content) > self.memory_limit_bytes:
+            pending = _PendingWrite(force=force, spill_path=self._spill(content))
+        else:
+            pending = _PendingWrite(force=force, content=content)
+            self._memory_bytes += len(content)
+        self._writes[path] = pending
+
+    def write_json_file(self, new_json_file_full_path: str, metadata: Any, force: bool = True):
+        """Buffer writing a json file, see write_file()"""
+        if not self._buffering:
+            return self.mocal.write_json_file(new_json_file_full_path, metadata, force=force)
+        self.write_file(new_json_file_full_path, json.dumps(metadata, indent=4).encode(), force=force)
+
+    def create_directory(self, dir_full_path: str, exists_ok: bool = True):
+        """Buffer creating a directory (and parent dirs as needed). Directories that end up containing a written file cost nothing extra"""
+        if not self._buffering:
+            return self.mocal.create_directory(dir_full_path, exists_ok=exists_ok)
+        self._directories.add(self._norm(dir_full_path))
+
+    def remove_file_or_directory(self, file_or_dir_to_remove_full_path: str, dne_ok: bool = False):
+        """Buffer removing a file or directory. Pending writes/directories at or under the path are dropped"""
+        if not self._buffering:
+            return self.mocal.remove_file_or_directory(file_or_dir_to_remove_full_path, dne_ok=dne_ok)
+
+        path = self._norm(file_or_dir_to_remove_full_path)
+        had_pending = False
+        for pending_path in [p for p in self._writes if _is_at_or_under(p, path)]:
+            self._drop_write(pending_path)
+            had_pending = True
+        for pending_dir in [d for d in self._directories if _is_at_or_under(d, path)]:
+            self._directories.discard(pending_dir)
+            had_pending = True
+
+        # If the path only existed as pending content it may not exist on the volume at all
+        self._removals.pop(path, None)
+        self._removals[path] = dne_ok or had_pending
+
+    def read_file(self, file_full_path: str) -> Any:
+        """Load content from the given file, seeing writes and removals pending in this session"""
+        path = self._norm(file_full_path)
+        if path in self._writes:
+            return self._writes[path].read()
+        if self._is_removed(path):
+            raise FileNotFoundError(f"{file_full_path} is removed in this batch session")
+        return self.mocal.read_file(file_full_path)
+
+    def read_json_file(self, json_file_full_path: str) -> Any:
+        """Load json from the given file, seeing writes and removals pending in this session"""
+        return json.loads(self.read_file(json_file_full_path))
+
+    def file_or_dir_exists(self, full_path: str) -> bool:
+        """Returns true if the given path exists on the volume/filesystem or is pending in this session (and not pending removal)"""
+        path = self._norm(full_path)
+        if path in self._writes or self._is_pending_directory(path):
+            return True
+        if self._is_removed(path):
+            return False
+        return self.mocal.file_or_dir_exists(full_path)
+
+    def flush(self):
+        """Apply everything pending: removals first, then directory creations and writes in at most one batch_upload per force value"""
+        if not self._buffering:
+            self.mocal.flush()
+            return
+
+        for path, dne_ok in self._removals.items():
+            self.mocal.remove_file_or_directory(path, dne_ok=dne_ok)
+
+        # Directories at or above a pending file (or another pending directory) are created by the upload itself, and those that
+        # already exist need nothing
+        directories = [
+            d
+            for d in self._directories
+            if not any(_is_under(p, d) for p in self._writes)
+            and not any(_is_under(other, d) for other in self._directories)
+            and not self.mocal.isdir(d)
+        ]
+
+        writes_by_force: Dict[bool, List[str]] = {}
+        for path, pending in self._writes.items():
+            writes_by_force.setdefault(pending.force, []).append(path)
+        if directories:
+            writes_by_force.setdefault(True, [])
+
+        placeholders = []
+        for force, paths in writes_by_force.items():
+            with self.mocal.backend.batch(force=force) as batch:
+                for path in paths:
+                    pending = self._writes[path]
+                    source = pending.spill_path if pending.content is None else BytesIO(pending.content)
+                    batch.put_file(source, path)
+                if force:
+                    # Volumes cannot hold empty directories, so upload a placeholder into each and remove it afterwards (as create_directory() does).
+                    # The directories are new and the names unique, so a placeholder can never replace (and then remove) a file of the user's
+                    for directory in directories:
+                        placeholder = os.path.join(directory, f".modal_or_local-{uuid.uuid4()}")
+                        batch.put_file(
+                            BytesIO(b"This is a temp file to create a directory - it can be safely removed\n"),
+                            placeholder,
+                        )
+                        placeholders.append(placeholder)
+
+        self.mocal.remove_files(placeholders, dne_ok=True)
+
+        for path in list(self._writes) + directories:
+            self.mocal._written(path)
+
+        self._discard()
+
+    def _norm(self, full_path: str) -> str:
+        return os.path.normpath(os.path.join("/", full_path))
+
+    def _is_removed(self, path: str) -> bool:
+        return any(_is_at_or_under(path, removed) for removed in self._removals)
+
+    def _is_pending_directory(self, path: str) -> bool:
+        return any(_is_at_or_under(d, path) for d in self._directories) or any(
+            _is_under(p, path) for p in self._writes
+        )
+
+    def _drop_write(self, path: str):
+        pending = self._writes.pop(path, None)
+        if pending is None:
+            return
+        if pending.content is not None:
+            self._memory_bytes -= len(pending.content)
+        else:
+            os.remove(pending.spill_path)
+
+    def _spill(self, content: bytes) -> str:
+        if self._spill_dir is None:
+            self._spill_dir = mkdtemp(prefix="modal_or_local_batch_")
+        self._spill_count += 1
+        spill_path = os.path.join(self._spill_dir, str(self._spill_count))
+        with open(spill_path, "wb") as f:
+            f.write(content)
+        return spill_path
+
+    def _discard(self):
+        self._writes.clear()
+        self._directories.clear()
+        self._removals.clear()
+        self._memory_bytes = 0
+        if self._spill_dir:
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
+            self._spill_dir = None
+
+
+def _is_under(path: str, directory: str) -> bool:
+    """Return true if path is strictly inside directory (both normalized absolute paths)"""
+    return path.startswith(directory.rstrip("/") + "/")
+
+
+def _is_at_or_under(path: str, directory: str) -> bool:
+    return path == directory or _is_under(path, directory)
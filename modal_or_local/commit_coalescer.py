@@ -0,0 +1,159 @@
+"""
+Commits for writes to a mounted volume. While running remotely writes go to the mounted filesystem and only become visible to other
+containers once the volume is committed, but committing after every write is expensive. Every ModalOrLocal keeps a CommitCoalescer which
+counts the writes (and removals) made through it on a backend that needs committing, and commits once enough have built up:
+
+    mocal = ModalOrLocal(volume_name=..., volume_mount_dir=..., auto_commit=True)  # or auto_commit=CommitCoalescer(max_writes=500)
+    with mocal:
+        for ...:
+            mocal.write_file(...)  # committed every max_writes writes, max_bytes bytes or max_seconds since the oldest uncommitted write
+    # ... and whatever is left when the with block exits (or on mocal.flush(), or when the process exits)
+
+Without auto_commit writes are still tracked, but only committed by flush(), on leaving a with block and at the end of a batch().
+With auto_commit a coalescer with uncommitted writes (and so its ModalOrLocal) is kept alive until they are committed, so writes made
+through an instance that is then dropped are still committed at exit; one atexit hook flushes every such coalescer.
+The limits are checked as each write is recorded (by the thread that made it) rather than by a background timer, so max_seconds is the
+age at which the next write commits; flush() commits writes that are not followed by any.
+"""
+
+import atexit
+import threading
+import time
+import weakref
+from typing import Any, Callable, Dict, Optional, Set
+
+DEFAULT_MAX_WRITES = 100
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_MAX_SECONDS = 10.0
+
+_exit_coalescers: "weakref.WeakSet[CommitCoalescer]" = weakref.WeakSet()  # Flushed at exit, see flush_at_exit()
+_dirty_exit_coalescers: Set["CommitCoalescer"] = set()  # Those of them with uncommitted writes, held so they live until the exit flush
+_exit_lock = threading.Lock()
+_exit_hook_registered = False
+
+
+class CommitCoalescer:
+    """Uncommitted writes to a volume, committed through the bound commit function once any of the limits is reached. None disables a limit"""
+
+    def __init__(
+        self,
+        max_writes: Optional[int] = DEFAULT_MAX_WRITES,
+        max_bytes: Optional[int] = DEFAULT_MAX_BYTES,
+        max_seconds: Optional[float] = DEFAULT_MAX_SECONDS,
+    ):
+        self.max_writes = max_writes
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.pending_writes = 0
+        self.pending_bytes = 0
+        self.first_pending_at: Optional[float] = None  # time.monotonic() of the oldest uncommitted write
+        self.commits = 0
+        self.commit_errors = 0
+        self.commit_seconds_total = 0.0
+        self.last_commit_seconds = 0.0
+        self._commit: Optional[Callable[[], None]] = None
+        self._flush_at_exit = False  # True once passed to flush_at_exit()
+        self._lock = threading.RLock()
+
+    def __str__(self):
+        return __class__.__name__ + f"(pending_writes={self.pending_writes}, pending_bytes={self.pending_bytes}, commits={self.commits})"
+
+    @property
+    def automatic(self) -> bool:
+        """True if commits are made when a limit is reached, rather than only by flush()"""
+        return any(limit is not None for limit in (self.max_writes, self.max_bytes, self.max_seconds))
+
+    @property
+    def dirty(self) -> bool:
+        """True if writes have been made since the last commit"""
+        return self.pending_writes > 0
+
+    def bind(self, commit: Callable[[], None]):
+        """Set the function that commits the volume (ModalOrLocal binds its backend's commit())"""
+        self._commit = commit
+
+    def record_write(self, nbytes: int = 0):
+        """Count a write (or removal) of nbytes, committing if that reaches a limit"""
+        with self._lock:
+            if not self.pending_writes:
+                self.first_pending_at = time.monotonic()
+                if self._flush_at_exit:
+                    _dirty_exit_coalescers.add(self)
+            self.pending_writes += 1
+            self.pending_bytes += nbytes
+            if self._due():
+                self._commit_pending()
+
+    def flush(self) -> bool:
+        """Commit now if there are uncommitted writes. Returns true if a commit was made"""
+        with self._lock:
+            if not self.dirty:
+                return False
+            self._commit_pending()
+            return True
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the uncommitted writes and bytes, and the count and latency of the commits made so far"""
+        with self._lock:
+            return {
+                "pending_writes": self.pending_writes,
+                "pending_bytes": self.pending_bytes,
+                "pending_seconds": time.monotonic() - self.first_pending_at if self.first_pending_at is not None else 0.0,
+                "commits": self.commits,
+                "commit_errors": self.commit_errors,
+                "commit_seconds_total": self.commit_seconds_total,
+                "last_commit_seconds": self.last_commit_seconds,
+            }
+
+    def _due(self) -> bool:
+        if self.max_writes is not None and self.pending_writes >= self.max_writes:
+            return True
+        if self.max_bytes is not None and self.pending_bytes >= self.max_bytes:
+            return True
+        return self.max_seconds is not None and time.monotonic() - self.first_pending_at >= self.max_seconds
+
+    def _commit_pending(self):
+        if self._commit is None:
+            raise RuntimeError(f"{self} has no commit function, see bind()")
+        started = time.perf_counter()
+        try:
+            self._commit()
+        except BaseException:
+            # The writes stay pending, for the next commit to pick up
+            self.commit_errors += 1
+            raise
+        finally:
+            self.last_commit_seconds = time.perf_counter() - started
+            self.commit_seconds_total += self.last_commit_seconds
+        self.commits += 1
+        self.pending_writes = 0
+        self.pending_bytes = 0
+        self.first_pending_at = None
+        _dirty_exit_coalescers.discard(self)
+
+
+def flush_at_exit(coalescer: CommitCoalescer):
+    """Commit what is left in the coalescer when the process exits (once however many instances share it). The coalescer is only held
+    while it has uncommitted writes, so one that is clean can be collected along with its ModalOrLocal"""
+    global _exit_hook_registered
+    with _exit_lock:
+        if not _exit_hook_registered:
+            _exit_hook_registered = True
+            atexit.register(_flush_all)
+        coalescer._flush_at_exit = True
+        _exit_coalescers.add(coalescer)
+    with coalescer._lock:
+        if coalescer.dirty:
+            _dirty_exit_coalescers.add(coalescer)
+
+
+def _flush_all():
+    # Every coalescer is tried even if committing one fails; the first error is raised once they all have been
+    error: Optional[BaseException] = None
+    for coalescer in list(_exit_coalescers):
+        try:
+            coalescer.flush()
+        except Exception as e:
+            error = error or e
+    if error is not None:
+        raise error
@@ -0,0 +1,190 @@
+"""
+Adaptive concurrency for the parallel operations of a ModalOrLocal (parallel walks, prefetch() and iter_files(), remove_files(), copy_dir()
+with workers). Instead of each running a fixed number of calls at once, they share one ConcurrencyController:
+
+    mocal = ModalOrLocal(volume_name=..., volume_mount_dir=..., concurrency=True)  # or concurrency=ConcurrencyController(max_concurrency=32)
+    mocal.prefetch(...)
+    print(mocal.concurrency.snapshot())  # also in mocal.metrics.snapshot()["gauges"]["concurrency"]
+
+The limit on calls in flight is adjusted AIMD style, as TCP adjusts its window: it grows by about one for each limit's worth of calls that
+complete with latency close to the usual for their kind (per MiB, for calls returning more than that), and is halved when a call fails with a transient error (throttling, an unavailable
+or overloaded server, a timeout) or takes much longer than usual. Only calls started since the last decrease can cause another, so one
+burst of slow calls halves the limit once. Calls failing with a transient error are retried after a jittered exponential backoff - for calls
+that change the volume (removals, copies) only when the error means the call cannot have taken effect, since an internal or unknown error
+may come after the change was made.
+"""
+
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+import modal
+from grpclib import GRPCError, Status
+
+
+T = TypeVar("T")
+
+TRANSIENT_STATUSES = frozenset(
+    {Status.UNAVAILABLE, Status.RESOURCE_EXHAUSTED, Status.DEADLINE_EXCEEDED, Status.ABORTED, Status.INTERNAL, Status.UNKNOWN}
+)
+"""GRPCError statuses worth retrying"""
+
+UNEXECUTED_STATUSES = frozenset({Status.UNAVAILABLE, Status.RESOURCE_EXHAUSTED, Status.DEADLINE_EXCEEDED})
+"""GRPCError statuses worth retrying for calls that are not idempotent: the server was not reached, turned the call away or it timed out"""
+
+LATENCY_UNIT_BYTES = 1024 * 1024
+"""Calls returning content (read_file, copies) are compared per this many bytes, so a large file is not mistaken for a latency spike"""
+
+
+def is_transient_error(e: BaseException, idempotent: bool = True) -> bool:
+    """Return true if the exception raised by a volume call or filesystem operation is likely to go away if the call is retried.
+    If not idempotent, only errors that mean the call was not carried out count"""
+    if isinstance(e, GRPCError):
+        return e.status in (TRANSIENT_STATUSES if idempotent else UNEXECUTED_STATUSES)
+    transient_types = (
+        modal.exception.ConnectionError,
+        modal.exception.TimeoutError,
+        modal.exception.ResourceExhaustedError,
+        ConnectionError,
+        TimeoutError,
+    )
+    return isinstance(e, transient_types) or (idempotent and isinstance(e, modal.exception.InternalError))
+
+
+class ConcurrencyController:
+    """An AIMD limit on the calls in flight across the parallel operations sharing it, with retries of transient errors"""
+
+    def __init__(
+        self,
+        initial_concurrency: int = 4,
+        min_concurrency: int = 1,
+        max_concurrency: int = 64,
+        latency_tolerance: float = 2.0,
+        min_spike_seconds: float = 0.05,
+        decrease_factor: float = 0.5,
+        retries: int = 3,
+        backoff_seconds: float = 0.1,
+        max_backoff_seconds: float = 5.0,
+    ):
+        if not 1 <= min_concurrency <= initial_concurrency <= max_concurrency:
+            raise ValueError(
+                f"Expected 1 <= min_concurrency <= initial_concurrency <= max_concurrency but got {min_concurrency=}, {initial_concurrency=}, {max_concurrency=}"
+            )
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        """Most calls ever in flight at once, and the number of threads parallel operations use when sharing this controller"""
+        self.latency_tolerance = latency_tolerance  # A call slower than this multiple of the usual latency for its kind is a spike
+        self.min_spike_seconds = min_spike_seconds  # ... if also slower than this, so jitter on very fast calls is ignored
+        self.decrease_factor = decrease_factor
+        self.retries = retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+
+        self.limit = float(initial_concurrency)
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.calls = 0
+        self.errors = 0  # Calls that failed after any retries
+        self.retried = 0
+        self.increases = 0
+        self.decreases = 0
+        self._baseline_seconds: Dict[str, float] = {}  # Usual latency of each kind of call when not queued, see _release()
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def __str__(self):
+        return __class__.__name__ + f"(limit={int(self.limit)}, in_flight={self.in_flight}, max_concurrency={self.max_concurrency})"
+
+    def call(self, kind: str, fn: Callable[..., T], *args: Any, idempotent: bool = True, **kwargs: Any) -> T:
+        """Return fn(*args, **kwargs), waiting until the limit allows another call in flight. kind (e.g. "listdir", "read_file") groups
+        calls whose latencies are comparable. A transient error is retried up to retries times after a jittered backoff; pass
+        idempotent=False for calls that change the volume, so they are only retried on errors that mean they were not carried out"""
+        attempt = 0
+        while True:
+            started = self._acquire()
+            error: Optional[BaseException] = None
+            size = 0
+            try:
+                result = fn(*args, **kwargs)
+                size = _size_of(result)
+                return result
+            except BaseException as e:
+                error = e
+                if not is_transient_error(e, idempotent) or attempt >= self.retries:
+                    with self._condition:
+                        self.errors += 1
+                    raise
+            finally:
+                self._release(kind, started, (time.perf_counter() - started) / max(1.0, size / LATENCY_UNIT_BYTES), error)
+            attempt += 1
+            with self._condition:
+                self.retried += 1
+            # Full jitter, so calls that failed together do not all come back together
+            time.sleep(random.uniform(0, min(self.max_backoff_seconds, self.backoff_seconds * 2 ** (attempt - 1))))
+
+    def threads(self, workers: int) -> int:
+        """Return the number of threads a parallel operation asked to use workers should start: max_concurrency, since this controller
+        decides how many of them make calls at once, or workers if that is 1 (the operation should run serially)"""
+        return self.max_concurrency if workers > 1 else workers
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the current limit and calls in flight, and counts of calls, errors, retries and limit changes so far"""
+        with self._condition:
+            return {
+                "limit": int(self.limit),
+                "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight,
+                "calls": self.calls,
+                "errors": self.errors,
+                "retries": self.retried,
+                "increases": self.increases,
+                "decreases": self.decreases,
+                "baseline_seconds": dict(self._baseline_seconds),
+            }
+
+    def _acquire(self) -> float:
+        with self._condition:
+            self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+            self.calls += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            return time.perf_counter()
+
+    def _release(self, kind: str, started: float, seconds: float, error: Optional[BaseException]):
+        with self._condition:
+            self.in_flight -= 1
+            if error is not None and not is_transient_error(error):
+                # Says nothing about load (e.g. a missing file)
+                self._condition.notify_all()
+                return
+            if error is not None or self._is_spike(kind, seconds):
+                # Calls started before the last decrease were sent at the higher limit, so only later ones can lower it again
+                if started >= self._last_decrease and self.limit > self.min_concurrency:
+                    self.limit = max(float(self.min_concurrency), self.limit * self.decrease_factor)
+                    self.decreases += 1
+                    self._last_decrease = time.perf_counter()
+            elif self.limit < self.max_concurrency:
+                # +1/limit per call is about +1 per limit's worth of calls
+                previous = int(self.limit)
+                self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+                self.increases += 1 if int(self.limit) > previous else 0
+            if error is None:
+                # Follows faster calls at once and slower ones only slowly, so it tracks the latency of an unloaded server (as TCP Vegas
+                # tracks the minimum round trip) rather than creeping up with the load the limit is meant to detect
+                baseline = self._baseline_seconds.get(kind)
+                self._baseline_seconds[kind] = seconds if baseline is None or seconds < baseline else baseline + 0.01 * (seconds - baseline)
+            self._condition.notify_all()
+
+    def _is_spike(self, kind: str, seconds: float) -> bool:
+        baseline = self._baseline_seconds.get(kind)
+        return baseline is not None and seconds > self.min_spike_seconds and seconds > baseline * self.latency_tolerance
+
+
+def _size_of(result: Any) -> int:
+    """Return the number of bytes a call transferred, judging by its result: content read, or a copy_file() result"""
+    if isinstance(result, (bytes, bytearray, memoryview)):
+        return len(result)
+    if isinstance(result, dict):
+        return result.get("transferred_bytes", 0)
+    return 0
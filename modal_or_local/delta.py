@@ -0,0 +1,423 @@
+"""
+rsync style delta transfer, used by modal_or_local_copy.copy_file(delta=True).
+
+Each file copied with delta=True gets a block signature sidecar (<file>.blocksig): a weak rolling checksum (adler32, as rsync uses) and a
+strong hash for every block of the new version. The next copy over it works out which blocks are unchanged and rebuilds the new version
+from those plus the changed ranges, which are the only bytes taken from the source:
+
+    source directly accessible (local filesystem, mounted volume)  rolling checksum scan of the source, so blocks are found at any offset
+                                                                    (needs numpy, otherwise blocks are compared at the same offsets)
+    source through the volume API                                   the source's stored signature is compared block by block with the
+                                                                    destination's, and the source is streamed once up to the end of the
+                                                                    last changed block, keeping only the changed blocks (the volume API
+                                                                    has no ranged reads, so the bytes between them are read and dropped)
+
+The old version has to be readable locally, so the destination must be directly accessible; through the volume API every write uploads
+the whole file, so there a delta copy is an ordinary copy that leaves a signature for later copies from it.
+The new version is written to a temporary file next to the old one and renamed over it, so a copy that fails part way leaves the old
+version (and its signature) as they were. The digest and new signature come from the bytes as they are written, not from a second read.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import zlib
+from contextlib import ExitStack, nullcontext
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple, TYPE_CHECKING
+
+from modal.volume import FileEntry
+
+from modal_or_local.backends import is_not_found_error
+
+if TYPE_CHECKING:
+    from modal_or_local import ModalOrLocal
+    from modal_or_local.transfer_budget import TransferBudget
+
+
+DEFAULT_BLOCK_SIZE = 64 * 1024
+SIGNATURE_SUFFIX = ".blocksig"
+READ_CHUNK_BYTES = 8 * 1024 * 1024
+
+_ADLER_MOD = 65521
+_SCAN_SEGMENT_BYTES = 1024 * 1024  # Windows checksummed at a time when looking for the next match after a miss
+_SKIP_CHUNK_BYTES = 1024 * 1024  # Read and dropped at a time when streaming past unchanged blocks of the source
+
+DeltaOp = Tuple[int, int, Optional[int]]
+"""(offset in the new version, length, offset in the old version to reuse the bytes from or None to take them from the source)"""
+
+
+class Signature:
+    """Block signatures of one version of a file. size and mtime identify that version, so a signature left over from an earlier one is not used"""
+
+    def __init__(
+        self,
+        block_size: int = DEFAULT_BLOCK_SIZE,
+        size: int = 0,
+        mtime: Optional[float] = None,
+        weak: Optional[List[int]] = None,
+        strong: Optional[List[str]] = None,
+    ):
+        self.block_size = block_size
+        self.size = size
+        self.mtime = mtime
+        self.weak = weak if weak is not None else []  # zlib.adler32() of each block
+        self.strong = strong if strong is not None else []  # strong_hash() of each block
+
+    def __str__(self):
+        return __class__.__name__ + f"(block_size={self.block_size}, size={self.size}, blocks={len(self.weak)})"
+
+    def describes(self, entry: Optional[FileEntry]) -> bool:
+        """Return true if this is the signature of the version of the file given by the FileEntry (see ModalOrLocal.get_FileEntry())"""
+        return entry is not None and entry.size == self.size and entry.mtime == self.mtime
+
+    def block_length(self, index: int) -> int:
+        return min(self.block_size, self.size - index * self.block_size)
+
+    def to_json(self) -> bytes:
+        return json.dumps(
+            {"block_size": self.block_size, "size": self.size, "mtime": self.mtime, "weak": self.weak, "strong": self.strong}
+        ).encode()
+
+    @classmethod
+    def from_json(cls, content: Any) -> "Signature":
+        fields = json.loads(bytes(content))
+        return cls(fields["block_size"], fields["size"], fields["mtime"], fields["weak"], fields["strong"])
+
+
+class SignatureBuilder:
+    """Builds a Signature from content passed in chunks of any size, e.g. as it is being copied"""
+
+    def __init__(self, block_size: int = DEFAULT_BLOCK_SIZE):
+        self.signature = Signature(block_size)
+        self._partial = bytearray()  # Start of the next block
+
+    def update(self, chunk: Any):
+        view = memoryview(chunk).cast("B")
+        self.signature.size += len(view)
+        block_size = self.signature.block_size
+        if self._partial:
+            needed = block_size - len(self._partial)
+            self._partial += view[:needed]
+            view = view[needed:]
+            if len(self._partial) < block_size:
+                return
+            self._add_block(self._partial)
+            self._partial = bytearray()
+        whole_blocks_end = len(view) - len(view) % block_size
+        for start in range(0, whole_blocks_end, block_size):
+            self._add_block(view[start : start + block_size])
+        self._partial += view[whole_blocks_end:]
+
+    def finish(self, mtime: Optional[float] = None) -> Signature:
+        """Return the signature, for the version of the file with the given mtime"""
+        if self._partial:
+            self._add_block(self._partial)
+            self._partial = bytearray()
+        self.signature.mtime = mtime
+        return self.signature
+
+    def _add_block(self, block: Any):
+        self.signature.weak.append(zlib.adler32(block))
+        self.signature.strong.append(strong_hash(block))
+
+
+def strong_hash(block: Any) -> str:
+    return hashlib.blake2b(block, digest_size=16).hexdigest()
+
+
+def signature_path(file_full_path: str) -> str:
+    """Return the path of the sidecar holding the block signature of the given file"""
+    return file_full_path + SIGNATURE_SUFFIX
+
+
+def read_signature(mocal: "ModalOrLocal", file_full_path: str, entry: Optional[FileEntry]) -> Optional[Signature]:
+    """Return the stored signature of the given file if it has one for the version given by entry, otherwise None"""
+    try:
+        signature = Signature.from_json(mocal.read_file(signature_path(file_full_path)))
+    except (ValueError, KeyError, TypeError):
+        return None  # Not a signature we can use
+    except Exception as e:
+        if is_not_found_error(e):
+            return None
+        raise
+    return signature if signature.describes(entry) else None
+
+
+def write_signature(mocal: "ModalOrLocal", file_full_path: str, signature: Signature):
+    mocal.write_file(signature_path(file_full_path), signature.to_json())
+
+
+def compute_signature(mocal: "ModalOrLocal", file_full_path: str, block_size: int = DEFAULT_BLOCK_SIZE) -> Signature:
+    """Read the given file and return its signature"""
+    builder = SignatureBuilder(block_size)
+    with mocal.open_read(file_full_path) as f:
+        while chunk := f.read(READ_CHUNK_BYTES):
+            builder.update(chunk)
+    entry = mocal.get_FileEntry(file_full_path)
+    return builder.finish(entry.mtime if entry else None)
+
+
+def plan_from_signatures(new: Signature, old: Signature) -> List[DeltaOp]:
+    """Plan the new version from the old one by comparing the blocks at the same offsets"""
+    ops = []
+    for index in range(len(new.weak)):
+        offset = index * new.block_size
+        length = new.block_length(index)
+        unchanged = (
+            index < len(old.weak)
+            and old.block_length(index) == length
+            and old.weak[index] == new.weak[index]
+            and old.strong[index] == new.strong[index]
+        )
+        ops.append((offset, length, offset if unchanged else None))
+    return _merge(ops)
+
+
+def plan_from_file(file_path: str, size: int, old: Signature) -> List[DeltaOp]:
+    """Plan the new version (the local file at file_path) from the old one the way rsync does, finding the old version's blocks at any
+    offset. Each block following a match is checked directly; only after a miss are the windows at every following offset checksummed
+    (vectorised with numpy) until the next match. Without numpy blocks are only compared at the same offsets."""
+    try:
+        import numpy as np
+    except ImportError:
+        np = None
+
+    block_size = old.block_size
+    with open(file_path, "rb") as f:
+        if np is None:
+            builder = SignatureBuilder(block_size)
+            while chunk := f.read(READ_CHUNK_BYTES):
+                builder.update(chunk)
+            return plan_from_signatures(builder.finish(), old)
+
+        # The old version's whole blocks by weak checksum; a short last block can only match the end of the new version
+        whole_blocks = old.size // block_size
+        blocks_by_weak: Dict[int, List[int]] = {}
+        for index in range(whole_blocks):
+            blocks_by_weak.setdefault(old.weak[index], []).append(index)
+        scanner = _RollingScanner(np, blocks_by_weak, block_size)
+
+        def matching_block(offset: int, window: bytes, weak: int) -> Optional[int]:
+            window_strong = strong_hash(window)
+            matches = [index for index in blocks_by_weak.get(weak, []) if old.strong[index] == window_strong]
+            if not matches:
+                return None
+            # Prefer the block at the same offset, so unchanged runs of blocks merge into one op
+            return offset // block_size if offset // block_size in matches else matches[0]
+
+        ops = []
+        offset = 0  # Everything before this has been planned
+        while offset + block_size <= size:
+            window = os.pread(f.fileno(), block_size, offset)
+            index = matching_block(offset, window, zlib.adler32(window))
+            if index is None:
+                # Look for the next match at any offset in the following segment
+                window_count = min(_SCAN_SEGMENT_BYTES, size - block_size + 1 - offset)
+                data = os.pread(f.fileno(), window_count + block_size - 1, offset)
+                match_offset = offset + window_count
+                for window_start, weak in scanner.candidates(data, window_count):
+                    index = matching_block(offset + window_start, data[window_start : window_start + block_size], weak)
+                    if index is not None:
+                        match_offset = offset + window_start
+                        break
+                ops.append((offset, match_offset - offset, None))
+                offset = match_offset
+                if index is None:
+                    continue
+            ops.append((offset, block_size, index * block_size))
+            offset += block_size
+
+        if offset < size:
+            remaining = size - offset
+            last_block_length = old.size % block_size
+            if remaining == last_block_length and strong_hash(os.pread(f.fileno(), remaining, offset)) == old.strong[-1]:
+                ops.append((offset, remaining, whole_blocks * block_size))
+            else:
+                ops.append((offset, remaining, None))
+    return _merge([op for op in ops if op[1]])
+
+
+def apply_delta(
+    source_mocal: "ModalOrLocal",
+    source_full_path: str,
+    source_entry: FileEntry,
+    destination_mocal: "ModalOrLocal",
+    destination_full_path: str,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    observe: Optional[Callable[[bytes], None]] = None,
+    budget: Optional["TransferBudget"] = None,
+    check: Optional[Callable[[], None]] = None,
+) -> Optional[Tuple[int, int]]:
+    """Bring the destination file up to date with the source by reusing its unchanged blocks, taking only the changed ranges from the source.
+    observe is called with the whole new content in order (for digests and the new signature), and check, if given, once all of it has
+    been written but before it replaces the old version, so an exception from it leaves the old version. Each chunk read is reserved
+    against budget, if given, until it has been written. Returns (bytes reused from the old version, bytes read from the source - which through the volume
+    API includes those streamed past between the changed blocks), or None if a delta copy is not possible (the destination is not directly accessible or does not exist yet, or the source is
+    only reachable through the volume API and has no up to date signature); the caller then copies the whole file."""
+    destination_local_path = destination_mocal.backend.local_path(destination_full_path)
+    if not destination_local_path or not os.path.isfile(destination_local_path):
+        return None
+
+    source_local_path = source_mocal.backend.local_path(source_full_path)
+    if not source_local_path:
+        new_signature = read_signature(source_mocal, source_full_path, source_entry)
+        if new_signature is None:
+            return None
+        block_size = new_signature.block_size
+
+    old_signature = read_signature(destination_mocal, destination_full_path, destination_mocal.get_FileEntry(destination_full_path))
+    if old_signature is None or old_signature.block_size != block_size:
+        old_signature = compute_signature(destination_mocal, destination_full_path, block_size)
+
+    if source_local_path:
+        ops = plan_from_file(source_local_path, source_entry.size, old_signature)
+    else:
+        ops = plan_from_signatures(new_signature, old_signature)
+
+    with _SourceReader(source_mocal, source_full_path, source_local_path) as source:
+        taken = _rewrite(destination_local_path, ops, source.read, observe, budget, check)
+    destination_mocal._written(destination_full_path, taken)
+    return source_entry.size - taken, source.bytes_read
+
+
+class _SourceReader:
+    """Reads the changed ranges of the new version from the source, in order, counting the bytes read from it. A directly accessible source
+    is read with pread. Otherwise the source is opened as a stream on the first read and read forward once, dropping the bytes between
+    the ranges, so nothing after the last changed range is downloaded and an unchanged file is not opened at all"""
+
+    def __init__(self, mocal: "ModalOrLocal", full_path: str, local_path: Optional[str]):
+        self.mocal = mocal
+        self.full_path = full_path
+        self.local_path = local_path
+        self.bytes_read = 0
+        self._file: Optional[BinaryIO] = None
+        self._position = 0  # Offset of the stream in the source
+        self._stack = ExitStack()
+
+    def __enter__(self) -> "_SourceReader":
+        return self
+
+    def __exit__(self, *exc_info: Any):
+        self._stack.close()
+
+    def read(self, offset: int, length: int) -> bytes:
+        if self._file is None:
+            self._file = self._stack.enter_context(open(self.local_path, "rb") if self.local_path else self.mocal.open_read(self.full_path))
+        if self.local_path:
+            chunk = os.pread(self._file.fileno(), length, offset)
+        else:
+            if offset < self._position:
+                raise ValueError(f"Expected ranges of {self.full_path} in order but got {offset=} after {self._position}")
+            while self._position < offset:
+                skipped = len(self._file.read(min(offset - self._position, _SKIP_CHUNK_BYTES)))
+                if not skipped:
+                    return b""
+                self._position += skipped
+                self.bytes_read += skipped
+            chunk = self._file.read(length)
+            self._position += len(chunk)
+        self.bytes_read += len(chunk)
+        return chunk
+
+
+def _rewrite(
+    local_path: str,
+    ops: List[DeltaOp],
+    read_source: Callable[[int, int], bytes],
+    observe: Optional[Callable[[bytes], None]],
+    budget: Optional["TransferBudget"] = None,
+    check: Optional[Callable[[], None]] = None,
+) -> int:
+    """Write the new version to a temporary file next to the old one, call check (if given), then rename it over the old one.
+    Returns the bytes taken from the source"""
+    taken = 0
+    directory, name = os.path.split(local_path)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=f".{name}.", suffix=".delta")
+    try:
+        with open(fd, "wb") as new_file, open(local_path, "rb") as old_file:
+            for offset, length, old_offset in ops:
+                if old_offset is None:
+                    chunks = _read_ranges(read_source, offset, length, budget)
+                else:
+                    chunks = _read_ranges(lambda o, n: os.pread(old_file.fileno(), n, o), old_offset, length, budget)
+                for _, chunk in chunks:
+                    new_file.write(chunk)
+                    if observe:
+                        observe(chunk)
+                    if old_offset is None:
+                        taken += len(chunk)
+        if check:
+            check()
+        os.replace(temp_path, local_path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return taken
+
+
+def _read_ranges(read: Callable[[int, int], bytes], offset: int, length: int, budget: Optional["TransferBudget"] = None):
+    """Yield (offset, bytes) for the given range READ_CHUNK_BYTES at a time.
+    With a budget each chunk is reserved until the caller asks for the next one, i.e. once it has been written"""
+    end = offset + length
+    chunk_bytes = budget.chunk_size(READ_CHUNK_BYTES) if budget else READ_CHUNK_BYTES
+    while offset < end:
+        nbytes = min(chunk_bytes, end - offset)
+        with budget.reserve(nbytes) if budget else nullcontext():
+            chunk = read(offset, nbytes)
+            if not chunk:
+                raise EOFError(f"Expected {end - offset} more bytes at {offset=}")
+            yield offset, chunk
+        offset += len(chunk)
+
+
+class _RollingScanner:
+    """Finds the windows of a buffer whose zlib.adler32() is one of the given weak checksums, for every offset at once using prefix sums"""
+
+    def __init__(self, np: Any, blocks_by_weak: Dict[int, List[int]], block_size: int):
+        self.np = np
+        self.block_size = block_size
+        self.weak_values = np.array(sorted(blocks_by_weak), dtype=np.int64)
+        # adler32's low half (a) is cheap to compute for every window, so it is used to rule out most windows before computing b
+        self.a_values = np.zeros(1 << 16, dtype=bool)
+        self.a_values[self.weak_values & 0xFFFF] = True
+
+    def candidates(self, data: bytes, window_count: int) -> Iterator[Tuple[int, int]]:
+        """Yield (window start, weak checksum) for each matching window starting at 0 to window_count - 1, in order"""
+        np = self.np
+        if not len(self.weak_values):
+            return
+        x = np.frombuffer(data, dtype=np.uint8)
+        sums = np.zeros(len(x) + 1, dtype=np.int64)
+        np.cumsum(x, out=sums[1:])
+        a = sums[self.block_size : self.block_size + window_count] - sums[:window_count]
+        a_mod = (a + 1) % _ADLER_MOD
+        starts = np.flatnonzero(self.a_values[a_mod])
+        if not len(starts):
+            return
+
+        # b is the sum of the running a values: block_size + sum of (block_size - i) * x[start + i]
+        weighted_sums = np.zeros(len(x) + 1, dtype=np.int64)
+        np.cumsum(x * np.arange(len(x), dtype=np.int64), out=weighted_sums[1:])
+        ends = starts + self.block_size
+        b = ends * a[starts] - (weighted_sums[ends] - weighted_sums[starts])
+        weak = ((b + self.block_size) % _ADLER_MOD) << 16 | a_mod[starts]
+        positions = np.searchsorted(self.weak_values, weak)
+        positions[positions == len(self.weak_values)] = 0
+        found = self.weak_values[positions] == weak
+        yield from zip(starts[found].tolist(), weak[found].tolist())
+
+
+def _merge(ops: List[DeltaOp]) -> List[DeltaOp]:
+    """Join adjacent ops that take contiguous bytes from the same place"""
+    merged: List[DeltaOp] = []
+    for offset, length, old_offset in ops:
+        if merged:
+            last_offset, last_length, last_old_offset = merged[-1]
+            if (old_offset is None and last_old_offset is None) or (
+                old_offset is not None and last_old_offset is not None and last_old_offset + last_length == old_offset
+            ):
+                merged[-1] = (last_offset, last_length + length, last_old_offset)
+                continue
+        merged.append((offset, length, old_offset))
+    return merged
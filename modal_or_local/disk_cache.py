@@ -0,0 +1,206 @@
+"""
+Opt-in local read-through disk cache for files read from modal volumes with ModalOrLocal.read_file().
+Cached content is keyed by (volume, path, size, mtime) so a changed file is never served stale once its metadata is checked.
+Files are written atomically (temp file + rename) so several processes can share one cache directory.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from tempfile import NamedTemporaryFile
+from typing import Callable, Dict, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from modal_or_local import ModalOrLocal
+
+
+EVICT_TO_FRACTION = 0.9
+"""Eviction frees space down to this fraction of max_bytes, so a full cache is scanned once per several misses rather than on each"""
+
+
+class DiskCache:
+    """Read-through disk cache of volume files with a byte budget and least-recently-used eviction.
+
+    Usage: ModalOrLocal(volume_name=..., volume_mount_dir=..., cache=DiskCache(max_bytes=2 * 1024**3))
+    """
+
+    def __init__(
+        self,
+        cache_dir: Optional[str] = None,
+        max_bytes: int = 1024 * 1024 * 1024,
+        ttl_seconds: Optional[float] = None,
+    ):
+        """cache_dir defaults to ~/.cache/modal_or_local. If ttl_seconds is set, a file whose metadata was checked within the last
+        ttl_seconds is served from the cache without checking its metadata again (no RPC at all); otherwise every read checks
+        the file's size and mtime on the volume first (one cheap listing instead of a download)."""
+        self.cache_dir = cache_dir or os.path.join(
+            os.path.expanduser("~"), ".cache", "modal_or_local"
+        )
+        """Directory holding the cached files - may be shared by several processes"""
+        self.max_bytes = max_bytes
+        """Total size of cached content above which least recently used files are evicted"""
+        self.ttl_seconds = ttl_seconds
+        """How long a metadata check stays valid, None to check metadata on every read"""
+
+        self._stats_lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "bytes_saved": 0, "evictions": 0}
+        self._size_lock = threading.Lock()
+        self._total_bytes: Optional[int] = None  # Running total of cached data bytes, from the last scan of cache_dir plus files added since
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def __str__(self):
+        return (
+            __class__.__name__
+            + f"(cache_dir={self.cache_dir}, max_bytes={self.max_bytes}, ttl_seconds={self.ttl_seconds})"
+        )
+
+    def stats(self) -> Dict[str, int]:
+        """Return a copy of the hit/miss/bytes_saved/evictions counters"""
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def reset_stats(self):
+        """Zero the hit/miss/bytes_saved/evictions counters"""
+        with self._stats_lock:
+            for key in self._stats:
+                self._stats[key] = 0
+
+    def read_through(
+        self, mocal: "ModalOrLocal", file_full_path: str, fetch: Callable[[], bytes]
+    ) -> bytes:
+        """Return the content of file_full_path on mocal's volume from the cache, calling fetch() to download (and cache) it on a miss"""
+        ref_path = self._ref_path(mocal.volume_name, file_full_path)
+
+        # Within the ttl, trust the last metadata check and skip the RPC
+        if self.ttl_seconds is not None:
+            data_path = self._read_ref(ref_path, max_age=self.ttl_seconds)
+            if data_path:
+                content = self._read_data(data_path)
+                if content is not None:
+                    return self._hit(content)
+
+        fe = mocal.get_FileEntry(file_full_path)
+        if fe is None:
+            # Let fetch() raise whatever the volume raises for a missing file
+            self.invalidate(mocal.volume_name, file_full_path)
+            return fetch()
+
+        data_path = self._data_path(mocal.volume_name, file_full_path, fe.size, fe.mtime)
+        content = self._read_data(data_path)
+        if content is not None:
+            self._write_ref(ref_path, data_path)
+            return self._hit(content)
+
+        with self._stats_lock:
+            self._stats["misses"] += 1
+        content = fetch()
+        self._atomic_write(data_path, content)
+        self._write_ref(ref_path, data_path)
+        self._added(len(content))
+        return content
+
+    def invalidate(self, volume_name: str, file_full_path: str):
+        """Forget the last metadata check of the given file so the next read checks the volume again"""
+        try:
+            os.remove(self._ref_path(volume_name, file_full_path))
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        """Remove everything from the cache directory"""
+        for filename in os.listdir(self.cache_dir):
+            try:
+                os.remove(os.path.join(self.cache_dir, filename))
+            except FileNotFoundError:
+                pass
+        with self._size_lock:
+            self._total_bytes = 0
+
+    def _hit(self, content: bytes) -> bytes:
+        with self._stats_lock:
+            self._stats["hits"] += 1
+            self._stats["bytes_saved"] += len(content)
+        return content
+
+    def _data_path(self, volume_name: str, file_full_path: str, size: int, mtime: float) -> str:
+        key = f"{volume_name}\0{os.path.normpath(file_full_path)}\0{size}\0{mtime}"
+        return os.path.join(self.cache_dir, hashlib.sha256(key.encode()).hexdigest() + ".data")
+
+    def _ref_path(self, volume_name: str, file_full_path: str) -> str:
+        """Path of the small file recording which data file the last metadata check of (volume, path) resolved to, and when (its mtime)"""
+        key = f"{volume_name}\0{os.path.normpath(file_full_path)}"
+        return os.path.join(self.cache_dir, hashlib.sha256(key.encode()).hexdigest() + ".ref")
+
+    def _read_ref(self, ref_path: str, max_age: float) -> Optional[str]:
+        try:
+            if time.time() - os.stat(ref_path).st_mtime > max_age:
+                return None
+            with open(ref_path, "r") as f:
+                return os.path.join(self.cache_dir, f.read().strip())
+        except FileNotFoundError:
+            return None
+
+    def _write_ref(self, ref_path: str, data_path: str):
+        self._atomic_write(ref_path, os.path.basename(data_path).encode())
+
+    def _read_data(self, data_path: str) -> Optional[bytes]:
+        try:
+            with open(data_path, "rb") as f:
+                content = f.read()
+        except FileNotFoundError:
+            return None
+        # Mark as recently used for eviction
+        try:
+            os.utime(data_path)
+        except FileNotFoundError:
+            pass
+        return content
+
+    def _atomic_write(self, path: str, content: bytes):
+        """Write to a temp file in the cache dir then rename over path, so readers never see a partial file"""
+        with NamedTemporaryFile(dir=self.cache_dir, prefix=".tmp_", delete=False) as f:
+            f.write(content)
+        os.replace(f.name, path)
+
+    def _added(self, nbytes: int):
+        """Count nbytes of newly cached data, scanning the cache dir to evict only once the running total goes over max_bytes"""
+        with self._size_lock:
+            if self._total_bytes is not None:
+                self._total_bytes += nbytes
+                if self._total_bytes <= self.max_bytes:
+                    return
+            # Over the limit, or not scanned yet - the scan also picks up what other processes sharing the dir have added or removed
+            self._total_bytes = self._evict()
+
+    def _evict(self) -> int:
+        """If the total cached bytes are over max_bytes, remove least recently used data files until they are within
+        EVICT_TO_FRACTION of it. Returns the total left"""
+        entries = []
+        total_bytes = 0
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if not entry.name.endswith(".data"):
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+                total_bytes += st.st_size
+
+        if total_bytes <= self.max_bytes:
+            return total_bytes
+
+        for _, size, path in sorted(entries):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            total_bytes -= size
+            with self._stats_lock:
+                self._stats["evictions"] += 1
+            if total_bytes <= self.max_bytes * EVICT_TO_FRACTION:
+                break
+        return total_bytes
@@ -0,0 +1,231 @@
+"""
+In-process stand-in for the parts of modal.Volume used by ModalOrLocal (listdir, iterdir, read_file, batch_upload, remove_file,
+commit, reload), with configurable per-call latency and bandwidth. Used for benchmarks and for exercising the volume code paths
+without a Modal account:
+
+    from modal_or_local import ModalOrLocal, volume_registry
+    from modal_or_local.fake_volume import FakeVolume
+
+    volume_registry.register_volume("my_fake_volume", FakeVolume(latency_seconds=0.02))
+    mocal = ModalOrLocal(volume_name="my_fake_volume", volume_mount_dir="/mnt")
+
+Errors follow the modal client: GRPCError(Status.NOT_FOUND) for missing paths, FileNotFoundError from read_file().
+"""
+
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Generator, List, Optional, Set
+
+from grpclib import GRPCError, Status
+from modal.volume import FileEntry, FileEntryType
+
+
+class FakeVolume:
+    """Thread-safe in-memory volume. Every call sleeps latency_seconds, plus size/bandwidth for file content transferred"""
+
+    def __init__(
+        self,
+        latency_seconds: float = 0.0,
+        bandwidth_bytes_per_second: Optional[float] = None,
+        read_chunk_size: int = 8 * 1024 * 1024,
+    ):
+        self.latency_seconds = latency_seconds
+        """Simulated round trip time added to every call"""
+        self.bandwidth_bytes_per_second = bandwidth_bytes_per_second
+        """Simulated transfer rate for file content, None for unlimited"""
+        self.read_chunk_size = read_chunk_size
+        """Size of the chunks yielded by read_file()"""
+
+        self.calls: Counter = Counter()
+        """Number of calls made per method name"""
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+        self._lock = threading.RLock()
+        self._files: Dict[str, bytes] = {}
+        self._mtimes: Dict[str, int] = {"": int(time.time())}
+        self._children: Dict[str, Set[str]] = {"": set()}  # directory path -> names of its entries
+
+    def __str__(self):
+        return __class__.__name__ + f"(files={len(self._files)}, directories={len(self._children)}, latency_seconds={self.latency_seconds})"
+
+    def reset_counters(self):
+        """Zero calls, bytes_read and bytes_written"""
+        with self._lock:
+            self.calls.clear()
+            self.bytes_read = 0
+            self.bytes_written = 0
+
+    def put(self, path: str, content: bytes, mtime: Optional[float] = None):
+        """Add a file directly (no latency, not counted as a call) - for setting up test data"""
+        with self._lock:
+            self._add_file(self._norm(path), bytes(content), mtime)
+
+    def iterdir(self, path: str, recursive: bool = True) -> Generator[FileEntry, None, None]:
+        self._rpc("iterdir")
+        for entry in self._list(path, recursive):
+            yield entry
+
+    def listdir(self, path: str, recursive: bool = False) -> List[FileEntry]:
+        self._rpc("listdir")
+        return self._list(path, recursive)
+
+    def read_file(self, path: str) -> Generator[bytes, None, None]:
+        self._rpc("read_file")
+        norm_path = self._norm(path)
+        with self._lock:
+            content = self._files.get(norm_path)
+        if content is None:
+            raise FileNotFoundError(f"No such file: {path}")
+        for start in range(0, len(content), self.read_chunk_size):
+            chunk = content[start : start + self.read_chunk_size]
+            self._transfer(len(chunk))
+            with self._lock:
+                self.bytes_read += len(chunk)
+            yield chunk
+
+    def remove_file(self, path: str, recursive: bool = False):
+        self._rpc("remove_file")
+        norm_path = self._norm(path)
+        with self._lock:
+            if norm_path in self._files:
+                self._remove_entry(norm_path)
+                return
+            if norm_path not in self._children or norm_path == "":
+                raise GRPCError(Status.NOT_FOUND, f"No such file or directory: {path}")
+            if self._children[norm_path] and not recursive:
+                raise GRPCError(Status.FAILED_PRECONDITION, f"Directory is not empty: {path}")
+            for child_path in [p for p in list(self._files) if p.startswith(norm_path + "/")]:
+                del self._files[child_path]
+                del self._mtimes[child_path]
+            for child_dir in [d for d in list(self._children) if d.startswith(norm_path + "/")]:
+                del self._children[child_dir]
+                del self._mtimes[child_dir]
+            self._remove_entry(norm_path)
+
+    @contextmanager
+    def batch_upload(self, force: bool = False):
+        self._rpc("batch_upload")
+        batch = _FakeBatch()
+        yield batch
+
+        # Like the modal client, everything is uploaded when the block exits
+        with self._lock:
+            if not force:
+                for remote_path, _ in batch.files:
+                    if remote_path in self._files:
+                        raise FileExistsError(f"{remote_path} already exists (use force=True to overwrite)")
+        total = sum(len(content) for _, content in batch.files)
+        self._transfer(total)
+        with self._lock:
+            for remote_path, content in batch.files:
+                self._add_file(remote_path, content)
+            self.bytes_written += total
+
+    def commit(self):
+        self._rpc("commit")
+
+    def reload(self):
+        self._rpc("reload")
+
+    def hydrate(self, *args, **kwargs) -> "FakeVolume":
+        return self
+
+    def _rpc(self, name: str):
+        with self._lock:
+            self.calls[name] += 1
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+
+    def _transfer(self, size: int):
+        if self.bandwidth_bytes_per_second and size:
+            time.sleep(size / self.bandwidth_bytes_per_second)
+
+    def _norm(self, path: str) -> str:
+        norm_path = os.path.normpath(os.path.join("/", path)).lstrip("/")
+        return "" if norm_path == "." else norm_path
+
+    def _entry(self, path: str) -> FileEntry:
+        if path in self._files:
+            return FileEntry(path=path, type=FileEntryType.FILE, mtime=self._mtimes[path], size=len(self._files[path]))
+        return FileEntry(path=path, type=FileEntryType.DIRECTORY, mtime=self._mtimes[path], size=0)
+
+    def _list(self, path: str, recursive: bool) -> List[FileEntry]:
+        norm_path = self._norm(path)
+        with self._lock:
+            if norm_path in self._files:
+                return [self._entry(norm_path)]
+            if norm_path not in self._children:
+                raise GRPCError(Status.NOT_FOUND, f"No such file or directory: {path}")
+            entries = []
+            pending = [norm_path]
+            while pending:
+                directory = pending.pop()
+                for name in sorted(self._children[directory]):
+                    child_path = f"{directory}/{name}" if directory else name
+                    entries.append(self._entry(child_path))
+                    if recursive and child_path in self._children:
+                        pending.append(child_path)
+            return entries
+
+    def _add_file(self, path: str, content: bytes, mtime: Optional[float] = None):
+        if path in self._children:
+            raise IsADirectoryError(f"{path} is a directory")
+        now = int(time.time() if mtime is None else mtime)
+        parent, _, name = path.rpartition("/")
+        self._ensure_directory(parent, now)
+        self._children[parent].add(name)
+        self._files[path] = content
+        self._mtimes[path] = now
+
+    def _ensure_directory(self, path: str, mtime: int):
+        if path in self._files:
+            raise NotADirectoryError(f"{path} is a file")
+        if path in self._children:
+            self._mtimes[path] = mtime
+            return
+        parent, _, name = path.rpartition("/")
+        self._ensure_directory(parent, mtime)
+        self._children[parent].add(name)
+        self._children[path] = set()
+        self._mtimes[path] = mtime
+
+    def _remove_entry(self, path: str):
+        parent, _, name = path.rpartition("/")
+        self._children[parent].discard(name)
+        self._files.pop(path, None)
+        self._children.pop(path, None)
+        self._mtimes.pop(path, None)
+
+
+class _FakeBatch:
+    """Collects the put_file/put_directory calls made inside FakeVolume.batch_upload()"""
+
+    def __init__(self):
+        self.files = []  # (normalized remote path, content)
+
+    def put_file(self, local_file, remote_path: str, mode: Optional[int] = None):
+        if isinstance(local_file, (str, os.PathLike)):
+            with open(local_file, "rb") as f:
+                content = f.read()
+        else:
+            content = local_file.read()
+        self.files.append((_norm_remote(remote_path), content))
+
+    def put_directory(self, local_path: str, remote_path: str, recursive: bool = True):
+        for dirpath, dirnames, filenames in os.walk(local_path):
+            relative_dir = os.path.relpath(dirpath, local_path)
+            for filename in filenames:
+                self.put_file(
+                    os.path.join(dirpath, filename),
+                    os.path.join(remote_path, relative_dir, filename),
+                )
+            if not recursive:
+                break
+
+
+def _norm_remote(path: str) -> str:
+    return os.path.normpath(os.path.join("/", path)).lstrip("/")
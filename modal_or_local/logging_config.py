@@ -8,9 +8,6 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 # Define the logs directory relative to the base directory
 LOGS_DIR = os.path.join(BASE_DIR, "logs")
 
-# Create the logs directory if it doesn't exist
-os.makedirs(LOGS_DIR, exist_ok=True)
-
 LOGGING_CONFIG = {
     "version": 1,
     "disable_existing_loggers": False,
@@ -30,6 +27,7 @@ LOGGING_CONFIG = {
             "formatter": "standard",
             "level": "INFO",
             "filename": os.path.join(LOGS_DIR, "app.log"),
+            "delay": True,  # Do not open (or require) the log file until something is logged
         },
     },
     "loggers": {
@@ -48,3 +46,14 @@ LOGGING_CONFIG = {
 
 #dictConfig(LOGGING_CONFIG)
 #logger = logging.getLogger("modal_or_local." + __name__)
+
+
+def configure_logging(config: dict = LOGGING_CONFIG):
+    """Create the logs directory used by the file handler (if it doesn't exist) and apply the logging config.
+    This is not done at import time so importing modal_or_local has no file system side effects."""
+    from logging.config import dictConfig
+
+    for handler in config.get("handlers", {}).values():
+        if handler.get("filename"):
+            os.makedirs(os.path.dirname(handler["filename"]), exist_ok=True)
+    dictConfig(config)
@@ -0,0 +1,413 @@
+"""
+Per-operation metrics for ModalOrLocal: call counts, errors, bytes read/written and latency histograms per operation and
+backend branch, plus the volume RPCs (listdir, iterdir, read_file, batch_upload, remove_file, ...) each operation made.
+
+    mocal = ModalOrLocal(volume_name=..., volume_mount_dir=..., metrics=True)
+    mocal.walk(...)
+    print(mocal.metrics.snapshot())
+    print(mocal.metrics.to_prometheus())
+
+When disabled (the default) each instrumented call costs one attribute check.
+Components with state of their own (e.g. the ConcurrencyController of modal_or_local.concurrency) register it as gauges, which are read
+when a snapshot is taken whether or not recording is enabled.
+"""
+
+import functools
+import inspect
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+DEFAULT_LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+"""Upper bounds (seconds) of the latency histogram buckets, an implicit +Inf bucket follows"""
+
+
+class _Stats:
+    """Counters and latency histogram for one operation/branch or one RPC"""
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.calls = 0
+        self.errors = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.seconds_total = 0.0
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.rpcs: Dict[str, int] = {}
+
+    def observe(self, seconds: float, error: bool):
+        self.calls += 1
+        self.errors += 1 if error else 0
+        self.seconds_total += seconds
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                self.bucket_counts[i] += 1
+                return
+        self.bucket_counts[-1] += 1
+
+    def as_dict(self) -> Dict[str, Any]:
+        stats = {
+            "calls": self.calls,
+            "errors": self.errors,
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+            "seconds_total": self.seconds_total,
+            "latency_buckets": {
+                **{str(bound): count for bound, count in zip(self.buckets, self.bucket_counts)},
+                "+Inf": self.bucket_counts[-1],
+            },
+        }
+        if self.rpcs:
+            stats["rpcs"] = dict(self.rpcs)
+        return stats
+
+
+class _Span:
+    """An in-progress operation. Generator operations (e.g. walk) are paused while their consumer runs"""
+
+    def __init__(self, operation: str, branch: str):
+        self.operation = operation
+        self.branch = branch
+        self.elapsed = 0.0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.rpcs: Dict[str, int] = {}
+        self._started: Optional[float] = None
+
+    def resume(self):
+        self._started = time.perf_counter()
+
+    def pause(self):
+        self.elapsed += time.perf_counter() - self._started
+
+
+class Metrics:
+    """Collects per-operation and per-RPC metrics for one or more ModalOrLocal instances"""
+
+    def __init__(self, enabled: bool = True, latency_buckets: Tuple[float, ...] = DEFAULT_LATENCY_BUCKETS):
+        self.enabled = enabled
+        """When False nothing is recorded"""
+        self.latency_buckets = tuple(latency_buckets)
+
+        self._lock = threading.Lock()
+        self._operations: Dict[Tuple[str, str], _Stats] = {}
+        self._rpcs: Dict[str, _Stats] = {}
+        self._gauges: Dict[str, Callable[[], Dict[str, Any]]] = {}  # name -> function returning the current values
+        self._local = threading.local()  # Per thread stack of the _Spans in progress
+
+    def __str__(self):
+        return __class__.__name__ + f"(enabled={self.enabled})"
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        """Forget everything recorded so far"""
+        with self._lock:
+            self._operations.clear()
+            self._rpcs.clear()
+
+    def register_gauges(self, name: str, read: Callable[[], Dict[str, Any]]):
+        """Include the dict returned by read() in every snapshot under ["gauges"][name] (replacing any gauges already registered as name).
+        Its numbers (and dicts of numbers) are also exported by to_prometheus()"""
+        with self._lock:
+            self._gauges[name] = read
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return everything recorded so far as plain dicts:
+        {"operations": {operation: {branch: stats}}, "rpcs": {rpc: stats}} where stats has calls, errors, bytes_read, bytes_written,
+        seconds_total, latency_buckets (count per bucket upper bound, not cumulative) and for operations the rpcs made ({rpc: count}).
+        If any gauges are registered (see register_gauges()) their current values are under "gauges": {name: values}"""
+        with self._lock:
+            operations: Dict[str, Dict[str, Any]] = {}
+            for (operation, branch), stats in self._operations.items():
+                operations.setdefault(operation, {})[branch] = stats.as_dict()
+            snapshot: Dict[str, Any] = {
+                "operations": operations,
+                "rpcs": {rpc: stats.as_dict() for rpc, stats in self._rpcs.items()},
+            }
+            gauges = dict(self._gauges)
+        if gauges:
+            # Read outside the lock, the gauges have locks of their own
+            snapshot["gauges"] = {name: read() for name, read in gauges.items()}
+        return snapshot
+
+    def to_json(self, indent: Optional[int] = 4) -> str:
+        """Return snapshot() as json"""
+        return json.dumps(self.snapshot(), indent=indent)
+
+    def to_prometheus(self, prefix: str = "modal_or_local") -> str:
+        """Return snapshot() in the Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        lines: List[str] = []
+
+        def add_stats(kind: str, labels: str, stats: Dict[str, Any]):
+            lines.append(f"{prefix}_{kind}_calls_total{{{labels}}} {stats['calls']}")
+            lines.append(f"{prefix}_{kind}_errors_total{{{labels}}} {stats['errors']}")
+            lines.append(f"{prefix}_{kind}_bytes_read_total{{{labels}}} {stats['bytes_read']}")
+            lines.append(f"{prefix}_{kind}_bytes_written_total{{{labels}}} {stats['bytes_written']}")
+            cumulative = 0
+            for bound, count in stats["latency_buckets"].items():
+                cumulative += count
+                lines.append(f'{prefix}_{kind}_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"{prefix}_{kind}_seconds_sum{{{labels}}} {stats['seconds_total']}")
+            lines.append(f"{prefix}_{kind}_seconds_count{{{labels}}} {stats['calls']}")
+
+        for operation, branches in sorted(snapshot["operations"].items()):
+            for branch, stats in sorted(branches.items()):
+                labels = f'operation="{operation}",branch="{branch}"'
+                add_stats("operation", labels, stats)
+                for rpc, count in sorted(stats.get("rpcs", {}).items()):
+                    lines.append(f'{prefix}_operation_rpcs_total{{{labels},rpc="{rpc}"}} {count}')
+        for rpc, stats in sorted(snapshot["rpcs"].items()):
+            add_stats("rpc", f'rpc="{rpc}"', stats)
+        for name, values in sorted(snapshot.get("gauges", {}).items()):
+            for key, value in sorted(values.items()):
+                if isinstance(value, dict):
+                    for label, number in sorted(value.items()):
+                        lines.append(f'{prefix}_{name}_{key}{{key="{label}"}} {number}')
+                elif isinstance(value, (int, float)):
+                    lines.append(f"{prefix}_{name}_{key} {value}")
+        return "\n".join(lines) + "\n"
+
+    def add_bytes(self, read: int = 0, written: int = 0):
+        """Count bytes read/written against the operation in progress on this thread (if any)"""
+        if not self.enabled:
+            return
+        stack = self._stack()
+        if stack:
+            stack[-1].bytes_read += read
+            stack[-1].bytes_written += written
+
+    @contextmanager
+    def operation(self, operation: str, branch: str):
+        """Record the enclosed block as one call of operation on the given branch"""
+        span = self._start(operation, branch)
+        error = False
+        try:
+            yield span
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self._finish(span, error)
+
+    @contextmanager
+    def rpc(self, rpc: str, bytes_read: int = 0, bytes_written: int = 0):
+        """Record the enclosed block as one volume RPC, attributed to the outermost operation in progress on this thread"""
+        started = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.record_rpc(rpc, time.perf_counter() - started, error, bytes_read, bytes_written)
+
+    def record_rpc(self, rpc: str, seconds: float, error: bool = False, bytes_read: int = 0, bytes_written: int = 0):
+        """Record one volume RPC that has already completed"""
+        stack = self._stack()
+        if stack:
+            stack[0].rpcs[rpc] = stack[0].rpcs.get(rpc, 0) + 1
+        with self._lock:
+            stats = self._rpcs.get(rpc)
+            if stats is None:
+                stats = self._rpcs[rpc] = _Stats(self.latency_buckets)
+            stats.observe(seconds, error)
+            stats.bytes_read += bytes_read
+            stats.bytes_written += bytes_written
+
+    def _stack(self) -> List[_Span]:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _start(self, operation: str, branch: str) -> _Span:
+        span = _Span(operation, branch)
+        self._stack().append(span)
+        span.resume()
+        return span
+
+    def _finish(self, span: _Span, error: bool, pause: bool = True):
+        if pause:
+            span.pause()
+        stack = self._stack()
+        if stack and stack[-1] is span:
+            stack.pop()
+        with self._lock:
+            stats = self._operations.get((span.operation, span.branch))
+            if stats is None:
+                stats = self._operations[(span.operation, span.branch)] = _Stats(self.latency_buckets)
+            stats.observe(span.elapsed, error)
+            stats.bytes_read += span.bytes_read
+            stats.bytes_written += span.bytes_written
+            for rpc, count in span.rpcs.items():
+                stats.rpcs[rpc] = stats.rpcs.get(rpc, 0) + count
+
+
+def measured(operation: Optional[str] = None) -> Callable:
+    """Decorator for ModalOrLocal methods recording each call in self.metrics under operation (default the method name)
+    and the branch given by self.backend_branch(). Generator methods are only timed while producing items."""
+
+    def decorator(method: Callable) -> Callable:
+        name = operation or method.__name__
+
+        if inspect.isgeneratorfunction(method):
+
+            @functools.wraps(method)
+            def generator_wrapper(self, *args, **kwargs):
+                metrics = self.metrics
+                if not metrics.enabled:
+                    yield from method(self, *args, **kwargs)
+                    return
+
+                span = _Span(name, self.backend_branch())
+                generator = method(self, *args, **kwargs)
+                error = False
+                try:
+                    while True:
+                        # Only time (and attribute RPCs to) this generator while it is running, not while the consumer is
+                        metrics._stack().append(span)
+                        span.resume()
+                        try:
+                            item = next(generator)
+                        except StopIteration:
+                            return
+                        except BaseException:
+                            error = True
+                            raise
+                        finally:
+                            span.pause()
+                            metrics._stack().pop()
+                        yield item
+                finally:
+                    generator.close()
+                    metrics._finish(span, error, pause=False)
+
+            return generator_wrapper
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            metrics = self.metrics
+            if not metrics.enabled:
+                return method(self, *args, **kwargs)
+            with metrics.operation(name, self.backend_branch()):
+                return method(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class InstrumentedVolume:
+    """Wraps a modal.Volume, recording each RPC made through it in a Metrics instance. Other attributes pass through"""
+
+    def __init__(self, volume: Any, metrics: Metrics):
+        self._volume = volume
+        self._metrics = metrics
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._volume, name)
+
+    def listdir(self, *args, **kwargs):
+        with self._metrics.rpc("listdir"):
+            return self._volume.listdir(*args, **kwargs)
+
+    def iterdir(self, *args, **kwargs):
+        yield from self._timed_generator("iterdir", self._volume.iterdir(*args, **kwargs), count_bytes=False)
+
+    def read_file(self, *args, **kwargs):
+        yield from self._timed_generator("read_file", self._volume.read_file(*args, **kwargs), count_bytes=True)
+
+    def remove_file(self, *args, **kwargs):
+        with self._metrics.rpc("remove_file"):
+            return self._volume.remove_file(*args, **kwargs)
+
+    def commit(self, *args, **kwargs):
+        with self._metrics.rpc("commit"):
+            return self._volume.commit(*args, **kwargs)
+
+    def reload(self, *args, **kwargs):
+        with self._metrics.rpc("reload"):
+            return self._volume.reload(*args, **kwargs)
+
+    @contextmanager
+    def batch_upload(self, *args, **kwargs):
+        started = time.perf_counter()
+        error = False
+        uploader = _CountingBatch(None)
+        try:
+            with self._volume.batch_upload(*args, **kwargs) as batch:
+                uploader._batch = batch
+                yield uploader
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self._metrics.record_rpc(
+                "batch_upload", time.perf_counter() - started, error, bytes_written=uploader.bytes_written
+            )
+
+    def _timed_generator(self, rpc: str, generator, count_bytes: bool):
+        # Time is only counted while the volume is producing items, not while the consumer handles them
+        seconds = 0.0
+        size = 0
+        error = False
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    item = next(generator)
+                except StopIteration:
+                    return
+                except BaseException:
+                    error = True
+                    raise
+                finally:
+                    seconds += time.perf_counter() - started
+                if count_bytes:
+                    size += len(item)
+                yield item
+        finally:
+            close = getattr(generator, "close", None)
+            if close:
+                close()
+            self._metrics.record_rpc(rpc, seconds, error, bytes_read=size)
+
+
+class _CountingBatch:
+    """Wraps a volume batch_upload() batch, counting the bytes of the files put"""
+
+    def __init__(self, batch: Any):
+        self._batch = batch
+        self.bytes_written = 0
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._batch, name)
+
+    def put_file(self, local_file, remote_path, *args, **kwargs):
+        self.bytes_written += _size_of(local_file)
+        return self._batch.put_file(local_file, remote_path, *args, **kwargs)
+
+
+def _size_of(local_file) -> int:
+    """Size of a local file path or seekable file-like object (0 if it cannot be determined)"""
+    import os
+
+    if isinstance(local_file, (str, os.PathLike)):
+        return os.path.getsize(local_file)
+    try:
+        position = local_file.tell()
+        size = local_file.seek(0, os.SEEK_END) - position
+        local_file.seek(position)
+        return size
+    except (AttributeError, OSError):
+        return 0
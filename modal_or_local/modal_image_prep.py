@@ -1,6 +1,9 @@
-from modal import Image, is_local
 import pathlib
 import os
+from typing import List, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from modal import Image
 
 # Get the path of the current module
 current_module_path = pathlib.Path(__file__).resolve().parent
@@ -9,24 +12,28 @@ parent_dir = current_module_path.parent
 # Construct the path to the requirements.txt file
 requirements_file = os.path.join(parent_dir, "requirements.txt")
 
-# Check if the requirements.txt file exists
-if is_local() and os.path.isfile(requirements_file):
-    with open(requirements_file, "r") as f:
-        requirements = [req for req in f.read().splitlines() if req]
-        # print(f"{requirements=}")
-else:
-    requirements = []
+
+def read_requirements() -> List[str]:
+    """Return the requirements listed in requirements.txt when running locally from a checkout, otherwise an empty list"""
+    from modal import is_local
+
+    # Check if the requirements.txt file exists
+    if is_local() and os.path.isfile(requirements_file):
+        with open(requirements_file, "r") as f:
+            return [req for req in f.read().splitlines() if req]
+    return []
 
 
-def setup_image() -> Image:
+def setup_image() -> "Image":
     """Prepares an Image to be run on Modal that has all things needed to support the modal_or_local project"""
+    from modal import Image
 
     # Note the image.run_commands() etc do not change the image value but return a new image
     # This means if additional changes are to be made, they can be made here or post with image = image.<new commands>
     image = (
         Image.debian_slim(python_version="3.10")
         .apt_install("git")
-        .pip_install(*requirements)
+        .pip_install(*read_requirements())
         .workdir("/root")
         .env({"MY_ENV_VAR": "value"})
         .run_commands(
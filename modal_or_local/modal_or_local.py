@@ -1,30 +1,121 @@
 import json
 import os
 import modal
-from pathlib import Path
-from typing import Any, List, Generator, Tuple
+from contextlib import ExitStack, contextmanager
+from functools import partial
+from itertools import chain
+from mmap import ACCESS_READ, mmap as MemoryMap
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Generator, Optional, Tuple, TypeVar, Union, TYPE_CHECKING
 from modal.volume import FileEntry, FileEntryType
-from io import BytesIO
-from grpclib import Status, GRPCError
+
+from modal_or_local import volume_registry
+from modal_or_local.backends import StorageBackend, choose_backend, is_not_found_error  # noqa: F401 (is_not_found_error used to live here)
+from modal_or_local.commit_coalescer import CommitCoalescer, flush_at_exit
+from modal_or_local.concurrency import ConcurrencyController
+from modal_or_local.metrics import InstrumentedVolume, Metrics, measured
+from modal_or_local.object_codecs import Codec, resolve_codec
+from modal_or_local.reload_policy import ReloadPolicy
+
+if TYPE_CHECKING:
+    from modal_or_local.batch_session import BatchSession
+    from modal_or_local.disk_cache import DiskCache
+    from modal_or_local.transfer_budget import TransferBudget
 
 #import logging
 #logger = logging.getLogger("modal_or_local." + __name__)
 
+T = TypeVar("T")
+
 
 # Class can use either local directory or a modal volume to store/retrieve files, create directories, etc.
 class ModalOrLocal:
     """Class to allow directory/file calls to be made to a modal volume or a local filesystem"""
 
-    def __init__(self, volume_name: str = None, volume_mount_dir: str = None):
+    SPOOL_MAX_MEMORY_BYTES = 64 * 1024 * 1024
+    """Size above which open_write() spools content for a volume upload to a temp file on disk rather than memory"""
+
+    def __init__(
+        self,
+        volume_name: str = None,
+        volume_mount_dir: str = None,
+        cache: Optional["DiskCache"] = None,
+        prewarm: bool = False,
+        metrics: Union[bool, Metrics] = False,
+        backend: Optional[StorageBackend] = None,
+        walk_workers: int = 1,
+        walk_ordered: bool = True,
+        transfer_budget: Optional["TransferBudget"] = None,
+        concurrency: Union[bool, ConcurrencyController] = False,
+        auto_commit: Union[bool, CommitCoalescer] = False,
+        reload_policy: Union[str, ReloadPolicy] = "never",
+    ):
         # If volume name is not set, all methods will pull from the local filesystem
         self.volume_name = volume_name  # Name of the volume to be used. If None the local filesystem will be used
         self.volume_mount_dir = volume_mount_dir  # Directory used to mount this volume
-        self.volume = None
-        if volume_name:
-            self.volume = modal.Volume.from_name(volume_name, create_if_missing=True)
+        self.cache = cache  # Optional modal_or_local.disk_cache.DiskCache used by read_file() when reading through the volume API
+        self.metrics = (
+            metrics if isinstance(metrics, Metrics) else Metrics(enabled=bool(metrics))
+        )  # Call counts, bytes and latencies per operation and volume RPC, see modal_or_local.metrics. A Metrics may be shared between instances
+
+        self.walk_workers = walk_workers  # Directories walk()/walk_entries() list at once (see modal_or_local.parallel_walk). 1 walks serially
+        self.walk_ordered = walk_ordered  # If False a parallel walk yields each directory as soon as it is listed instead of depth first
+        self.concurrency = (
+            concurrency if isinstance(concurrency, ConcurrencyController) else ConcurrencyController() if concurrency else None
+        )  # Adaptive limit on the calls parallel operations make at once, see modal_or_local.concurrency. None runs fixed worker counts
+        if self.concurrency:
+            self.metrics.register_gauges("concurrency", self.concurrency.snapshot)
+        self.transfer_budget = transfer_budget  # Optional modal_or_local.transfer_budget.TransferBudget bounding the bytes and files copies hold in flight. May be shared between instances
+
+        self._du_cache: Dict[Tuple[str, Optional[int]], Dict] = {}  # (path, depth) -> du() result, dropped by writes through this instance
+
+        # Where files actually live, see modal_or_local.backends. Chosen once here unless one is passed (e.g. backends.InMemoryBackend())
+        self.backend = backend if backend is not None else choose_backend(self)
+
+        # Writes through this instance not yet committed, on a backend that needs committing (a mounted volume). With auto_commit they are
+        # committed in batches (see modal_or_local.commit_coalescer), otherwise by flush() and on leaving a with block
+        if isinstance(auto_commit, CommitCoalescer):
+            self.commits = auto_commit
+        else:
+            self.commits = CommitCoalescer() if auto_commit else CommitCoalescer(max_writes=None, max_bytes=None, max_seconds=None)
+        self.commits.bind(self._commit_volume)
+        if self.commits.automatic:
+            flush_at_exit(self.commits)
+        if self.commits.automatic or self.backend.needs_commit:
+            self.metrics.register_gauges("commits", self.commits.snapshot)
+
+        # When a mounted volume is reloaded to see changes committed elsewhere (see modal_or_local.reload_policy), never while the writes
+        # tracked above are uncommitted
+        self.reload_policy = reload_policy if isinstance(reload_policy, ReloadPolicy) else ReloadPolicy(reload_policy)
+        self.reload_policy.bind(self._reload_volume, lambda: not self.commits.dirty, self._read_generation)
+        if self.reload_policy.mode != "never":
+            self.metrics.register_gauges("reloads", self.reload_policy.snapshot)
+
+        # The modal.Volume handle is shared per volume name and looked up on first use (see the volume property)
+        # If prewarm is set, it is looked up and hydrated in a background thread now instead
+        if volume_name and prewarm:
+            volume_registry.prewarm(volume_name)
 
         # print(f"ModalOrLocal init setting {volume_name=}, {volume_mount_dir=}")
 
+    @property
+    def volume(self) -> Optional[modal.Volume]:
+        """The modal.Volume for volume_name (None if using the local filesystem), shared with every other ModalOrLocal for the same volume"""
+        if not self.volume_name:
+            return None
+        return volume_registry.get_volume(self.volume_name)
+
+    @property
+    def _rpc_volume(self) -> Any:
+        """The volume to make RPCs through - instrumented to record each call when metrics are enabled"""
+        if self.metrics.enabled:
+            return InstrumentedVolume(self.volume, self.metrics)
+        return self.volume
+
+    def backend_branch(self) -> str:
+        """Name of the backend used for this instance: 'volume_api' (a volume used through the modal API, i.e. running locally),
+        'mounted_volume' (a volume mounted while running remotely), 'local' (the local filesystem) or the name of a backend passed in"""
+        return self.backend.name
+
     def __str__(self):
         props = []
         if self.volume_name:
@@ -33,102 +124,254 @@ class ModalOrLocal:
             props.append(f"volume_mount_dir={self.volume_mount_dir}")
         return __class__.__name__ + "(" + ", ".join(props) + ")"
 
+    def __enter__(self) -> "ModalOrLocal":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+    def flush(self) -> bool:
+        """Commit the writes made through this instance to a mounted volume that have not been committed yet (see auto_commit).
+        Returns true if a commit was made; elsewhere writes need no commit and this does nothing"""
+        return self.commits.flush()
+
+    def reload(self) -> bool:
+        """Reload a mounted volume to see changes committed by other containers, unless writes made through this instance are not committed
+        yet (see flush()). Returns true if the volume was reloaded; elsewhere there is nothing to reload and this does nothing"""
+        if not self.backend.needs_commit:
+            return False
+        return self.reload_policy.reload()
+
+    def _commit_volume(self):
+        if self.reload_policy.mode == "generation":
+            # Readers using the generation policy reload once they see this change
+            generation_full_path = os.path.join(self.volume_mount_dir, self.reload_policy.generation_file)
+            self.backend.write(generation_full_path, self.reload_policy.next_generation().encode())
+        self.backend.commit()
+
+    def _reload_volume(self):
+        self.backend.reload()
+        self._du_cache.clear()
+
+    def _read_generation(self) -> Optional[str]:
+        # Through the volume API, which sees the latest commit rather than the mounted view
+        try:
+            return b"".join(self._rpc_volume.read_file(self.reload_policy.generation_file)).decode()
+        except Exception as e:
+            if is_not_found_error(e):
+                return None
+            raise
+
+    def _refresh(self):
+        """Reload a mounted volume if the reload policy says it may be stale"""
+        if self.backend.needs_commit:
+            self.reload_policy.before_read()
+
+    def _fresh(self, read: Callable[..., T], *args: Any) -> T:
+        """Return read(*args), a read from the backend, first reloading a mounted volume if the reload policy says it may be stale, and
+        retrying after a reload if the path was not found (an exception, or None from stat()) and the policy is on_miss"""
+        if not self.backend.needs_commit:
+            return read(*args)
+        self._refresh()
+        try:
+            result = read(*args)
+        except Exception as e:
+            if is_not_found_error(e) and self.reload_policy.after_miss():
+                return read(*args)
+            raise
+        if result is None and self.reload_policy.after_miss():
+            return read(*args)
+        return result
+
+    def _fresh_iter(self, list_entries: Callable[..., Iterator[T]], *args: Any) -> Iterator[T]:
+        """As _fresh() for a streamed listing, which only raises that the path was not found once started: the first item is read
+        under the retry and the rest streamed after it"""
+
+        def started() -> Iterator[T]:
+            entries = iter(list_entries(*args))
+            for entry in entries:
+                return chain([entry], entries)
+            return iter([])
+
+        yield from self._fresh(started)
+
+    @measured()
     def read_json_file(self, json_file_full_path: str) -> Any:
         """Load json from the given file - works on filesystem or on volume"""
-        if modal.is_local() and self.volume:
-            # Read using the modal volume tools - volume.read_file() apparently expects a "relative" path from / and does not use the volume mount dir in path
-
-            prepped_path = self.path_without_volume_mount_dir(
-                json_file_full_path, volume_mount_dir_required=True
-            )
-            if prepped_path.startswith("/"):
-                prepped_path = prepped_path.replace("/", "", 1)
-            # print(f"Reading {prepped_path=} with read_file() from {self.volume_name=}", "locally" if modal.is_local() else "remotely")
-            file_contents = b""
-            for chunk in self.volume.read_file(path=prepped_path):
-                file_contents += chunk
-
-            metadata = json.loads(file_contents)
-        else:
-            # Reading from local filesystem, or reading (from mounted volume) while running remotely
-            # print(f"Reading {json_file_full_path=} with open()", "locally" if modal.is_local() else "remotely")
-            with open(json_file_full_path, "r") as f:
-                metadata = json.load(f)
-        return metadata
+        return json.loads(self.read_file(json_file_full_path))
 
+    @measured()
     def write_json_file(
         self, new_json_file_full_path: str, metadata: Any, force: bool = True
     ):
         """Write a json file to either the local filesystem or to a volume. This will create any needed parent directories automatically."""
+        self.write_file(
+            new_json_file_full_path, json.dumps(metadata, indent=4).encode(), force=force
+        )
+        # print("Wrote metadata to", new_json_file_full_path, "mtime is", self.get_mtime(new_json_file_full_path))
 
-        if modal.is_local() and self.volume:
-            # Reading locally from volume
-
-            prepped_path = self.path_without_volume_mount_dir(
-                new_json_file_full_path, volume_mount_dir_required=True
-            )
-            prepped_path = os.path.normpath(os.path.join("/", prepped_path))
-            # logger.debug("write_json_file: prepped path is '%s'", prepped_path)
-
-            json_encoded = json.dumps(metadata, indent=4).encode()
-
-            with self.volume.batch_upload(force=force) as batch:
-                batch.put_file(BytesIO(json_encoded), prepped_path)
-            # print("Put json metadata file to", prepped_path)
-
-        else:  # Writing to local filesystem or writing to mounted volume while running remotely
-            # Create the directories if they do not already exist
-            os.makedirs(os.path.dirname(new_json_file_full_path), exist_ok=True)
-            with open(new_json_file_full_path, "w") as f:
-                json.dump(metadata, f, indent=4)
-            # print("Wrote metadata to", new_json_file_full_path, "mtime is", self.get_mtime(new_json_file_full_path))
-
+    @measured()
     def write_file(
         self, new_file_full_path: str, encoded_content: Any, force: bool = True
     ):
         """Write the encoded content to a file in either the local filesystem or to a volume. This will create any needed parent directories automatically."""
-
-        if modal.is_local() and self.volume:
-            # Reading locally from volume
-
-            prepped_path = self.path_without_volume_mount_dir(
-                new_file_full_path, volume_mount_dir_required=True
-            )
-            prepped_path = os.path.normpath(os.path.join("/", prepped_path))
-            # logger.debug(f"write_file: will put_file to {prepped_path=}")
-
-            # Prior to https://github.com/modal-labs/modal-client/pull/1962 (modal 0.63-ish) this would fail on files bigger than 4MB
-            with self.volume.batch_upload(force=force) as batch:
-                batch.put_file(BytesIO(encoded_content), prepped_path)
-            # print("Put encoded_content to file at", prepped_path)
-
-        else:  # Writing to local filesystem or writing to mounted volume while running remotely
-            os.makedirs(os.path.dirname(new_file_full_path), exist_ok=True)
-            with open(new_file_full_path, "wb") as f:
-                f.write(encoded_content)
-            # print("Wrote encoded_content to", new_file_full_path)
-
-    def read_file(self, file_full_path: str) -> Any:
-        """Load content from the given file - works on filesystem or on volume"""
-        if modal.is_local() and self.volume:
-            # Read using the modal volume tools - volume.read_file() apparently expects a "relative" path from / and does not use the volume mount dir in path
-            prepped_path = self.path_without_volume_mount_dir(
-                file_full_path, volume_mount_dir_required=True
+        self.metrics.add_bytes(written=len(encoded_content))
+        self.backend.write(new_file_full_path, encoded_content, force=force)
+        self._written(new_file_full_path, len(encoded_content))
+
+    @measured()
+    def read_file(self, file_full_path: str, mmap: bool = False) -> Any:
+        """Load content from the given file - works on filesystem or on volume.
+        If mmap is True a read-only memoryview is returned instead of bytes. Where the file is directly accessible (local filesystem, or a
+        mounted volume while running remotely) the view is backed by an mmap of the file, so slicing it does not copy. Through the volume
+        API the content is read as usual and wrapped in a memoryview. See also open_mmap() for explicit lifetime handling."""
+        if mmap:
+            local_path = self.backend.local_path(file_full_path)
+            if local_path:
+                # The mmap stays open for as long as the returned view (or any slice of it) is referenced
+                return self._fresh(self._mmap_local_file, local_path)
+
+        if self.cache and self.backend.remote:
+            file_contents = self.cache.read_through(
+                self, file_full_path, lambda: self.backend.read(file_full_path)
             )
-            if prepped_path.startswith("/"):
-                prepped_path = prepped_path.replace("/", "", 1)
-            # print(f"Reading {prepped_path=} with read_file() from {self.volume_name=}", "locally" if modal.is_local() else "remotely")
-            file_contents = b""
-            for chunk in self.volume.read_file(path=prepped_path):
-                file_contents += chunk
-
         else:
-            # Reading from local filesystem, or reading (from mounted volume) while running remotely
-            # print(f"Reading {file_full_path=} with open()", "locally" if modal.is_local() else "remotely")
-            with open(file_full_path, "rb") as f:
-                file_contents = f.read()
+            file_contents = self._fresh(self.backend.read, file_full_path)
+        self.metrics.add_bytes(read=len(file_contents))
+        if mmap:
+            return memoryview(file_contents)
         return file_contents
 
+    @measured()
+    def read_file_range(self, file_full_path: str, offset: int, length: int) -> bytes:
+        """Return up to length bytes of the given file starting at offset (fewer if the file ends first) - works on filesystem or on volume.
+        Locally (or on a mounted volume while running remotely) this is a single pread. Through the volume API, chunks before the range are
+        skipped without being kept and the download is stopped as soon as the range has been delivered."""
+        if offset < 0 or length < 0:
+            raise ValueError(f"Expected non-negative offset and length but got {offset=}, {length=}")
+        if length == 0:
+            return b""
+
+        file_range = self._fresh(self.backend.read_range, file_full_path, offset, length)
+        self.metrics.add_bytes(read=len(file_range))
+        return file_range
+
+    @contextmanager
+    def open_mmap(self, file_full_path: str) -> Iterator[memoryview]:
+        """Context manager giving a read-only memoryview of the given file, backed by mmap where the file is directly accessible
+        (local filesystem, or a mounted volume while running remotely) and by the streamed content when read through the volume API.
+        The view is released (and the mmap closed) on exit, so slices of it must not be kept beyond the with block."""
+        view = self.read_file(file_full_path, mmap=True)
+        source = view.obj
+        try:
+            yield view
+        finally:
+            view.release()
+            if isinstance(source, MemoryMap):
+                source.close()
+
+    def _mmap_local_file(self, file_full_path: str) -> memoryview:
+        """Return a read-only memoryview of a file on the local filesystem (or mounted volume) backed by mmap"""
+        with open(file_full_path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                # Empty files cannot be mapped
+                return memoryview(b"")
+            return memoryview(MemoryMap(f.fileno(), 0, access=ACCESS_READ))
+
+    @measured()
+    def write_object(
+        self,
+        new_file_full_path: str,
+        obj: Any,
+        codec: Optional[Union[str, Codec]] = None,
+        force: bool = True,
+    ):
+        """Serialize obj to a file in either the local filesystem or a volume using the given codec (name or Codec instance).
+        If codec is None it is chosen by the file extension (e.g. .msgpack, .pkl5, .npy). See modal_or_local.object_codecs"""
+        resolved_codec = resolve_codec(new_file_full_path, codec)
+        with self.open_write(new_file_full_path, force=force) as f:
+            resolved_codec.dump(obj, f)
+
+    @measured()
+    def read_object(
+        self, file_full_path: str, codec: Optional[Union[str, Codec]] = None
+    ) -> Any:
+        """Deserialize an object from the given file using the given codec, or the one registered for the file extension"""
+        resolved_codec = resolve_codec(file_full_path, codec)
+        with self.open_read(file_full_path) as f:
+            return resolved_codec.load(f)
+
+    @measured()
+    def write_array(self, new_file_full_path: str, array: Any, force: bool = True):
+        """Write a numpy array in .npy format to the local filesystem or a volume. Requires the optional numpy package"""
+        from modal_or_local.object_codecs import get_codec
+
+        with self.open_write(new_file_full_path, force=force) as f:
+            get_codec("npy").dump(array, f)
+
+    @measured()
+    def read_array(self, file_full_path: str, mmap: bool = True) -> Any:
+        """Read a numpy array from a .npy file. Requires the optional numpy package.
+        On the local filesystem (or a mounted volume while running remotely) the array is memory mapped read-only when mmap is True,
+        otherwise it is loaded into memory. Through the volume API the data is streamed straight into an array preallocated from the .npy header.
+        """
+        from modal_or_local.object_codecs import import_optional, read_npy_into_array
+
+        local_path = self.backend.local_path(file_full_path)
+        if not local_path:
+            with self.open_read(file_full_path) as f:
+                return read_npy_into_array(f)
+
+        np = import_optional("numpy")
+        return np.load(local_path, mmap_mode="r" if mmap else None, allow_pickle=False)
+
+    @contextmanager
+    def open_read(self, file_full_path: str) -> Iterator[BinaryIO]:
+        """Context manager giving a binary file-like object to stream the content of the given file - works on filesystem or on volume"""
+        with ExitStack() as stack:
+            yield self._fresh(lambda: stack.enter_context(self.backend.open_read(file_full_path)))
+
+    @contextmanager
+    def open_write(
+        self, new_file_full_path: str, force: bool = True, max_memory_bytes: Optional[int] = None
+    ) -> Iterator[BinaryIO]:
+        """Context manager giving a binary file-like object to write the given file in either the local filesystem or to a volume.
+        This will create any needed parent directories automatically. For volumes the content is uploaded when the context exits, and
+        is spooled to a temp file on disk once larger than max_memory_bytes (SPOOL_MAX_MEMORY_BYTES if None) until then."""
+        with self.backend.open_write(new_file_full_path, force=force, max_memory_bytes=max_memory_bytes) as f:
+            yield f
+            nbytes = f.tell()
+        self._written(new_file_full_path, nbytes)
+
+    def _written(self, full_path: str, nbytes: int = 0):
+        """Note that the given path was written (nbytes) or removed through this instance: drop what is cached about it, and count it
+        towards the next commit if the backend needs committing"""
+        self._invalidate_cached(full_path)
+        if self.backend.needs_commit:
+            self.commits.record_write(nbytes)
+
+    def _invalidate_cached(self, full_path: str):
+        """Drop anything cached about the given path (its DiskCache copy, du() results covering it) after it was written or removed
+        through this instance"""
+        if self.cache and self.backend.remote:
+            self.cache.invalidate(self.volume_name, full_path)
+        if self._du_cache:
+            norm_path = self._du_path(full_path)
+            for key in list(self._du_cache):
+                du_path = key[0]
+                if du_path == "/" or norm_path == du_path or norm_path.startswith(du_path + "/") or du_path.startswith(norm_path + "/"):
+                    self._du_cache.pop(key, None)
+
+    def batch(self, memory_limit_bytes: int = 256 * 1024 * 1024) -> "BatchSession":
+        """Return a write-behind session to use as a context manager: 'with mocal.batch() as b: b.write_file(...)'.
+        Writes, directory creations and removals made through the session are buffered (content beyond memory_limit_bytes is spilled to
+        a local temp dir), coalesced, and flushed with as few volume batch_upload() calls as possible when the with block exits.
+        Reads made through the session see the pending changes. See modal_or_local.batch_session.BatchSession"""
+        from modal_or_local.batch_session import BatchSession
+
+        return BatchSession(self, memory_limit_bytes=memory_limit_bytes)
+
+    @measured()
     def remove_file_or_directory(
         self, file_or_dir_to_remove_full_path: str, dne_ok: bool = False
     ):
@@ -142,25 +385,55 @@ class ModalOrLocal:
             return
 
         # Remove the given file or directory
-        if modal.is_local() and self.volume:
-            # Remove the file/dir from the volume
-            # Make sure there is a leading slash in the case of a bare filename passed
+        # print(f"Removing {file_or_dir_to_remove_full_path} with", self.backend)
+        self.backend.remove(file_or_dir_to_remove_full_path, dne_ok=dne_ok)
+        self._written(file_or_dir_to_remove_full_path)
 
-            prepped_path = self.path_without_volume_mount_dir(
-                file_or_dir_to_remove_full_path, volume_mount_dir_required=True
-            )
-            # print(f"Removing {prepped_path} ({file_or_dir_to_remove_full_path}) from volume", self.volume_name)
-            self.volume.remove_file(prepped_path, recursive=True)
-        else:
-            # Remove directly from the filesystem or mounted volume
-            # print(f"Removing from filesystem:",file_or_dir_to_remove_full_path)
-            if os.path.isfile(file_or_dir_to_remove_full_path):
-                os.remove(file_or_dir_to_remove_full_path)
-            if os.path.isdir(file_or_dir_to_remove_full_path):
-                from shutil import rmtree
+    @measured()
+    def remove_files(
+        self, full_paths: List[str], dne_ok: bool = True, workers: int = 8
+    ):
+        """Remove the given files/directories from the filesystem or modal volume, using up to workers concurrent removals.
+        Unlike remove_file_or_directory() there is no existence check per path; a path that does not exist is treated as removed when dne_ok is True.
+        Paths inside another given directory are covered by that directory's (recursive) removal and not removed separately.
+        With a concurrency controller the number of removals at once is adapted instead, and transient failures are retried."""
+
+        # Sorting by path components puts each directory directly before everything inside it, so nested paths can be dropped in one pass
+        collapsed_paths = []
+        for norm_path in sorted(
+            {os.path.normpath(os.path.join("/", p)) for p in full_paths},
+            key=lambda p: p.split("/"),
+        ):
+            if collapsed_paths and (
+                collapsed_paths[-1] == "/"
+                or norm_path.startswith(collapsed_paths[-1] + "/")
+            ):
+                continue
+            collapsed_paths.append(norm_path)
+
+        if not collapsed_paths:
+            return
+        if len(collapsed_paths) == 1 or workers <= 1:
+            for path in collapsed_paths:
+                self._remove_without_check(path, dne_ok)
+            return
+
+        from concurrent.futures import ThreadPoolExecutor
 
-                rmtree(file_or_dir_to_remove_full_path)
+        remove = partial(self._remove_without_check, dne_ok=dne_ok)
+        if self.concurrency:
+            workers = self.concurrency.threads(workers)
+            remove = partial(self.concurrency.call, "remove", self._remove_without_check, dne_ok=dne_ok, idempotent=False)
+        with ThreadPoolExecutor(max_workers=min(workers, len(collapsed_paths))) as executor:
+            # list() so the first failure is raised here
+            list(executor.map(remove, collapsed_paths))
 
+    def _remove_without_check(self, full_path: str, dne_ok: bool):
+        """Remove the given file or directory (recursively) without first checking that it exists"""
+        self.backend.remove(full_path, dne_ok=dne_ok)
+        self._written(full_path)
+
+    @measured()
     def file_or_dir_exists(self, full_path) -> bool:
         """Returns true if the passed file or directory exists in the volume/local filesystem"""
         fe = self.get_FileEntry(full_path)
@@ -205,6 +478,7 @@ class ModalOrLocal:
             return True
         return False
 
+    @measured()
     def listdir(
         self, dir_full_path: str = None, return_full_paths: bool = False
     ) -> List[str]:
@@ -221,77 +495,66 @@ class ModalOrLocal:
         if not self.isdir(dir_full_path):
             raise RuntimeError(f"No such file or directory: {dir_full_path}")
 
-        if modal.is_local() and self.volume:
-            # Remove the volume mount dir from the path if it was passed as part of the full path
-            prepped_path = self.path_without_volume_mount_dir(
-                dir_full_path, volume_mount_dir_required=True
-            )
-            for f in self.volume.iterdir(prepped_path, recursive=False):
-                if return_full_paths:
-                    list_to_return.append(
-                        str(
-                            os.path.normpath(
-                                os.path.join("/", self.volume_mount_dir, f.path)
-                            )
-                        )
-                    )
-                else:
-                    filename = os.path.basename(f.path)
-                    list_to_return.append(filename)
-        else:
-            # Get the list from the local filesystem
-            for filename in sorted(os.listdir(dir_full_path)):
-                if return_full_paths:
-                    list_to_return.append(
-                        str(
-                            os.path.normpath(os.path.join("/", dir_full_path, filename))
-                        )
-                    )
-                else:
-                    list_to_return.append(filename)
+        for filename in self.backend.list_names(dir_full_path):
+            if return_full_paths:
+                list_to_return.append(
+                    str(os.path.normpath(os.path.join("/", dir_full_path, filename)))
+                )
+            else:
+                list_to_return.append(filename)
         return list_to_return
 
     import os
 
+    @measured()
+    def iterdir(
+        self, dir_full_path: str, recursive: bool = False
+    ) -> Generator[FileEntry, None, None]:
+        """Yield a FileEntry (see get_FileEntry()) for each entry of the given directory, or for everything under it if recursive.
+        Through the volume API a recursive listing is a single streamed call."""
+        if recursive:
+            yield from self._fresh_iter(self.backend.list_recursive, dir_full_path)
+        else:
+            yield from self._fresh(self.backend.list, dir_full_path)
+
+    @measured()
     def walk(
-        self, dir_full_path: str
+        self, dir_full_path: str, workers: Optional[int] = None, ordered: Optional[bool] = None, prune: bool = True
     ) -> Generator[Tuple[str, list[str], list[str]], None, None]:
         """
         Return a generator of (dirpath, dirs, files) tuples similar to os.walk(). Uses os.walk() if not using a volume and running locally.
         Note dirpath will include the volume_mount_dir if applicable.
+        With workers > 1 (default walk_workers) sibling directories are listed concurrently by a thread pool, which helps where each listing
+        is a round trip (a mounted volume, the volume API); with a concurrency controller (see modal_or_local.concurrency) it decides how
+        many at a time. Unless ordered (default walk_ordered) directories are then yielded as soon as they are listed. Removing names from
+        dirs does not prune a parallel walk.
+        Pass prune=False if dirs will not be edited to skip directories: through the volume API the whole walk then comes from a single
+        recursive listing instead of one iterdir per directory.
 
         Yields:
             Tuple[str, list[str], list[str]]: A tuple containing the current directory path,
             a list of subdirectory names, and a list of filenames.
         """
-        if modal.is_local() and self.volume:
-            # Remove the volume mount dir if it was passed as part of the full path
-            prepped_path = self.path_without_volume_mount_dir(
-                dir_full_path, volume_mount_dir_required=True
-            )
-
-            # Add the entries from the given directory
-            dirpath = dir_full_path
-            dirnames = []
-            filenames = []
-
-            for entry in self.volume.iterdir(prepped_path, recursive=False):
-                # print(f"walk {entry=}, {prepped_path=}")
-                if entry.type == FileEntryType.DIRECTORY:
-                    dirnames.append(os.path.basename(entry.path))
-                else:
-                    filenames.append(os.path.basename(entry.path))
-
-            # print("yielding", (os.path.join(self.volume_mount_dir, dirpath), dirnames, filenames))
-            yield (os.path.join(self.volume_mount_dir, dirpath), dirnames, filenames)
-
-            # Walk the other directories found
-            for dir_to_walk in sorted(dirnames):
-                yield from self.walk(os.path.join(dir_full_path, dir_to_walk))
-        else:
-            # Get the list from the local filesystem
-            yield from os.walk(dir_full_path)
-
+        self._refresh()
+        yield from self.backend.walk(dir_full_path, *self._walk_options(workers, ordered), prune=prune, controller=self.concurrency)
+
+    @measured()
+    def walk_entries(
+        self, dir_full_path: str, workers: Optional[int] = None, ordered: Optional[bool] = None, prune: bool = True
+    ) -> Generator[Tuple[str, List[FileEntry], List[FileEntry]], None, None]:
+        """Like walk() but yielding (dirpath, dir_entries, file_entries) with a FileEntry (see get_FileEntry()) for each subdirectory and file,
+        so sizes and mtimes are available without a get_FileEntry() call per path. Locally this is an os.scandir() walk using the DirEntry
+        stat results; through the volume API it is one iterdir per directory, or one recursive iterdir if prune is False."""
+        self._refresh()
+        yield from self.backend.walk_entries(dir_full_path, *self._walk_options(workers, ordered), prune=prune, controller=self.concurrency)
+
+    def _walk_options(self, workers: Optional[int], ordered: Optional[bool]) -> Tuple[int, bool]:
+        return (
+            self.walk_workers if workers is None else workers,
+            self.walk_ordered if ordered is None else ordered,
+        )
+
+    @measured()
     def create_directory(self, dir_full_path: str, exists_ok: bool = True):
         """Create a directory (and parent dirs as needed) on the local filesystem or on a volume"""
 
@@ -304,44 +567,59 @@ class ModalOrLocal:
         elif self.isfile(dir_full_path):
             raise RuntimeError(f"Path {dir_full_path} already exists as a file")
 
-        if modal.is_local() and self.volume:
-            # Create the dir on the volume
-            # Remove the volume mount dir if it was passed as part of the full path
-            prepped_path = self.path_without_volume_mount_dir(
-                dir_full_path, volume_mount_dir_required=True
-            )
-
-            # Create a temp directory (with a temp file) locally to "directory_put" up to the volume
-            temp_dir = os.path.join("/tmp", "tmp_create_directory_" + str(os.getpid()))
-
-            # print(f"create_directory: Creating {temp_dir=}")
-            os.mkdir(temp_dir)
-            temp_file = os.path.join(temp_dir, "tmp.txt")
-            with open(temp_file, "w") as f:
-                f.write(
-                    "This is a temp file for modal.batch_upload to create a directory - it can be safely removed\n"
-                )
-
-            # print("putting", temp_dir, prepped_path)
-            with self.volume.batch_upload(force=True) as batch:
-                # print(f"create_directory: Putting {temp_dir=}, {prepped_path=}")
-                batch.put_directory(temp_dir, prepped_path)
+        # On a volume this uploads (and then removes) a placeholder file, since volumes cannot hold empty directories
+        self.backend.create_directory(dir_full_path)
+        self._written(dir_full_path)
+
+    @measured()
+    def du(self, full_path: str, depth: Optional[int] = None, cached: bool = False) -> Dict:
+        """Return disk usage of the given file or directory from a single recursive listing, as a dict:
+        {"path", "bytes", "files", "directories", "children"} where children maps each subdirectory name to the same dict for it,
+        down to depth levels (None for all, 0 for none). Counts include everything at any depth below each directory.
+        If cached is True a result from an earlier du() call on this instance is reused, unless a write/removal through this instance
+        has touched the path since."""
+        norm_path = self._du_path(full_path)
+        key = (norm_path, depth)
+        if cached and key in self._du_cache:
+            return self._du_cache[key]
+
+        entry = self.get_FileEntry(norm_path)
+        if entry is None:
+            raise RuntimeError(f"No such file or directory: {full_path}")
+        usage = _new_usage(norm_path)
+        if entry.type != FileEntryType.DIRECTORY:
+            usage["bytes"] = entry.size
+            usage["files"] = 1
+        else:
+            for entry in self.iterdir(norm_path, recursive=True):
+                relative_parts = os.path.relpath(os.path.join("/", entry.path), norm_path).split("/")
+                is_directory = entry.type == FileEntryType.DIRECTORY
+
+                # Count the entry in each directory above it, down to the depth of the breakdown
+                node = usage
+                _add_to_usage(node, entry.size, is_directory)
+                for level, name in enumerate(relative_parts[:-1], start=1):
+                    if depth is not None and level > depth:
+                        break
+                    if name not in node["children"]:
+                        node["children"][name] = _new_usage(os.path.join(node["path"], name))
+                    node = node["children"][name]
+                    _add_to_usage(node, entry.size, is_directory)
+                else:
+                    # node is the entry's parent - list directories even if they turn out to be empty
+                    if is_directory and (depth is None or len(relative_parts) <= depth) and relative_parts[-1] not in node["children"]:
+                        node["children"][relative_parts[-1]] = _new_usage(os.path.join(node["path"], relative_parts[-1]))
 
-            # print(f"Removing local {temp_file=} and {temp_dir=}")
-            os.remove(temp_file)
-            os.rmdir(temp_dir)
+        self._du_cache[key] = usage
+        return usage
 
-            # Remove the temporary file (tmp.txt) from the volume
-            temp_file_in_volume = os.path.join(
-                dir_full_path, os.path.basename(temp_file)
-            )
-            # print(f"Removing from volume {temp_file_in_volume=}")
-            self.remove_file_or_directory(temp_file_in_volume)
-        else:
-            # Creating a directory locally or on a volume while running remotely
-            if not os.path.isdir(dir_full_path):
-                os.makedirs(dir_full_path)
+    def _du_path(self, full_path: str) -> str:
+        # Volume paths are absolute (under the mount dir) already; a relative local path is taken from the working directory
+        if self.volume_name:
+            return os.path.normpath(os.path.join("/", full_path))
+        return os.path.abspath(full_path)
 
+    @measured()
     def get_mtime(self, full_path) -> float:
         """Returns most recent modified time (in seconds) of the given file/dir"""
         fe = self.get_FileEntry(full_path)
@@ -349,6 +627,7 @@ class ModalOrLocal:
             return None
         return fe.mtime
 
+    @measured()
     def get_FileEntry(self, full_path) -> FileEntry:
         """Return a modal.volume.FileEntry for the given path if it exists."""
 
@@ -357,95 +636,9 @@ class ModalOrLocal:
                 f"get_FileEntry was passed a blank full_path {full_path=}"
             )
 
-        if modal.is_local() and self.volume:
-            # Get the file info from the volume
-
-            prepped_path = self.path_without_volume_mount_dir(
-                full_path, volume_mount_dir_required=True
-            )
-            # volume.iterdir expects paths to be relative from "/", so remove any leading slash
-            if prepped_path != "/" and prepped_path.startswith("/"):
-                prepped_path = prepped_path.replace("/", "", 1)
-            # print(f"{prepped_path=}")
-
-            # Modal does not make getting a FileEntry for '/' available, so return a placeholder
-            if prepped_path == "/":
-                return FileEntry(
-                    path=self.volume_mount_dir.replace("/", "", 1),
-                    type=FileEntryType.DIRECTORY,
-                    mtime=0,
-                    size=0,
-                )
-
-            # If the full path is a file, volume.listdir() will return a single FileEntry
-            # Its also possible that there is a single file in the full_path directory, so we double check the path
-
-            try:
-                entries = self.volume.listdir(prepped_path)
-            except GRPCError as e:
-                if e.status == Status.NOT_FOUND:
-                    # The path does not exist on the volume
-                    return None
-                else:
-                    raise
-
-            # print(f"get_FileEntry: Checking for file '{prepped_path}' got ", f"{entries=}")
-            volume_mount_dir_no_lead_slash = self.volume_mount_dir.replace("/", "", 1)
-            if len(entries) == 1 and entries[0].path == prepped_path:
-                entry = entries[0]
-                # Add the volume mount directory back onto the start of path and return (note the entry itself is immutable)
-                return FileEntry(
-                    path=os.path.join(volume_mount_dir_no_lead_slash, entry.path),
-                    type=entry.type,
-                    mtime=entry.mtime,
-                    size=entry.size,
-                )
-
-            # Presuming full_path is a directory, list its parent to get the FileEntry
-            parent_dir = str(Path(prepped_path).parent)
-            if parent_dir == ".":
-                parent_dir = "/"
-            if parent_dir != "/" and parent_dir.startswith("/"):
-                parent_dir = parent_dir.replace("/", "", 1)
-            # print(f"{parent_dir=}")
-
-            # print("get_FileEntry: Checking for dir got ", self.volume.listdir(parent_dir))
-            for entry in self.volume.listdir(parent_dir):
-                if entry.path == prepped_path:
-                    # Add the volume mount directory back onto the start of path and return (note the entry itself is immutable)
-                    return FileEntry(
-                        path=os.path.join(volume_mount_dir_no_lead_slash, entry.path),
-                        type=entry.type,
-                        mtime=entry.mtime,
-                        size=entry.size,
-                    )
-
-            # Did not find a file or directory for the given path
-            return None
-
-        else:
-            # Get the file info from the local filesystem
-            # print(f"Getting FileEntry for {full_path=} from filesystem")
-            path = Path(full_path)
-            if not path.exists():
-                return None
-            entry_type = (
-                FileEntryType.FILE
-                if path.is_file()
-                else FileEntryType.DIRECTORY
-                if path.is_dir()
-                else None
-            )
-            path_to_return = str(path)
-            if path_to_return.startswith("/"):
-                path_to_return = path_to_return.replace("/", "", 1)
-            return FileEntry(
-                path=path_to_return,
-                type=entry_type,
-                mtime=path.stat().st_mtime,
-                size=path.stat().st_size,
-            )
+        return self._fresh(self.backend.stat, full_path)
 
+    @measured()
     def isdir(self, full_path) -> bool:
         """Return true if the given path exists and is a directory"""
         fe = self.get_FileEntry(full_path)
@@ -455,6 +648,7 @@ class ModalOrLocal:
             return True
         return False
 
+    @measured()
     def isfile(self, full_path) -> bool:
         """Return true if the given path exists and is a file"""
         fe = self.get_FileEntry(full_path)
@@ -493,3 +687,15 @@ class ModalOrLocal:
         self.remove_file_or_directory(my_file)
         mocal.remove_file_or_directory(mocal_file)
         return total / number_of_times_to_average
+
+
+def _new_usage(full_path: str) -> Dict:
+    return {"path": full_path, "bytes": 0, "files": 0, "directories": 0, "children": {}}
+
+
+def _add_to_usage(usage: Dict, size: int, is_directory: bool):
+    if is_directory:
+        usage["directories"] += 1
+    else:
+        usage["bytes"] += size
+        usage["files"] += 1
@@ -1,25 +1,82 @@
 from modal_or_local import ModalOrLocal
+import hashlib
 import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Collection, Dict, Generator, List, Optional, Tuple, TYPE_CHECKING, Union
+
+from modal.volume import FileEntryType
+
+from modal_or_local.backends import is_not_found_error
+from modal_or_local.delta import DEFAULT_BLOCK_SIZE, SIGNATURE_SUFFIX, SignatureBuilder, apply_delta, write_signature
+from modal_or_local.transfer_budget import TransferBudget
+
+if TYPE_CHECKING:
+    from modal_or_local.sync_executor import SyncExecutor
 
 #import logging
 #logger = logging.getLogger("modal_or_local." + __name__)
 
 """
 Provides utility functions for copying files to/from modal volumes and/or the local filesystem.
-This is currently pretty rudimentary. Future improvements can include chunking and maintaining timestamps/permissions.
+Files are streamed in chunks, and a digest of the source bytes is computed as they pass through so each copy can be checked against
+the source and destination sizes (and a digest stored in a sidecar file, if there is one) without reading anything a second time.
+Each chunk counts against the TransferBudget of the ModalOrLocals involved (see modal_or_local.transfer_budget) from being read until it
+is written, which is what bounds memory when copy_dir() copies many files at once. Under a budget with max_bytes, a copy to a volume
+spools no more than one chunk in memory before spilling to disk until the upload, rather than up to SPOOL_MAX_MEMORY_BYTES.
+Future improvements can include maintaining timestamps/permissions.
 """
 
+COPY_CHUNK_BYTES = 8 * 1024 * 1024
+"""Size of the chunks files are streamed through copy_file() in"""
+
+DEFAULT_DIGEST = "sha256"
+"""hashlib algorithm copy_file() uses to checksum the bytes it copies. Sidecar files are named <file>.<algorithm>"""
+
 
 def copy_file(
     source_mocal: ModalOrLocal,
     source_file_full_path: str,
     destination_mocal: ModalOrLocal,
     destination_full_path: str,
-):
+    digest: Optional[str] = DEFAULT_DIGEST,
+    sidecar: bool = False,
+    delta: bool = False,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    budget: Optional[TransferBudget] = None,
+) -> Dict[str, Any]:
     """Copy the given file from the source_mocal to the destination_full_path on the destination_mocal.
-    The destination_full_path can point to a file (will become the new name) or a directory."""
+    The destination_full_path can point to a file (will become the new name) or a directory.
+    The file is streamed in chunks while its digest (a hashlib algorithm name, or None to skip) is computed. The bytes read are checked
+    against the source size and the size written against the destination's, raising RuntimeError on a mismatch. If sidecar is True the
+    digest is also checked against the source's sidecar file (<file>.<digest>) when it has one, and written to one next to the destination.
+    If delta is True an existing destination is updated rsync style, taking only the changed blocks from the source, and a block signature
+    is kept next to it for the next delta copy (see modal_or_local.delta). Where that is not possible the whole file is copied.
+    The copy takes one of the budget's file slots and reserves each chunk against its bytes, waiting for room when they are used up by
+    other copies. The budget defaults to resolve_transfer_budget(source_mocal, destination_mocal).
+    Returns a dict with the source and destination paths, the file size in bytes, the bytes read from the source and reused from the
+    previous version (a delta copy from a volume through the API also reads the source's unchanged bytes before its last changed block), the digest and its algorithm, and the budget's peak bytes in flight: the most reserved at once across every copy
+    sharing it so far, which counts the chunks being copied but not memory used otherwise, e.g. by a spool waiting for upload."""
+    if budget is None:
+        budget = resolve_transfer_budget(source_mocal, destination_mocal)
+    with budget.file():
+        return _copy_file(
+            source_mocal, source_file_full_path, destination_mocal, destination_full_path, digest, sidecar, delta, block_size, budget
+        )
 
-    if not source_mocal.isfile(source_file_full_path):
+
+def _copy_file(
+    source_mocal: ModalOrLocal,
+    source_file_full_path: str,
+    destination_mocal: ModalOrLocal,
+    destination_full_path: str,
+    digest: Optional[str],
+    sidecar: bool,
+    delta: bool,
+    block_size: int,
+    budget: TransferBudget,
+) -> Dict[str, Any]:
+    source_entry = source_mocal.get_FileEntry(source_file_full_path)
+    if source_entry is None or source_entry.type != FileEntryType.FILE:
         raise RuntimeError(
             f"Could not locate {source_file_full_path=} in {source_mocal=}"
         )
@@ -34,11 +91,122 @@ def copy_file(
         # The destination path is what was passed
         destination_file_full_path = destination_full_path
 
-    # Read the data from the source file
-    file_data_encoded = source_mocal.read_file(source_file_full_path)
+    stored_digest = read_sidecar_digest(source_mocal, source_file_full_path, digest) if digest and sidecar else None
+    hasher = hashlib.new(digest) if digest else None
+    signature_builder = SignatureBuilder(block_size) if delta else None
+
+    def observe(chunk: bytes):
+        # Everything is computed from the bytes as they pass through, rather than by reading the file again
+        if hasher:
+            hasher.update(chunk)
+        if signature_builder:
+            signature_builder.update(chunk)
+
+    def check_stored_digest():
+        if stored_digest and hasher and hasher.hexdigest() != stored_digest:
+            raise RuntimeError(
+                f"The {digest} of {source_file_full_path=} is {hasher.hexdigest()} but its sidecar has {stored_digest}"
+            )
+
+    delta_transfer = None
+    if delta:
+        delta_transfer = apply_delta(
+            source_mocal, source_file_full_path, source_entry, destination_mocal, destination_file_full_path, block_size, observe, budget,
+            check=check_stored_digest,
+        )
+    if delta_transfer:
+        reused_bytes, copied_bytes = delta_transfer
+    else:
+        # Stream the data from the source file to the destination file
+        reused_bytes = 0
+        copied_bytes = 0
+        chunk_bytes = budget.chunk_size(COPY_CHUNK_BYTES)
+        # The reservation for a chunk ends once it is written, so a volume upload should not keep many more of them in memory
+        spool_bytes = chunk_bytes if budget.max_bytes else None
+        with source_mocal.open_read(source_file_full_path) as source, destination_mocal.open_write(
+            destination_file_full_path, max_memory_bytes=spool_bytes
+        ) as destination:
+            while copied_bytes <= source_entry.size:
+                # Only what is expected is reserved; the last read, of at most a byte, confirms the end of the file
+                nbytes = min(chunk_bytes, source_entry.size - copied_bytes) or 1
+                with budget.reserve(nbytes):
+                    chunk = source.read(nbytes)
+                    if not chunk:
+                        break
+                    observe(chunk)
+                    destination.write(chunk)
+                copied_bytes += len(chunk)
+
+            # Checked before leaving the block so a bad copy is not stored, and any existing destination file is kept
+            if copied_bytes != source_entry.size:
+                raise RuntimeError(
+                    f"Read {copied_bytes} bytes from {source_file_full_path=} but expected {source_entry.size}, the file may have changed during the copy"
+                )
+            check_stored_digest()
+    source_mocal.metrics.add_bytes(read=copied_bytes)
+    destination_mocal.metrics.add_bytes(written=copied_bytes)
+
+    # Only metadata is needed to confirm what landed - no second transfer of the content
+    destination_entry = destination_mocal.get_FileEntry(destination_file_full_path)
+    if destination_entry is None or destination_entry.size != source_entry.size:
+        raise RuntimeError(
+            f"Copied {source_entry.size} bytes to {destination_file_full_path=} but found {destination_entry=}"
+        )
+
+    file_digest = hasher.hexdigest() if hasher else None
+    if file_digest and sidecar:
+        destination_mocal.write_file(
+            sidecar_path(destination_file_full_path, digest),
+            f"{file_digest}  {os.path.basename(destination_file_full_path)}\n".encode(),
+        )
+    if signature_builder:
+        write_signature(destination_mocal, destination_file_full_path, signature_builder.finish(destination_entry.mtime))
+
+    return {
+        "source": source_file_full_path,
+        "destination": destination_file_full_path,
+        "bytes": source_entry.size,
+        "transferred_bytes": copied_bytes,
+        "reused_bytes": reused_bytes,
+        "digest": file_digest,
+        "algorithm": digest if hasher else None,
+        "peak_in_flight_bytes": budget.peak_bytes,
+    }
 
-    # Write the data to the destination file
-    destination_mocal.write_file(destination_file_full_path, file_data_encoded)
+
+def resolve_transfer_budget(source_mocal: ModalOrLocal, destination_mocal: ModalOrLocal) -> TransferBudget:
+    """Return the budget copies between the two count against: the destination's transfer_budget, else the source's, else a new unlimited
+    one (which still records the peak bytes in flight)"""
+    return destination_mocal.transfer_budget or source_mocal.transfer_budget or TransferBudget()
+
+
+def sidecar_path(file_full_path: str, digest: str = DEFAULT_DIGEST) -> str:
+    """Return the path of the sidecar file holding the digest of the given file"""
+    return f"{file_full_path}.{digest}"
+
+
+def is_sidecar_file(
+    name: str, names: Collection[str], digest: Optional[str] = DEFAULT_DIGEST, sidecar: bool = False, delta: bool = False
+) -> bool:
+    """Return true if the file name is a sidecar that copy_file() writes with the given options, which directory copies skip.
+    names are the other names in the same listing: <name>.<digest> is only a sidecar if <name> is there too, so a file of the user's
+    such as checksums.sha256 is still copied"""
+    for suffix in ([f".{digest}"] if sidecar and digest else []) + ([SIGNATURE_SUFFIX] if delta else []):
+        if name.endswith(suffix) and name[: -len(suffix)] in names:
+            return True
+    return False
+
+
+def read_sidecar_digest(mocal: ModalOrLocal, file_full_path: str, digest: str = DEFAULT_DIGEST) -> Optional[str]:
+    """Return the digest stored in the sidecar of the given file (sha256sum format: '<hex digest>  <name>'), or None if it has none"""
+    try:
+        content = mocal.read_file(sidecar_path(file_full_path, digest))
+    except Exception as e:
+        if is_not_found_error(e):
+            return None
+        raise
+    fields = bytes(content).decode().split()
+    return fields[0].lower() if fields else None
 
 
 def copy_dir(
@@ -46,10 +214,68 @@ def copy_dir(
     source_dir_full_path: str,
     destination_mocal: ModalOrLocal,
     destination_full_path: str,
-):
+    digest: Optional[str] = DEFAULT_DIGEST,
+    sidecar: bool = False,
+    delta: bool = False,
+    workers: int = 1,
+    executor: Optional["SyncExecutor"] = None,
+) -> List[Dict[str, Any]]:
     """Copy the given directory (and its contents) from the source_mocal source_dir_full_path to the destination_full_path on the destination_mocal.
     If the destination directory already exists, a copy of the source directory will be placed inside of it.
-    If the destination directory does not exist, a copy of the source directory will be created as the destination directory"""
+    If the destination directory does not exist, a copy of the source directory will be created as the destination directory.
+    Each file is copied and checked as by copy_file() with the given digest, sidecar and delta options; returns the copy_file() result for
+    each. Sidecar files those options write (digests, block signatures) are not copied from the source, since fresh ones are written.
+    Up to workers files are copied at once, within the transfer budget (see copy_file()); the results stay in walk order. If either
+    ModalOrLocal has a concurrency controller (the destination's is used first) it decides how many instead.
+    If an executor is given (see modal_or_local.sync_executor) the copy is planned here and run by it instead, e.g. in a Modal function
+    with both volumes mounted so the bytes do not pass through this machine."""
+    if executor is not None:
+        from modal_or_local.sync_executor import plan_copy_dir
+
+        return executor.run(
+            plan_copy_dir(source_mocal, source_dir_full_path, destination_mocal, destination_full_path, digest=digest, sidecar=sidecar, delta=delta)
+        )
+
+    source_dir_full_path, resolved_destination_full_path = resolve_copy_dir(
+        source_mocal, source_dir_full_path, destination_mocal, destination_full_path
+    )
+
+    def file_copies():
+        # Yields (source, destination) for each file while creating the destination directories as the walk reaches them
+        for source, destination in dir_copies(source_mocal, source_dir_full_path, resolved_destination_full_path, digest, sidecar, delta):
+            if source is not None:
+                yield source, destination
+            elif not destination_mocal.isdir(destination):
+                destination_mocal.create_directory(destination)
+
+    budget = resolve_transfer_budget(source_mocal, destination_mocal)
+    copy_options = dict(digest=digest, sidecar=sidecar, delta=delta, budget=budget)
+    if workers <= 1:
+        return [copy_file(source_mocal, source, destination_mocal, destination, **copy_options) for source, destination in file_copies()]
+
+    controller = destination_mocal.concurrency or source_mocal.concurrency
+    with ThreadPoolExecutor(max_workers=controller.threads(workers) if controller else workers, thread_name_prefix="modal_or_local-copy") as executor:
+        futures = []
+        try:
+            for source, destination in file_copies():
+                copy_args = (copy_file, source_mocal, source, destination_mocal, destination)
+                if controller:
+                    futures.append(executor.submit(controller.call, "copy", *copy_args, idempotent=False, **copy_options))
+                else:
+                    futures.append(executor.submit(*copy_args, **copy_options))
+            return [future.result() for future in futures]
+        except BaseException:
+            # Do not start the copies still queued
+            for future in futures:
+                future.cancel()
+            raise
+
+
+def resolve_copy_dir(
+    source_mocal: ModalOrLocal, source_dir_full_path: str, destination_mocal: ModalOrLocal, destination_full_path: str
+) -> Tuple[str, str]:
+    """Check the source directory exists and return it (without a trailing slash) and the directory copy_dir() copies it to: inside the
+    destination_full_path if that already exists, otherwise the destination_full_path itself"""
 
     # Make sure the source path exists and is a directory
     if not source_mocal.isdir(source_dir_full_path):
@@ -70,9 +296,24 @@ def copy_dir(
         # print(f"Destination dir {destination_full_path} already exists so {resolved_destination_full_path=}")
 
     # print(f"copy_dir: {destination_full_path=}, {resolved_destination_full_path=}")
-    for path, dirs, files in source_mocal.walk(source_dir_full_path):
+    return source_dir_full_path, resolved_destination_full_path
+
+
+def dir_copies(
+    source_mocal: ModalOrLocal,
+    source_dir_full_path: str,
+    resolved_destination_full_path: str,
+    digest: Optional[str] = DEFAULT_DIGEST,
+    sidecar: bool = False,
+    delta: bool = False,
+) -> Generator[Tuple[Optional[str], str], None, None]:
+    """Walk the source directory and yield (source, destination) for each file copy_dir() copies, and (None, destination) for each
+    directory it creates, in walk order (a directory's files come before its subdirectories)"""
+    for path, dirs, files in source_mocal.walk(source_dir_full_path, prune=False):
         # print ("copy_dir got entry:", path, dirs, files)
         for file in files:
+            if is_sidecar_file(file, files, digest, sidecar, delta):
+                continue
             file_source_full_path = os.path.join(path, file)
             file_relative_path = file_source_full_path.replace(
                 source_dir_full_path, ""
@@ -81,12 +322,7 @@ def copy_dir(
                 resolved_destination_full_path, file_relative_path
             )
             # print(f"Copying {file_source_full_path=} to {file_destination_full_path=}, {file_relative_path=}")
-            copy_file(
-                source_mocal,
-                file_source_full_path,
-                destination_mocal,
-                file_destination_full_path,
-            )
+            yield file_source_full_path, file_destination_full_path
         for dir in dirs:
             # print(f"Making sure {dir=} exists")
             dir_source_full_path = os.path.join(path, dir)
@@ -97,8 +333,7 @@ def copy_dir(
                 resolved_destination_full_path, dir_relative_path
             )
             # print(f"Making sure {dir_relative_path=} exists at {dir_destination_full_path=}, {dir_relative_path=}")
-            if not destination_mocal.isdir(dir_destination_full_path):
-                destination_mocal.create_directory(dir_destination_full_path)
+            yield None, dir_destination_full_path
 
 
 def copy(
@@ -106,12 +341,34 @@ def copy(
     source_path,
     destination_mocal: ModalOrLocal,
     destination_path,
-):
-    """Copy the source_path on the source volume or filesystem to the target_path on the destination volume or filesystem"""
+    digest: Optional[str] = DEFAULT_DIGEST,
+    sidecar: bool = False,
+    delta: bool = False,
+    workers: int = 1,
+    executor: Optional["SyncExecutor"] = None,
+) -> Union[Dict[str, Any], List[Dict[str, Any]]]:
+    """Copy the source_path on the source volume or filesystem to the target_path on the destination volume or filesystem.
+    Returns the copy_file() result for a file, or the list of them for a directory (copied up to workers files at once).
+    If an executor is given the copy is run by it (see modal_or_local.sync_executor)"""
     if source_mocal.isfile(source_path):
-        copy_file(source_mocal, source_path, destination_mocal, destination_path)
+        if executor is not None:
+            from modal_or_local.sync_executor import SyncPlan
+
+            plan = SyncPlan(source_mocal, destination_mocal, files=[(source_path, destination_path)], digest=digest, sidecar=sidecar, delta=delta)
+            return executor.run(plan)[0]
+        return copy_file(source_mocal, source_path, destination_mocal, destination_path, digest=digest, sidecar=sidecar, delta=delta)
     elif source_mocal.isdir(source_path):
-        copy_dir(source_mocal, source_path, destination_mocal, destination_path)
+        return copy_dir(
+            source_mocal,
+            source_path,
+            destination_mocal,
+            destination_path,
+            digest=digest,
+            sidecar=sidecar,
+            delta=delta,
+            workers=workers,
+            executor=executor,
+        )
     else:
         raise RuntimeError(f"Could not locate path {source_path=} in {source_mocal=}")
 
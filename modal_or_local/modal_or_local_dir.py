@@ -1,8 +1,9 @@
+import json
 import os
-from typing import Any, Dict, List, Optional, Generator, Tuple, TYPE_CHECKING
+from typing import Any, Dict, Iterable, List, Optional, Generator, Tuple, Union, TYPE_CHECKING
 
 from datetime import datetime
-from modal.volume import FileEntry
+from modal.volume import FileEntry, FileEntryType
 from warnings import warn
 
 #import logging
@@ -10,6 +11,8 @@ from warnings import warn
 
 if TYPE_CHECKING:
     from modal_or_local import ModalOrLocal
+    from modal_or_local.object_codecs import Codec
+    from modal_or_local.prefetch import PrefetchStore
 
 
 class ModalOrLocalDir:
@@ -55,6 +58,8 @@ class ModalOrLocalDir:
             # Will be using the local filesystem
             self.modal_or_local = ModalOrLocal()
 
+        self._prefetched: Optional["PrefetchStore"] = None  # Content downloaded by prefetch(), created on first use
+
         # If the directory is on a modal volume, make sure the path includes the volume mount dir
         if (
             self.modal_or_local.volume
@@ -108,6 +113,7 @@ class ModalOrLocalDir:
         self, json_file_relative_path: str, metadata: Any, force: bool = True
     ):
         """Write a json file to the directory. This will overwrite existing and create any needed parent/sub directories automatically."""
+        self._forget_prefetched(json_file_relative_path)
         return self.modal_or_local.write_json_file(
             new_json_file_full_path=self.get_full_path(json_file_relative_path),
             metadata=metadata,
@@ -115,7 +121,10 @@ class ModalOrLocalDir:
         )
 
     def read_json_file(self, json_file_relative_path: str) -> Any:
-        """Load json from the given file"""
+        """Load json from the given file (from memory if it was prefetched)"""
+        content = self._get_prefetched(json_file_relative_path)
+        if content is not None:
+            return json.loads(content)
         return self.modal_or_local.read_json_file(
             json_file_full_path=self.get_full_path(json_file_relative_path)
         )
@@ -124,18 +133,75 @@ class ModalOrLocalDir:
         self, new_file_relative_path: str, encoded_content: Any, force: bool = True
     ):
         """Write the encoded content to a file in either the local filesystem or to a volume. This will create any needed parent directories automatically."""
+        self._forget_prefetched(new_file_relative_path)
         return self.modal_or_local.write_file(
             new_file_full_path=self.get_full_path(new_file_relative_path),
             encoded_content=encoded_content,
             force=force,
         )
 
-    def read_file(self, file_relative_path: str) -> Any:
-        """Load content from the given file"""
+    def read_file(self, file_relative_path: str, mmap: bool = False) -> Any:
+        """Load content from the given file (from memory if it was prefetched). If mmap is True a read-only memoryview (backed by mmap where possible) is returned"""
+        content = self._get_prefetched(file_relative_path)
+        if content is not None:
+            return memoryview(content) if mmap else content
         return self.modal_or_local.read_file(
+            file_full_path=self.get_full_path(file_relative_path), mmap=mmap
+        )
+
+    def read_file_range(self, file_relative_path: str, offset: int, length: int) -> bytes:
+        """Return up to length bytes of the given file starting at offset, without reading the rest of the file"""
+        return self.modal_or_local.read_file_range(
+            file_full_path=self.get_full_path(file_relative_path),
+            offset=offset,
+            length=length,
+        )
+
+    def open_mmap(self, file_relative_path: str):
+        """Context manager giving a read-only memoryview of the given file, see ModalOrLocal.open_mmap()"""
+        return self.modal_or_local.open_mmap(
             file_full_path=self.get_full_path(file_relative_path)
         )
 
+    def write_object(
+        self,
+        new_file_relative_path: str,
+        obj: Any,
+        codec: Optional[Union[str, "Codec"]] = None,
+        force: bool = True,
+    ):
+        """Serialize obj to a file in our directory using the given codec, or the one registered for the file extension"""
+        self._forget_prefetched(new_file_relative_path)
+        return self.modal_or_local.write_object(
+            new_file_full_path=self.get_full_path(new_file_relative_path),
+            obj=obj,
+            codec=codec,
+            force=force,
+        )
+
+    def read_object(
+        self, file_relative_path: str, codec: Optional[Union[str, "Codec"]] = None
+    ) -> Any:
+        """Deserialize an object from the given file using the given codec, or the one registered for the file extension"""
+        return self.modal_or_local.read_object(
+            file_full_path=self.get_full_path(file_relative_path), codec=codec
+        )
+
+    def write_array(self, new_file_relative_path: str, array: Any, force: bool = True):
+        """Write a numpy array in .npy format to a file in our directory"""
+        self._forget_prefetched(new_file_relative_path)
+        return self.modal_or_local.write_array(
+            new_file_full_path=self.get_full_path(new_file_relative_path),
+            array=array,
+            force=force,
+        )
+
+    def read_array(self, file_relative_path: str, mmap: bool = True) -> Any:
+        """Read a numpy array from a .npy file in our directory, memory mapped where the file is directly accessible and mmap is True"""
+        return self.modal_or_local.read_array(
+            file_full_path=self.get_full_path(file_relative_path), mmap=mmap
+        )
+
     def file_or_dir_exists(self, file_relative_path: str) -> bool:
         """Returns true if the passed file or directory exists in our directory"""
         return self.modal_or_local.file_or_dir_exists(
@@ -168,13 +234,27 @@ class ModalOrLocalDir:
 
     def remove_file_or_directory(self, relative_path: str, dne_ok: bool = False):
         """Remove the given relative path (file or directory) from the filesystem or modal volume"""
+        self._forget_prefetched(relative_path)
         return self.modal_or_local.remove_file_or_directory(
             file_or_dir_to_remove_full_path=self.get_full_path(relative_path),
             dne_ok=dne_ok,
         )
 
+    def remove_files(
+        self, relative_paths: List[str], dne_ok: bool = True, workers: int = 8
+    ):
+        """Remove the given relative paths (files or directories) concurrently and without per-path existence checks, see ModalOrLocal.remove_files()"""
+        for relative_path in relative_paths:
+            self._forget_prefetched(relative_path)
+        return self.modal_or_local.remove_files(
+            [self.get_full_path(relative_path) for relative_path in relative_paths],
+            dne_ok=dne_ok,
+            workers=workers,
+        )
+
     def remove_own_directory(self, dne_ok: bool = False):
         """Remove the ModalOrLocalDir object's directory (self.dir_full_path) from the filesystem or modal volume"""
+        self.clear_prefetched()
         return self.modal_or_local.remove_file_or_directory(
             self.dir_full_path, dne_ok=dne_ok
         )
@@ -190,6 +270,47 @@ class ModalOrLocalDir:
         """
         yield self.modal_or_local.walk(dir_full_path=self.dir_full_path)
 
+    def du(self, depth: Optional[int] = 1, cached: bool = False) -> Dict:
+        """Return total bytes, file and directory counts for our directory with a per-subdirectory breakdown down to depth levels,
+        from a single recursive listing. See ModalOrLocal.du()"""
+        return self.modal_or_local.du(self.dir_full_path, depth=depth, cached=cached)
+
+    def glob(
+        self, pattern: str, recursive_listing: Optional[bool] = None
+    ) -> Generator[FileEntry, None, None]:
+        """Yield a FileEntry (see get_FileEntry()) for each file/dir in our directory matching the relative glob pattern, e.g. '*.json',
+        'shards/*/part-??.bin' or '**/*.json' ('**' matches any number of directories). Directories that cannot hold a match are not listed.
+        When the pattern has '**' and we are on the volume API a single recursive listing is used, unless recursive_listing says otherwise.
+        """
+        from modal_or_local.search import glob_entries
+
+        yield from glob_entries(
+            self.modal_or_local, self.dir_full_path, pattern, recursive_listing=recursive_listing
+        )
+
+    def find(
+        self,
+        name: Optional[str] = None,
+        min_size: Optional[int] = None,
+        max_size: Optional[int] = None,
+        newer_than: Optional[Union[datetime, float]] = None,
+        type: Optional[Union[str, FileEntryType]] = None,
+    ) -> Generator[FileEntry, None, None]:
+        """Yield a FileEntry for each file/dir anywhere under our directory matching all the given conditions (like the find command), from a
+        single recursive listing. name is a glob for the entry name, newer_than a datetime or seconds since the epoch, type 'file' or 'directory'
+        """
+        from modal_or_local.search import find_entries
+
+        yield from find_entries(
+            self.modal_or_local,
+            self.dir_full_path,
+            name=name,
+            min_size=min_size,
+            max_size=max_size,
+            newer_than=newer_than,
+            type=type,
+        )
+
     def report_changes(self, since_datetime: Optional[datetime] = None) -> Dict:
         """Return files/dirs that have changed in this directory since the given datetime (inclusive)
         Note this tries to give changed directories as well, but the mtimes changing on modal volume directories seems to be unreliable (maybe caching?).
@@ -200,45 +321,32 @@ class ModalOrLocalDir:
             "new_or_modified_directories": [],
         }
 
-        if since_datetime is None:
-            # Everything is considered new
-            # print(f"Walking without since_datetime {self.dir_full_path=}")
-            for path, dirs, files in self.modal_or_local.walk(self.dir_full_path):
-                # print(f"Walking {path=}, {dirs=}, {files=}")
-                for file in files:
-                    report["new_or_modified_files"].append(os.path.join(path, file))
-                for dir in dirs:
-                    report["new_or_modified_directories"].append(
-                        os.path.join(path, dir)
-                    )
-        else:
-            # Check for changes since the since_datetime
-            # print(f"Walking {since_datetime.timestamp()=} {self.dir_full_path=}")
-            for path, dirs, files in self.modal_or_local.walk(self.dir_full_path):
-                # print(f"Walking {path=}, {dirs=}, {files=}")
-                for file in files:
-                    full_path = os.path.join(path, file)
-                    mtime = self.modal_or_local.get_mtime(full_path)
-                    # print(f"  mtime of file {full_path} is {mtime}")
-                    if mtime >= since_datetime.timestamp():
-                        # print("  adding file", full_path, mtime-since_datetime.timestamp())
-                        report["new_or_modified_files"].append(full_path)
-
-                for dir in dirs:
-                    full_path = os.path.join(path, dir)
-                    mtime = self.modal_or_local.get_mtime(full_path)
-                    if mtime >= since_datetime.timestamp():
-                        report["new_or_modified_directories"].append(full_path)
+        # The mtimes come with the walk, rather than from a get_mtime() call per path
+        since_timestamp = since_datetime.timestamp() if since_datetime is not None else None
+        # print(f"Walking {since_timestamp=} {self.dir_full_path=}")
+        for path, dir_entries, file_entries in self.modal_or_local.walk_entries(self.dir_full_path, prune=False):
+            for entry in file_entries:
+                if since_timestamp is None or entry.mtime >= since_timestamp:
+                    report["new_or_modified_files"].append(os.path.join(path, os.path.basename(entry.path)))
+            for entry in dir_entries:
+                if since_timestamp is None or entry.mtime >= since_timestamp:
+                    report["new_or_modified_directories"].append(os.path.join(path, os.path.basename(entry.path)))
 
         return report
 
     def copy_changed_files_from(
-        self, source_mdir: "ModalOrLocalDir", since_date: datetime = None
+        self, source_mdir: "ModalOrLocalDir", since_date: datetime = None, sidecar: bool = False, delta: bool = False
     ) -> List[str]:
         """Copy files/dirs that have changed since the given date (if specified) and are newer than what is currently in this directory.
+        Each file is checksummed and size checked as it is copied (see copy_file()); with sidecar its digest is also written next to it.
+        With delta, files that already exist here are updated by transferring only their changed blocks (see modal_or_local.delta).
         Returns list of the relative paths of the files that were copied"""
+        from modal_or_local.modal_or_local_copy import is_sidecar_file
 
         changes = source_mdir.report_changes(since_date)
+        changed_relative_paths = {
+            str(file_full_path).replace(source_mdir.dir_full_path + "/", "") for file_full_path in changes.get("new_or_modified_files")
+        }
 
         copied_files = []
         for file_full_path in changes.get("new_or_modified_files"):
@@ -246,6 +354,8 @@ class ModalOrLocalDir:
             file_relative_path = str(file_full_path).replace(
                 source_mdir.dir_full_path + "/", ""
             )
+            if is_sidecar_file(file_relative_path, changed_relative_paths, sidecar=sidecar, delta=delta):
+                continue  # Written along with the file it is for
             existing_mtime = self.get_mtime(file_relative_path)
             source_mtime = source_mdir.get_mtime(file_relative_path)
 
@@ -255,6 +365,8 @@ class ModalOrLocalDir:
                     source_mdir=source_mdir,
                     source_file_relative_path=file_relative_path,
                     destination_relative_path=file_relative_path,
+                    sidecar=sidecar,
+                    delta=delta,
                 )
                 copied_files.append(file_relative_path)
 
@@ -268,20 +380,100 @@ class ModalOrLocalDir:
         source_mdir: "ModalOrLocalDir",
         source_file_relative_path: str,
         destination_relative_path: Optional[str] = None,
-    ):
+        digest: Optional[str] = "sha256",
+        sidecar: bool = False,
+        delta: bool = False,
+    ) -> Dict[str, Any]:
         """Copy a file from source_mdir/source_file_relative_path to the destination path in this directory.
         If destination_relative_path is an existing directory or ends with '/' the file will be of the same name and placed in that directory.
         If destination_relative_path is None or blank, the file will be copied to the same relative path it has at the source.
         Otherwise the file will be named according to the basename of destination_relative_path.
+        The copy is checksummed with digest and checked as it goes, and with delta an existing file is updated rsync style. See
+        modal_or_local_copy.copy_file(), whose result is returned.
         """
         if not destination_relative_path:
             destination_relative_path = source_file_relative_path
 
         from modal_or_local.modal_or_local_copy import copy_file
 
-        copy_file(
+        self._forget_prefetched(destination_relative_path)
+        return copy_file(
             source_mocal=source_mdir.modal_or_local,
             source_file_full_path=source_mdir.get_full_path(source_file_relative_path),
             destination_mocal=self.modal_or_local,
             destination_full_path=self.get_full_path(destination_relative_path),
+            digest=digest,
+            sidecar=sidecar,
+            delta=delta,
+        )
+
+    def prefetch(
+        self,
+        paths_or_globs: Union[str, Iterable[str]],
+        workers: int = 8,
+        max_bytes: Optional[int] = None,
+        wait: bool = True,
+    ) -> List[str]:
+        """Download the given files (relative paths, or glob patterns such as 'shards/*.bin' or '**/*.json') concurrently and keep their content
+        in memory, so the next read_file()/read_json_file() call for each does not wait on the volume (and takes the content, so it is not held
+        twice). Stops prefetching once the content held, from this and earlier calls, would exceed max_bytes (the rest are read normally). If wait is False this returns straight away and a read of a file still downloading waits for it.
+        Writes and removals through this object drop the affected content. Returns the relative paths requested."""
+        from modal_or_local.prefetch import PrefetchStore
+
+        relative_paths = self._expand_paths(paths_or_globs)
+        if self._prefetched is None:
+            self._prefetched = PrefetchStore()
+        self._prefetched.prefetch(
+            self.modal_or_local,
+            [(os.path.normpath(p), self.get_full_path(p)) for p in relative_paths],
+            workers=workers,
+            max_bytes=max_bytes,
+            wait=wait,
         )
+        return relative_paths
+
+    def clear_prefetched(self):
+        """Drop all content kept by prefetch()"""
+        if self._prefetched is not None:
+            self._prefetched.clear()
+
+    def iter_files(
+        self, paths_or_globs: Union[str, Iterable[str]], lookahead: int = 4, workers: int = 4
+    ) -> Generator[Tuple[str, bytes], None, None]:
+        """Yield (relative_path, content) for the given files (relative paths or glob patterns) in order, reading up to lookahead files ahead
+        of the one being processed so downloads overlap with the caller's work. Only about lookahead + 1 files are held in memory at once."""
+        from modal_or_local.prefetch import read_ahead
+
+        # read_file() serves files already prefetched from memory
+        yield from read_ahead(
+            self.read_file,
+            self._expand_paths(paths_or_globs),
+            lookahead=lookahead,
+            workers=workers,
+            controller=self.modal_or_local.concurrency,
+        )
+
+    def _expand_paths(self, paths_or_globs: Union[str, Iterable[str]]) -> List[str]:
+        """Return the relative paths given, with glob patterns replaced by the files matching them"""
+        from modal_or_local.search import entry_relative_path, has_magic
+
+        if isinstance(paths_or_globs, str):
+            paths_or_globs = [paths_or_globs]
+        relative_paths = []
+        for path_or_glob in paths_or_globs:
+            if not has_magic(path_or_glob):
+                relative_paths.append(path_or_glob)
+                continue
+            for entry in self.glob(path_or_glob):
+                if entry.type == FileEntryType.FILE:
+                    relative_paths.append(entry_relative_path(self.modal_or_local, entry, self.dir_full_path))
+        return relative_paths
+
+    def _get_prefetched(self, relative_path: str) -> Optional[bytes]:
+        if self._prefetched is None:
+            return None
+        return self._prefetched.get(os.path.normpath(relative_path))
+
+    def _forget_prefetched(self, relative_path: Optional[str]):
+        if self._prefetched is not None and relative_path:
+            self._prefetched.discard(os.path.normpath(relative_path))
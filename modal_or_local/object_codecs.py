@@ -0,0 +1,192 @@
+"""
+Codecs used by ModalOrLocal.write_object()/read_object() to persist typed Python objects.
+Each codec writes to and reads from a binary file-like object so data streams through the
+read/write paths instead of being built up as an intermediate byte string.
+Codecs are looked up by name or by the extension of the file being written/read.
+"""
+
+import os
+import pickle
+import struct
+from abc import ABC, abstractmethod
+from io import BytesIO
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple, Union
+
+from modal_or_local.streams import readinto_exactly
+
+
+class Codec(ABC):
+    """Base class for codecs. Subclasses set name and extensions and implement dump() and load()"""
+
+    name: str = ""
+    """Name used to select the codec explicitly, e.g. write_object(path, obj, codec="msgpack")"""
+    extensions: Tuple[str, ...] = ()
+    """File extensions (including the dot) that select this codec when no codec is given"""
+
+    @abstractmethod
+    def dump(self, obj: Any, f: BinaryIO):
+        """Serialize obj to the binary file-like f"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def load(self, f: BinaryIO) -> Any:
+        """Deserialize and return an object from the binary file-like f"""
+        raise NotImplementedError
+
+    def __str__(self):
+        return type(self).__name__ + f"(name={self.name}, extensions={self.extensions})"
+
+
+class MsgpackCodec(Codec):
+    """msgpack serialization. Requires the optional msgpack package"""
+
+    name = "msgpack"
+    extensions = (".msgpack", ".mpk")
+
+    def dump(self, obj: Any, f: BinaryIO):
+        msgpack = import_optional("msgpack")
+        msgpack.pack(obj, f, use_bin_type=True)
+
+    def load(self, f: BinaryIO) -> Any:
+        msgpack = import_optional("msgpack")
+        unpacker = msgpack.Unpacker(f, raw=False, max_buffer_size=0)
+        return unpacker.unpack()
+
+
+class Pickle5Codec(Codec):
+    """Pickle protocol 5 with out-of-band buffers.
+    Large buffers (numpy arrays, bytearrays, etc.) are written straight from the object's memory rather than copied into the pickle stream.
+    File layout: magic, buffer count, buffer lengths, the raw buffers, then the (small) in-band pickle stream."""
+
+    name = "pickle5"
+    extensions = (".pkl5",)
+
+    MAGIC = b"MOLPKL5\x00"
+    _COUNT = struct.Struct("<I")
+    _LENGTH = struct.Struct("<Q")
+
+    def dump(self, obj: Any, f: BinaryIO):
+        buffers: List[pickle.PickleBuffer] = []
+        in_band = BytesIO()
+        pickle.Pickler(in_band, protocol=5, buffer_callback=buffers.append).dump(obj)
+
+        raw_buffers = [buffer.raw() for buffer in buffers]
+        f.write(self.MAGIC)
+        f.write(self._COUNT.pack(len(raw_buffers)))
+        for raw in raw_buffers:
+            f.write(self._LENGTH.pack(raw.nbytes))
+        for raw in raw_buffers:
+            f.write(raw)
+        f.write(in_band.getbuffer())
+
+    def load(self, f: BinaryIO) -> Any:
+        magic = f.read(len(self.MAGIC))
+        if magic != self.MAGIC:
+            raise ValueError(f"Not a {self.name} stream, got magic {magic!r}")
+        (count,) = self._COUNT.unpack(f.read(self._COUNT.size))
+        lengths = [self._LENGTH.unpack(f.read(self._LENGTH.size))[0] for _ in range(count)]
+
+        # Read each buffer directly into its final (writable) memory so unpickled arrays can use it without a copy
+        buffers = []
+        for length in lengths:
+            buffer = bytearray(length)
+            readinto_exactly(f, buffer)
+            buffers.append(buffer)
+        return pickle.Unpickler(f, buffers=buffers).load()
+
+
+class NpyCodec(Codec):
+    """NumPy .npy format. Requires the optional numpy package"""
+
+    name = "npy"
+    extensions = (".npy",)
+
+    def dump(self, obj: Any, f: BinaryIO):
+        np = import_optional("numpy")
+        np.lib.format.write_array(f, np.asanyarray(obj), allow_pickle=False)
+
+    def load(self, f: BinaryIO) -> Any:
+        return read_npy_into_array(f)
+
+
+def read_npy_header(f: BinaryIO) -> Tuple[Tuple[int, ...], bool, Any]:
+    """Read the .npy magic and header from f, returning (shape, fortran_order, dtype). f is left positioned at the array data"""
+    np = import_optional("numpy")
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+        return np.lib.format.read_array_header_1_0(f)
+    if version == (2, 0):
+        return np.lib.format.read_array_header_2_0(f)
+    # Newer header versions are read by the generic (private) helper
+    return np.lib.format._read_array_header(f, version)
+
+
+def read_npy_into_array(f: BinaryIO) -> Any:
+    """Read a .npy stream from f into a preallocated array sized from its header (one copy, straight from the stream)"""
+    np = import_optional("numpy")
+    shape, fortran_order, dtype = read_npy_header(f)
+    if dtype.hasobject:
+        raise ValueError("Object arrays are not supported by the npy codec, use the pickle5 codec instead")
+    array = np.empty(shape, dtype=dtype, order="F" if fortran_order else "C")
+    if array.nbytes:
+        readinto_exactly(f, array.reshape(-1, order="A").view(np.uint8))
+    return array
+
+
+_CODECS_BY_NAME: Dict[str, Codec] = {}
+_CODECS_BY_EXTENSION: Dict[str, Codec] = {}
+
+
+def register_codec(codec: Codec, overwrite: bool = False):
+    """Register a codec by its name and extensions so it can be used by write_object()/read_object()"""
+    if not codec.name:
+        raise ValueError(f"Codec must have a name to be registered: {codec}")
+    if not overwrite and codec.name in _CODECS_BY_NAME:
+        raise ValueError(f"A codec named '{codec.name}' is already registered")
+    _CODECS_BY_NAME[codec.name] = codec
+    for extension in codec.extensions:
+        _CODECS_BY_EXTENSION[extension.lower()] = codec
+
+
+def get_codec(name: str) -> Codec:
+    """Return the registered codec with the given name"""
+    codec = _CODECS_BY_NAME.get(name)
+    if codec is None:
+        raise ValueError(f"No codec registered with {name=}. Registered codecs are {sorted(_CODECS_BY_NAME)}")
+    return codec
+
+
+def codec_for_path(full_path: str) -> Codec:
+    """Return the registered codec for the extension of the given path"""
+    extension = os.path.splitext(full_path)[1].lower()
+    codec = _CODECS_BY_EXTENSION.get(extension)
+    if codec is None:
+        raise ValueError(
+            f"No codec registered for extension '{extension}' of {full_path=}. Pass codec= explicitly or use one of {sorted(_CODECS_BY_EXTENSION)}"
+        )
+    return codec
+
+
+def resolve_codec(full_path: str, codec: Optional[Union[str, Codec]] = None) -> Codec:
+    """Return the codec to use for full_path - the one given (by name or instance) or else the one registered for the file extension"""
+    if codec is None:
+        return codec_for_path(full_path)
+    if isinstance(codec, Codec):
+        return codec
+    return get_codec(codec)
+
+
+def import_optional(module_name: str):
+    """Import an optional dependency, raising an ImportError that says how to install it if missing"""
+    from importlib import import_module
+
+    try:
+        return import_module(module_name)
+    except ImportError as e:
+        raise ImportError(
+            f"The optional package '{module_name}' is required for this codec. Install it with 'pip install {module_name}'"
+        ) from e
+
+
+for _codec in (MsgpackCodec(), Pickle5Codec(), NpyCodec()):
+    register_codec(_codec)
@@ -0,0 +1,145 @@
+"""
+Directory traversal that lists many directories at once, for storage where each listing is a high latency round trip (the network
+filesystem behind a mounted volume, the volume API). Used by the backends' walk()/walk_entries() when ModalOrLocal(walk_workers=N) or
+walk(..., workers=N) is given.
+
+A listing function is called for each directory and returns (dirs, files, subdirectories): dirs and files are passed through to the
+output as (dirpath, dirs, files) tuples, and subdirectories are the full paths to descend into. It may return None to skip a directory
+(e.g. one that cannot be read). Sibling directories are listed concurrently by up to workers threads as soon as their parent has been
+listed, up to a bound on the directories listed ahead of the caller so memory stays flat however large the tree.
+"""
+
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Generator, List, Optional, Tuple
+
+
+ListFunction = Callable[[str], Optional[Tuple[Any, Any, List[str]]]]
+
+PENDING_PER_WORKER = 4
+"""Directories listed or being listed ahead of the caller, per worker, unless parallel_walk() is given max_pending"""
+
+
+class _Listing:
+    """A directory queued for listing, and (once listed) its result and the listings of its subdirectories"""
+
+    __slots__ = ("path", "result", "error", "children", "listed", "started", "holds_slot")
+
+    def __init__(self, path: str):
+        self.path = path
+        self.result: Optional[Tuple[Any, Any, List[str]]] = None
+        self.error: Optional[BaseException] = None
+        self.children: List["_Listing"] = []
+        self.listed = threading.Event()
+        self.started = False  # Submitted to the executor
+        self.holds_slot = False  # Counts against max_pending until the caller takes it
+
+    def wait(self) -> Optional[Tuple[Any, Any, List[str]]]:
+        self.listed.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def parallel_walk(
+    list_dir: ListFunction,
+    top: str,
+    workers: int = 8,
+    ordered: bool = True,
+    max_pending: Optional[int] = None,
+) -> Generator[Tuple[str, Any, Any], None, None]:
+    """Yield (dirpath, dirs, files) for top and every directory below it, listing up to workers directories concurrently.
+    If ordered, output is in the same depth first order a serial walk gives; otherwise each directory is yielded as soon as it is listed.
+    At most max_pending directories (PENDING_PER_WORKER per worker by default) are listed ahead of the caller, being listed or waiting to be
+    taken, so a slow caller holds the walk back rather than the whole tree being listed into memory. In order, the directory the caller
+    needs next is always listed, even when that takes one more.
+    Unlike os.walk(), removing names from dirs does not prune the walk, since subdirectories are listed ahead of the caller.
+    An error from list_dir is raised to the caller."""
+    workers = max(workers, 1)
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="modal_or_local-walk")
+    slots = threading.BoundedSemaphore(max_pending or PENDING_PER_WORKER * workers)
+    start_lock = threading.Lock()
+    done: "queue.Queue[_Listing]" = queue.Queue()  # Listings in the order they finish, for unordered output
+    waiting: "deque[_Listing]" = deque()  # Unordered: subdirectories found while every slot was taken, to start as slots free up
+    stopped = threading.Event()
+    outstanding = 1  # Unordered: listings found but not yet taken from done. Children are counted before their parent is put on done
+    outstanding_lock = threading.Lock()
+
+    def start(listing: _Listing, with_slot: bool = True) -> bool:
+        """Submit the listing unless it has been already. Returns False if with_slot and there is no slot free, so it was not"""
+        if with_slot and not slots.acquire(blocking=False):
+            return False
+        with start_lock:
+            started, listing.started = listing.started, True
+        if started:
+            if with_slot:
+                slots.release()
+        else:
+            listing.holds_slot = with_slot
+            executor.submit(run, listing)
+        return True
+
+    def taken(listing: _Listing):
+        if listing.holds_slot:
+            slots.release()
+
+    def run(listing: _Listing):
+        nonlocal outstanding
+        try:
+            listing.result = list_dir(listing.path)
+            for subdirectory in listing.result[2] if listing.result else []:
+                if stopped.is_set():
+                    break
+                listing.children.append(_Listing(subdirectory))
+            if not ordered:
+                with outstanding_lock:
+                    outstanding += len(listing.children)
+            # Start the subdirectories straight away rather than when the caller gets to them, as far as there are slots free
+            for index, child in enumerate(listing.children):
+                if stopped.is_set() or not start(child):
+                    if not ordered:
+                        waiting.extend(listing.children[index:])
+                    break
+        except BaseException as e:
+            if not stopped.is_set():
+                listing.error = e
+        finally:
+            listing.listed.set()
+            if not ordered:
+                done.put(listing)
+
+    root = _Listing(top)
+    try:
+        start(root)
+        if ordered:
+            pending = [root]
+            while pending:
+                listing = pending.pop()
+                start(listing, with_slot=False)  # Needed next, so listed even if every slot is taken
+                result = listing.wait()
+                taken(listing)
+                pending.extend(reversed(listing.children))
+                # Fill the slots freed with the directories the caller will get to soonest
+                for queued in reversed(pending):
+                    if not queued.started and not start(queued):
+                        break
+                if result is not None:
+                    yield (listing.path, *result[:2])
+        else:
+            while True:
+                while waiting and start(waiting[0]):
+                    waiting.popleft()
+                listing = done.get()
+                taken(listing)
+                if listing.wait() is not None:
+                    yield (listing.path, *listing.result[:2])
+                with outstanding_lock:
+                    outstanding -= 1
+                    if not outstanding:
+                        break
+    finally:
+        # The caller stopped early (or a listing failed) - drop the listings not yet started
+        stopped.set()
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,152 @@
+"""
+Concurrent read-ahead for ModalOrLocalDir. Used via ModalOrLocalDir.prefetch() and ModalOrLocalDir.iter_files():
+
+    mdir.prefetch(["config.json", "shards/*.bin"], workers=16, max_bytes=2 * 1024**3)
+    config = mdir.read_json_file("config.json")  # served from memory
+
+    for relative_path, content in mdir.iter_files("shards/*.bin", lookahead=8):
+        process(content)  # the next 8 files download meanwhile
+"""
+
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Dict, Generator, Iterable, Optional, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from modal_or_local import ModalOrLocal
+    from modal_or_local.concurrency import ConcurrencyController
+
+
+class PrefetchStore:
+    """Content of files downloaded ahead of use, keyed by path. Downloads run in a thread pool; get() waits for one still in flight"""
+
+    def __init__(self):
+        self._futures: Dict[str, Future] = {}
+        self._held_bytes = 0  # Content downloaded and not yet handed out by get() or dropped
+        self._lock = threading.RLock()
+
+    def __str__(self):
+        return __class__.__name__ + f"(files={len(self._futures)}, bytes={self.bytes})"
+
+    @property
+    def bytes(self) -> int:
+        """Total size of the content downloaded so far and currently held"""
+        with self._lock:
+            return self._held_bytes
+
+    def prefetch(
+        self,
+        mocal: "ModalOrLocal",
+        keys_and_full_paths: Iterable[Tuple[str, str]],
+        workers: int = 8,
+        max_bytes: Optional[int] = None,
+        wait: bool = True,
+    ):
+        """Read the given files through mocal with up to workers concurrent reads (or as many as mocal.concurrency allows, if set), keeping
+        each under its key. Once the content held (from this call and earlier ones, until handed out by get()) would exceed max_bytes, content is
+        dropped and downloads not yet started are cancelled; those files are simply read normally later."""
+        over_budget = threading.Event()
+        pending = []
+        controller = mocal.concurrency
+
+        def fetch(full_path: str) -> Optional[bytes]:
+            if over_budget.is_set():
+                return None
+            content = controller.call("read_file", mocal.read_file, full_path) if controller else mocal.read_file(full_path)
+            with self._lock:
+                if max_bytes is not None and self._held_bytes + len(content) > max_bytes:
+                    # Over budget - cancel whatever has not started yet and let this file be read on demand
+                    over_budget.set()
+                    for future in list(pending):
+                        future.cancel()
+                    return None
+                self._held_bytes += len(content)
+            return content
+
+        threads = controller.threads(workers) if controller else workers
+        executor = ThreadPoolExecutor(max_workers=max(threads, 1), thread_name_prefix="modal_or_local-prefetch")
+        try:
+            for key, full_path in keys_and_full_paths:
+                if over_budget.is_set():
+                    break
+                with self._lock:
+                    if key in self._futures:
+                        continue
+                    future = executor.submit(fetch, full_path)
+                    self._futures[key] = future
+                pending.append(future)
+        finally:
+            # Let queued downloads finish in the background unless waiting for them
+            executor.shutdown(wait=wait)
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Hand over the prefetched content for key (waiting if it is still downloading), or None if it was not prefetched or failed.
+        The store lets go of it, so it is only held as long as the caller keeps it and a later read of key goes to the volume"""
+        with self._lock:
+            future = self._futures.pop(key, None)
+        if future is None or future.cancelled():
+            return None
+        try:
+            content = future.result()
+        except Exception:
+            # Reading normally will raise the error (or succeed if it was transient)
+            return None
+        self._release(future)
+        return content
+
+    def discard(self, key: str):
+        """Forget the content for key and anything under it (key/...), e.g. because it was written or removed"""
+        with self._lock:
+            for k in [k for k in self._futures if k == key or k.startswith(key.rstrip("/") + "/")]:
+                self._drop(k)
+
+    def clear(self):
+        """Forget all prefetched content"""
+        with self._lock:
+            for k in list(self._futures):
+                self._drop(k)
+
+    def _drop(self, key: str):
+        future = self._futures.pop(key)
+        if not future.cancel():
+            # Already downloading or done - stop counting its content once there is any
+            future.add_done_callback(self._release)
+
+    def _release(self, future: Future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        content = future.result()
+        if content is not None:
+            with self._lock:
+                self._held_bytes -= len(content)
+
+
+def read_ahead(
+    read: Callable[[str], bytes],
+    paths: Iterable[str],
+    lookahead: int = 4,
+    workers: int = 4,
+    controller: Optional["ConcurrencyController"] = None,
+) -> Generator[Tuple[str, bytes], None, None]:
+    """Yield (path, read(path)) for the given paths in order, keeping up to lookahead reads in flight ahead of the one being consumed.
+    At most lookahead + 1 files are held in memory at a time. With a controller, it decides how many of those reads run at once."""
+    in_flight = deque()
+    if controller:
+        workers = controller.threads(workers)
+        read = partial(controller.call, "read_file", read)
+    with ThreadPoolExecutor(max_workers=max(min(workers, lookahead + 1), 1), thread_name_prefix="modal_or_local-read-ahead") as executor:
+        try:
+            for path in paths:
+                in_flight.append((path, executor.submit(read, path)))
+                if len(in_flight) > lookahead:
+                    path, future = in_flight.popleft()
+                    yield path, future.result()
+            while in_flight:
+                path, future = in_flight.popleft()
+                yield path, future.result()
+        finally:
+            # Stopped early (or failed) - do not start the reads still queued
+            for _, future in in_flight:
+                future.cancel()
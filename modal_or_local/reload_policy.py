@@ -0,0 +1,135 @@
+"""
+When a mounted volume is reloaded, for ModalOrLocal(reload_policy=...). While running remotely a container sees the volume as it was
+when mounted (or last reloaded), so writes committed by other containers only show up after volume.reload() - which is too expensive to
+do before every read. The policy picks when to:
+
+    never       never reload (the default)
+    on_miss     when a path is not found, reload once and retry (at most once per min_interval_seconds)
+    periodic    before a read, if interval_seconds have passed since the last reload
+    generation  before a read, if the volume's generation file has changed. Instances using this policy write a new generation to it with
+                each commit they make, and readers check it through the volume API at most every generation_check_seconds
+
+A volume is never reloaded while there are writes made through the same ModalOrLocal that have not been committed yet (see
+modal_or_local.commit_coalescer), since they would be lost; the reload happens on a later read once they have been.
+"""
+
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional
+
+
+RELOAD_MODES = ("never", "on_miss", "periodic", "generation")
+
+GENERATION_FILE = ".modal_or_local_generation"
+"""Name of the file at the root of the volume holding its generation, for the generation policy"""
+
+
+class ReloadPolicy:
+    """When to reload a mounted volume (see RELOAD_MODES), and counts of the reloads made and skipped"""
+
+    def __init__(
+        self,
+        mode: str = "never",
+        interval_seconds: float = 30.0,
+        min_interval_seconds: float = 1.0,
+        generation_check_seconds: float = 1.0,
+        generation_file: str = GENERATION_FILE,
+    ):
+        if mode not in RELOAD_MODES:
+            raise ValueError(f"Expected mode to be one of {RELOAD_MODES} but got {mode=}")
+        self.mode = mode
+        self.interval_seconds = interval_seconds  # For periodic: longest time between reloads
+        self.min_interval_seconds = min_interval_seconds  # For on_miss: shortest time between reloads, so a path that really is missing is cheap
+        self.generation_check_seconds = generation_check_seconds  # For generation: shortest time between checks of the generation file
+        self.generation_file = generation_file
+        self.generation: Optional[str] = None  # Generation the mounted view is at, once known
+
+        self.reloads = 0
+        self.reloads_skipped = 0  # Reloads due but not made because of uncommitted writes
+        self.misses_retried = 0
+        self.generation_checks = 0
+        self.last_reload_at = time.monotonic()  # The volume is as fresh as this when mounted
+        self._last_check_at: Optional[float] = None
+        self._reload: Optional[Callable[[], None]] = None
+        self._can_reload: Callable[[], bool] = lambda: True
+        self._read_generation: Callable[[], Optional[str]] = lambda: None
+        self._lock = threading.RLock()
+
+    def __str__(self):
+        return __class__.__name__ + f"(mode={self.mode}, reloads={self.reloads})"
+
+    def bind(
+        self,
+        reload: Callable[[], None],
+        can_reload: Callable[[], bool],
+        read_generation: Callable[[], Optional[str]],
+    ):
+        """Set the functions to reload the volume, tell whether that is safe now and read the generation file (None if there is none)"""
+        self._reload = reload
+        self._can_reload = can_reload
+        self._read_generation = read_generation
+
+    def before_read(self):
+        """Reload if the periodic or generation policy says the mounted view may be stale"""
+        if self.mode == "periodic":
+            with self._lock:
+                if time.monotonic() - self.last_reload_at >= self.interval_seconds:
+                    self.reload()
+        elif self.mode == "generation":
+            with self._lock:
+                now = time.monotonic()
+                first_check = self._last_check_at is None
+                if not first_check and now - self._last_check_at < self.generation_check_seconds:
+                    return
+                self._last_check_at = now
+                self.generation_checks += 1
+                generation = self._read_generation()
+                if first_check:
+                    # The mount is taken to be at the generation current when first checked
+                    self.generation = generation
+                elif generation != self.generation and self.reload():
+                    self.generation = generation
+
+    def after_miss(self) -> bool:
+        """For the on_miss policy, reload after a path was not found. Returns true if it did, so the read is worth retrying"""
+        if self.mode != "on_miss":
+            return False
+        with self._lock:
+            if time.monotonic() - self.last_reload_at < self.min_interval_seconds:
+                return False
+            if not self.reload():
+                return False
+            self.misses_retried += 1
+            return True
+
+    def reload(self) -> bool:
+        """Reload now unless there are uncommitted writes. Returns true if the volume was reloaded"""
+        if self._reload is None:
+            raise RuntimeError(f"{self} has no reload function, see bind()")
+        with self._lock:
+            if not self._can_reload():
+                self.reloads_skipped += 1
+                return False
+            self._reload()
+            self.reloads += 1
+            self.last_reload_at = time.monotonic()
+            return True
+
+    def next_generation(self) -> str:
+        """Return a new generation to write to the generation file with a commit, taken as already seen by this policy"""
+        with self._lock:
+            self.generation = uuid.uuid4().hex
+            return self.generation
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the mode and the counts of reloads, reloads skipped, misses retried and generation checks"""
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "reloads": self.reloads,
+                "reloads_skipped": self.reloads_skipped,
+                "misses_retried": self.misses_retried,
+                "generation_checks": self.generation_checks,
+                "seconds_since_reload": time.monotonic() - self.last_reload_at,
+            }
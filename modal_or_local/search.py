@@ -0,0 +1,189 @@
+"""
+glob/find over a ModalOrLocal directory, used by ModalOrLocalDir.glob() and ModalOrLocalDir.find().
+Glob patterns are matched one path segment at a time, so directories that cannot contain a match are never listed. When every
+directory has to be visited anyway (a '**' segment, or find()), one recursive listing is used instead of one listing per directory.
+"""
+
+import os
+from datetime import datetime
+from fnmatch import fnmatchcase
+from typing import FrozenSet, Generator, List, Optional, Union, TYPE_CHECKING
+
+from modal.volume import FileEntry, FileEntryType
+
+if TYPE_CHECKING:
+    from modal_or_local import ModalOrLocal
+
+
+MAGIC_CHARACTERS = "*?["
+
+
+class GlobPattern:
+    """A glob pattern relative to a directory, e.g. 'data/*.json' or '**/shard-??.bin'.
+    Segments are matched with fnmatch against single names; a '**' segment matches any number of directories (including none)."""
+
+    def __init__(self, pattern: str):
+        if not pattern or pattern.startswith("/"):
+            raise ValueError(f"Expected a relative glob pattern but got {pattern=}")
+        self.pattern = pattern
+        self.segments: List[str] = [s for s in os.path.normpath(pattern).split("/")]
+
+        # Leading segments without wildcards can be gone straight to rather than searched for
+        literal_count = 0
+        while literal_count < len(self.segments) - 1 and not has_magic(self.segments[literal_count]):
+            literal_count += 1
+        self.literal_prefix = "/".join(self.segments[:literal_count])
+        """Directory (relative, possibly "") below which all matches lie"""
+        self._rest = self.segments[literal_count:]
+
+    def __str__(self):
+        return __class__.__name__ + f"(pattern={self.pattern})"
+
+    @property
+    def crosses_directories(self) -> bool:
+        """True if the pattern has a '**' segment below its literal prefix, so every directory under the prefix may hold a match"""
+        return "**" in self._rest
+
+    @property
+    def start(self) -> FrozenSet[int]:
+        """The match state at the literal prefix directory"""
+        return self._closure({0})
+
+    def advance(self, states: FrozenSet[int], name: str) -> FrozenSet[int]:
+        """Return the states after matching one more path segment (an entry name) from the given states; empty if nothing can match"""
+        next_states = set()
+        for i in states:
+            if i == len(self._rest):
+                continue
+            if self._rest[i] == "**":
+                next_states.add(i)
+            elif fnmatchcase(name, self._rest[i]):
+                next_states.add(i + 1)
+        return self._closure(next_states)
+
+    def is_match(self, states: FrozenSet[int]) -> bool:
+        """Return true if the path consumed to reach states matches the whole pattern"""
+        return len(self._rest) in states
+
+    def can_extend(self, states: FrozenSet[int]) -> bool:
+        """Return true if a longer path could still match from these states, i.e. a directory reached in them is worth listing"""
+        return any(i < len(self._rest) for i in states)
+
+    def match(self, relative_path: str) -> bool:
+        """Return true if the given path (relative to the directory the pattern is for) matches"""
+        if self.literal_prefix:
+            if not relative_path.startswith(self.literal_prefix + "/"):
+                return False
+            relative_path = relative_path[len(self.literal_prefix) + 1 :]
+        states = self.start
+        for name in relative_path.split("/"):
+            states = self.advance(states, name)
+            if not states:
+                return False
+        return self.is_match(states)
+
+    def _closure(self, states) -> FrozenSet[int]:
+        # A '**' may match no directories at all, so the state after it is reachable without consuming anything
+        closed = set(states)
+        pending = list(states)
+        while pending:
+            i = pending.pop()
+            if i < len(self._rest) and self._rest[i] == "**" and i + 1 not in closed:
+                closed.add(i + 1)
+                pending.append(i + 1)
+        return frozenset(closed)
+
+
+def has_magic(path: str) -> bool:
+    """Return true if the path contains glob wildcards"""
+    return any(c in path for c in MAGIC_CHARACTERS)
+
+
+def entry_relative_path(mocal: "ModalOrLocal", entry: FileEntry, dir_full_path: str) -> str:
+    """Return the path of the entry, listed from under dir_full_path, relative to dir_full_path"""
+    # Entry paths are relative to / (see backends._entry_from_stat), except those listed from a relative local path, which stay relative
+    # to the working directory; both sides are then made absolute the way ModalOrLocal._du_path() does
+    entry_path = os.path.join("/", entry.path) if mocal.volume_name or os.path.isabs(dir_full_path) else entry.path
+    return os.path.relpath(mocal._du_path(entry_path), mocal._du_path(dir_full_path))
+
+
+def glob_entries(
+    mocal: "ModalOrLocal",
+    dir_full_path: str,
+    pattern: Union[str, GlobPattern],
+    recursive_listing: Optional[bool] = None,
+) -> Generator[FileEntry, None, None]:
+    """Yield FileEntries (see ModalOrLocal.get_FileEntry()) for the files and directories under dir_full_path matching the glob pattern.
+    By default a single recursive listing is used when the pattern crosses directories and the backend is remote, and otherwise one
+    listing per directory that can still hold a match. Pass recursive_listing to choose."""
+    glob_pattern = pattern if isinstance(pattern, GlobPattern) else GlobPattern(pattern)
+    start_dir = os.path.normpath(os.path.join(dir_full_path, glob_pattern.literal_prefix))
+    if not mocal.isdir(start_dir):
+        return
+
+    if recursive_listing is None:
+        recursive_listing = glob_pattern.crosses_directories and mocal.backend.remote
+
+    if recursive_listing:
+        for entry in mocal.iterdir(start_dir, recursive=True):
+            relative_path = entry_relative_path(mocal, entry, dir_full_path)
+            if glob_pattern.match(relative_path):
+                yield entry
+        return
+
+    pending = [(start_dir, glob_pattern.start)]
+    while pending:
+        directory, states = pending.pop()
+        subdirectories = []
+        for entry in mocal.iterdir(directory):
+            name = os.path.basename(entry.path)
+            entry_states = glob_pattern.advance(states, name)
+            if not entry_states:
+                continue  # Nothing under this entry can match, so it is not descended into
+            if glob_pattern.is_match(entry_states):
+                yield entry
+            if entry.type == FileEntryType.DIRECTORY and glob_pattern.can_extend(entry_states):
+                subdirectories.append((os.path.join(directory, name), entry_states))
+        pending.extend(reversed(subdirectories))  # Depth first, in listing order
+
+
+def find_entries(
+    mocal: "ModalOrLocal",
+    dir_full_path: str,
+    name: Optional[str] = None,
+    min_size: Optional[int] = None,
+    max_size: Optional[int] = None,
+    newer_than: Optional[Union[datetime, float]] = None,
+    type: Optional[Union[str, FileEntryType]] = None,
+) -> Generator[FileEntry, None, None]:
+    """Yield FileEntries for everything under dir_full_path matching all of the given conditions, from one recursive listing.
+    name is a glob matched against the entry name, sizes are in bytes and only match files (a directory's size is 0 on a volume but
+    a block size locally), newer_than is a datetime or seconds since the epoch (compared to
+    mtime, inclusive) and type is 'file', 'directory' or a FileEntryType."""
+    entry_type = _entry_type(type)
+    if isinstance(newer_than, datetime):
+        newer_than = newer_than.timestamp()
+
+    for entry in mocal.iterdir(dir_full_path, recursive=True):
+        if entry_type is not None and entry.type != entry_type:
+            continue
+        if name is not None and not fnmatchcase(os.path.basename(entry.path), name):
+            continue
+        if (min_size is not None or max_size is not None) and entry.type != FileEntryType.FILE:
+            continue
+        if min_size is not None and entry.size < min_size:
+            continue
+        if max_size is not None and entry.size > max_size:
+            continue
+        if newer_than is not None and entry.mtime < newer_than:
+            continue
+        yield entry
+
+
+def _entry_type(type: Optional[Union[str, FileEntryType]]) -> Optional[FileEntryType]:
+    if type is None or isinstance(type, FileEntryType):
+        return type
+    types = {"file": FileEntryType.FILE, "f": FileEntryType.FILE, "directory": FileEntryType.DIRECTORY, "dir": FileEntryType.DIRECTORY, "d": FileEntryType.DIRECTORY}
+    if type not in types:
+        raise ValueError(f"Expected type to be 'file', 'directory' or a FileEntryType but got {type=}")
+    return types[type]
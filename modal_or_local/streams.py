@@ -0,0 +1,63 @@
+"""
+File-like wrappers used to stream data through the ModalOrLocal read/write paths without
+collecting whole files into intermediate byte strings.
+"""
+
+import io
+from typing import Iterable, Iterator, Optional
+
+
+class ChunkIteratorReader(io.RawIOBase):
+    """Read-only raw stream over an iterator of byte chunks (e.g. the generator returned by modal.Volume.read_file()).
+    Wrap in io.BufferedReader (see open_chunk_reader) for efficient small reads."""
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks: Iterator[bytes] = iter(chunks)
+        self._current: Optional[memoryview] = None  # Unconsumed part of the chunk currently being read
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def readinto(self, buffer) -> int:
+        """Fill as much of buffer as the current chunk allows. Returns 0 at end of stream."""
+        while not self._current:
+            try:
+                self._current = memoryview(next(self._chunks))
+            except StopIteration:
+                return 0
+
+        target = memoryview(buffer).cast("B")
+        n = min(len(target), len(self._current))
+        target[:n] = self._current[:n]
+        self._current = self._current[n:]
+        self._position += n
+        return n
+
+    def close(self):
+        """Close the underlying chunk iterator (if it is a generator) so no further chunks are fetched"""
+        if not self.closed:
+            close = getattr(self._chunks, "close", None)
+            if close:
+                close()
+            self._current = None
+        super().close()
+
+
+def open_chunk_reader(chunks: Iterable[bytes], buffer_size: int = io.DEFAULT_BUFFER_SIZE) -> io.BufferedReader:
+    """Return a buffered binary file-like object that reads from the given iterator of byte chunks"""
+    return io.BufferedReader(ChunkIteratorReader(chunks), buffer_size=buffer_size)
+
+
+def readinto_exactly(f, buffer) -> None:
+    """Fill the whole of buffer from the binary file-like f, raising EOFError if f ends first"""
+    view = memoryview(buffer).cast("B")
+    filled = 0
+    while filled < len(view):
+        n = f.readinto(view[filled:])
+        if not n:
+            raise EOFError(f"Expected {len(view)} bytes but stream ended after {filled}")
+        filled += n
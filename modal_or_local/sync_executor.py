@@ -0,0 +1,211 @@
+"""
+Where a copy between two ModalOrLocals runs. copy_dir() and copy() normally copy in the calling process, so a copy between two volumes
+made from a laptop downloads every byte and uploads it again. Given an executor, the copy is planned where it is called (only the source
+is walked there) and the plan is run by the executor instead:
+
+    plan = plan_copy_dir(source, "/data/run_1", destination, "/backup")  # or copy_dir(..., executor=...), which does both
+    InProcessSyncExecutor(workers=8).run(plan)               # here, as copy_dir() would
+    ProcessPoolSyncExecutor(processes=4).run(plan)           # split across local processes
+    ModalFunctionSyncExecutor().run(plan)                    # in a Modal function with both volumes mounted, so the bytes stay in the data center
+
+Plans are pickled to the processes or function that run them, where each side is opened again as ModalOrLocal(volume_name, volume_mount_dir)
+- so options such as metrics, transfer budgets and concurrency controllers of the ModalOrLocals passed in only apply in process.
+Every executor returns the copy_file() result for each file in the plan, in plan order, and commits the destination when done.
+"""
+
+import os
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+import modal
+
+from modal_or_local.modal_or_local import ModalOrLocal
+from modal_or_local.modal_or_local_copy import DEFAULT_DIGEST, copy_file, dir_copies, resolve_copy_dir, resolve_transfer_budget
+
+if TYPE_CHECKING:
+    from modal import Image
+
+
+class SyncPlan:
+    """The directories to create and the files to copy from one ModalOrLocal to another, with the copy_file() options to copy them with"""
+
+    def __init__(
+        self,
+        source_mocal: ModalOrLocal,
+        destination_mocal: ModalOrLocal,
+        directories: Optional[List[str]] = None,
+        files: Optional[List[Tuple[str, str]]] = None,
+        digest: Optional[str] = DEFAULT_DIGEST,
+        sidecar: bool = False,
+        delta: bool = False,
+    ):
+        self.source = (source_mocal.volume_name, source_mocal.volume_mount_dir)  # What the source is opened again as where the plan runs
+        self.destination = (destination_mocal.volume_name, destination_mocal.volume_mount_dir)
+        self.directories = directories or []  # Destination directories to create, parents first
+        self.files = files or []  # (source, destination) full paths, as for copy_file()
+        self.digest = digest
+        self.sidecar = sidecar
+        self.delta = delta
+        self._mocals: Optional[Tuple[ModalOrLocal, ModalOrLocal]] = (source_mocal, destination_mocal)
+
+    def __str__(self):
+        return __class__.__name__ + f"(source={self.source}, destination={self.destination}, directories={len(self.directories)}, files={len(self.files)})"
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # The ModalOrLocals hold volume handles, locks and caches, so only what is needed to open them again is pickled
+        state = self.__dict__.copy()
+        state["_mocals"] = None
+        return state
+
+    def mocals(self) -> Tuple[ModalOrLocal, ModalOrLocal]:
+        """Return the source and destination ModalOrLocals: those the plan was made with, or new ones where it has been unpickled"""
+        if self._mocals is None:
+            self._mocals = (ModalOrLocal(*self.source), ModalOrLocal(*self.destination))
+        return self._mocals
+
+    def split(self, count: int) -> List["SyncPlan"]:
+        """Return up to count plans with no directories, sharing out the files round robin"""
+        count = min(count, len(self.files))
+        return [self._with(directories=[], files=self.files[i::count]) for i in range(count)]
+
+    def volumes(self) -> Dict[str, modal.Volume]:
+        """Return the volumes to mount to run the plan in a Modal function, by mount dir"""
+        volumes = {}
+        for volume_name, volume_mount_dir in (self.source, self.destination):
+            if not volume_name:
+                raise ValueError(f"{self} copies to or from the local filesystem, which a Modal function cannot reach")
+            if volume_mount_dir in volumes and volumes[volume_mount_dir] is not self._volume(volume_name):
+                raise ValueError(f"Expected the source and destination of {self} to be mounted at different dirs but got {volume_mount_dir=} for both")
+            volumes[volume_mount_dir] = self._volume(volume_name)
+        return volumes
+
+    def _with(self, **changes: Any) -> "SyncPlan":
+        plan = SyncPlan.__new__(SyncPlan)
+        plan.__dict__.update(self.__dict__, **changes)
+        return plan
+
+    @staticmethod
+    def _volume(volume_name: str) -> modal.Volume:
+        from modal_or_local import volume_registry
+
+        return volume_registry.get_volume(volume_name)
+
+
+def plan_copy_dir(
+    source_mocal: ModalOrLocal,
+    source_dir_full_path: str,
+    destination_mocal: ModalOrLocal,
+    destination_full_path: str,
+    digest: Optional[str] = DEFAULT_DIGEST,
+    sidecar: bool = False,
+    delta: bool = False,
+) -> SyncPlan:
+    """Walk the source directory and return the plan for the copy copy_dir() would make with the same arguments"""
+    source_dir_full_path, resolved_destination_full_path = resolve_copy_dir(
+        source_mocal, source_dir_full_path, destination_mocal, destination_full_path
+    )
+    plan = SyncPlan(source_mocal, destination_mocal, digest=digest, sidecar=sidecar, delta=delta)
+    for source, destination in dir_copies(source_mocal, source_dir_full_path, resolved_destination_full_path, digest, sidecar, delta):
+        if source is None:
+            plan.directories.append(destination)
+        else:
+            plan.files.append((source, destination))
+    return plan
+
+
+def run_sync_plan(plan: SyncPlan, workers: int = 1) -> List[Dict[str, Any]]:
+    """Create the plan's directories that do not exist yet, copy its files (up to workers at once) and commit the destination.
+    Returns the copy_file() result for each file, in plan order"""
+    source_mocal, destination_mocal = plan.mocals()
+    for directory in plan.directories:
+        if not destination_mocal.isdir(directory):
+            destination_mocal.create_directory(directory)
+
+    budget = resolve_transfer_budget(source_mocal, destination_mocal)
+    copy_options = dict(digest=plan.digest, sidecar=plan.sidecar, delta=plan.delta, budget=budget)
+
+    def copy(file: Tuple[str, str]) -> Dict[str, Any]:
+        return copy_file(source_mocal, file[0], destination_mocal, file[1], **copy_options)
+
+    with destination_mocal:
+        if workers <= 1:
+            return [copy(file) for file in plan.files]
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="modal_or_local-sync") as executor:
+            return list(executor.map(copy, plan.files))
+
+
+class SyncExecutor(ABC):
+    """Runs a SyncPlan somewhere, returning the copy_file() result for each of its files in plan order"""
+
+    @abstractmethod
+    def run(self, plan: SyncPlan) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+
+class InProcessSyncExecutor(SyncExecutor):
+    """Runs plans in the calling process with the ModalOrLocals they were made with, as copy_dir() does"""
+
+    def __init__(self, workers: int = 1):
+        self.workers = workers  # Files copied at once
+
+    def __str__(self):
+        return __class__.__name__ + f"(workers={self.workers})"
+
+    def run(self, plan: SyncPlan) -> List[Dict[str, Any]]:
+        return run_sync_plan(plan, self.workers)
+
+
+class ProcessPoolSyncExecutor(SyncExecutor):
+    """Runs plans split across a pool of local processes, e.g. to spread digests and delta copies of many files across CPUs"""
+
+    def __init__(self, processes: Optional[int] = None, workers: int = 1):
+        self.processes = processes or os.cpu_count() or 1  # Processes the files are shared between
+        self.workers = workers  # Files each process copies at once
+
+    def __str__(self):
+        return __class__.__name__ + f"(processes={self.processes}, workers={self.workers})"
+
+    def run(self, plan: SyncPlan) -> List[Dict[str, Any]]:
+        # Directories first, here, so every process finds the ones its files go in
+        run_sync_plan(plan._with(files=[]))
+        shards = plan.split(self.processes)
+        if not shards:
+            return []
+        with ProcessPoolExecutor(max_workers=len(shards)) as executor:
+            shard_results = list(executor.map(run_sync_plan, shards, [self.workers] * len(shards)))
+
+        # Shard i has files i, i + count, ... so interleave the results back into plan order
+        results: List[Dict[str, Any]] = [{}] * len(plan.files)
+        for i, shard_result in enumerate(shard_results):
+            results[i :: len(shards)] = shard_result
+        return results
+
+
+class ModalFunctionSyncExecutor(SyncExecutor):
+    """Runs plans in a Modal function with the source and destination volumes mounted, so the bytes move inside the data center
+    rather than through the calling machine. Both sides must be volumes, mounted at different volume_mount_dirs"""
+
+    def __init__(self, image: Optional["Image"] = None, app_name: str = "modal_or_local-sync", workers: int = 8, timeout: int = 3600):
+        self.image = image  # Image for the function, setup_image() if None
+        self.app_name = app_name
+        self.workers = workers  # Files the function copies at once
+        self.timeout = timeout  # Seconds the function may run for
+
+    def __str__(self):
+        return __class__.__name__ + f"(app_name={self.app_name}, workers={self.workers})"
+
+    def run(self, plan: SyncPlan) -> List[Dict[str, Any]]:
+        if not modal.is_local():
+            # Already running in a Modal container, so the bytes do not leave the data center anyway
+            return run_sync_plan(plan, self.workers)
+
+        from modal_or_local.modal_image_prep import setup_image
+
+        # The volumes to mount are only known from the plan, so the function is defined (serialized) and run in an app of its own
+        app = modal.App(self.app_name)
+        function = app.function(
+            image=self.image or setup_image(), volumes=plan.volumes(), timeout=self.timeout, serialized=True
+        )(run_sync_plan)
+        with app.run():
+            return function.remote(plan, self.workers)
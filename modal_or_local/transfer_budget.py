@@ -0,0 +1,108 @@
+"""
+A limit on how much data concurrent transfers hold in memory at once, shared by every copy made through the ModalOrLocals it is given to:
+
+    budget = TransferBudget(max_bytes=256 * 1024**2, max_files=16)
+    source = ModalOrLocal(volume_name=..., volume_mount_dir=..., transfer_budget=budget)
+    copy_dir(source, "/data", destination, "/backup", workers=32)  # at most 16 files and 256 MiB of chunks in flight
+
+Files are streamed in chunks and each chunk is reserved against the budget from the time it is read until it has been written, so
+threads wanting more than the budget allows wait for others to finish theirs rather than read ahead. A single reservation larger than
+max_bytes is granted once nothing else is in flight, so it can never block forever.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Generator, Optional
+
+
+class TransferBudget:
+    """Maximum bytes and files in flight across the transfers sharing it, with the peaks reached. None means unlimited"""
+
+    def __init__(self, max_bytes: Optional[int] = None, max_files: Optional[int] = None):
+        if max_bytes is not None and max_bytes <= 0:
+            raise ValueError(f"Expected max_bytes to be positive or None but got {max_bytes=}")
+        if max_files is not None and max_files <= 0:
+            raise ValueError(f"Expected max_files to be positive or None but got {max_files=}")
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.in_flight_bytes = 0
+        self.in_flight_files = 0
+        self.peak_bytes = 0  # Most bytes in flight at once since this budget was created or reset
+        self.peak_files = 0
+        self.waits = 0  # Times a transfer had to wait for room
+        self.seconds_waited = 0.0
+        self._condition = threading.Condition()
+
+    def __str__(self):
+        return __class__.__name__ + f"(max_bytes={self.max_bytes}, max_files={self.max_files}, in_flight_bytes={self.in_flight_bytes}, in_flight_files={self.in_flight_files})"
+
+    def chunk_size(self, preferred: int) -> int:
+        """Return the size to read chunks in: preferred, or less if that would not fit in the budget at all"""
+        return min(preferred, self.max_bytes) if self.max_bytes else preferred
+
+    @contextmanager
+    def reserve(self, nbytes: int) -> Generator[None, None, None]:
+        """Hold nbytes of the budget for the duration of the with block, waiting for room first"""
+        self._acquire(nbytes, 0)
+        try:
+            yield
+        finally:
+            self._release(nbytes, 0)
+
+    @contextmanager
+    def file(self) -> Generator[None, None, None]:
+        """Hold one of the concurrent file slots for the duration of the with block, waiting for one first"""
+        self._acquire(0, 1)
+        try:
+            yield
+        finally:
+            self._release(0, 1)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the limits, what is in flight now and the peaks and waits so far"""
+        with self._condition:
+            return {
+                "max_bytes": self.max_bytes,
+                "max_files": self.max_files,
+                "in_flight_bytes": self.in_flight_bytes,
+                "in_flight_files": self.in_flight_files,
+                "peak_bytes": self.peak_bytes,
+                "peak_files": self.peak_files,
+                "waits": self.waits,
+                "seconds_waited": self.seconds_waited,
+            }
+
+    def reset(self):
+        """Restart the peaks and waits from what is in flight now"""
+        with self._condition:
+            self.peak_bytes = self.in_flight_bytes
+            self.peak_files = self.in_flight_files
+            self.waits = 0
+            self.seconds_waited = 0.0
+
+    def _fits(self, nbytes: int, files: int) -> bool:
+        # Anything fits when nothing else is in flight, otherwise an oversized request would wait forever
+        if nbytes and self.max_bytes is not None and self.in_flight_bytes and self.in_flight_bytes + nbytes > self.max_bytes:
+            return False
+        if files and self.max_files is not None and self.in_flight_files and self.in_flight_files + files > self.max_files:
+            return False
+        return True
+
+    def _acquire(self, nbytes: int, files: int):
+        with self._condition:
+            if not self._fits(nbytes, files):
+                self.waits += 1
+                start = time.perf_counter()
+                self._condition.wait_for(lambda: self._fits(nbytes, files))
+                self.seconds_waited += time.perf_counter() - start
+            self.in_flight_bytes += nbytes
+            self.in_flight_files += files
+            self.peak_bytes = max(self.peak_bytes, self.in_flight_bytes)
+            self.peak_files = max(self.peak_files, self.in_flight_files)
+
+    def _release(self, nbytes: int, files: int):
+        with self._condition:
+            self.in_flight_bytes -= nbytes
+            self.in_flight_files -= files
+            self._condition.notify_all()
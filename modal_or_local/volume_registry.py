@@ -0,0 +1,66 @@
+"""
+Process-wide registry of modal.Volume handles shared by every ModalOrLocal (and so every ModalOrLocalDir) using the same volume name.
+The volume lookup is deferred until a handle is first needed; prewarm() can hydrate it in a background thread ahead of first use.
+"""
+
+import threading
+from typing import Dict, Optional
+
+import modal
+
+
+_volumes: Dict[str, modal.Volume] = {}
+_prewarm_threads: Dict[str, threading.Thread] = {}
+_lock = threading.Lock()
+
+
+def get_volume(volume_name: str, create_if_missing: bool = True) -> modal.Volume:
+    """Return the shared modal.Volume handle for volume_name, looking it up on first use"""
+    volume = _volumes.get(volume_name)
+    if volume is not None:
+        return volume
+    with _lock:
+        volume = _volumes.get(volume_name)
+        if volume is None:
+            volume = modal.Volume.from_name(volume_name, create_if_missing=create_if_missing)
+            _volumes[volume_name] = volume
+        return volume
+
+
+def prewarm(volume_name: str) -> threading.Thread:
+    """Look up and hydrate the volume in a background (daemon) thread so the first operation does not pay for it.
+    Returns the thread, which can be joined to wait for hydration. Failures are left for the first real operation to raise."""
+    with _lock:
+        thread = _prewarm_threads.get(volume_name)
+        if thread is not None:
+            return thread
+
+        def hydrate():
+            try:
+                get_volume(volume_name).hydrate()
+            except Exception:
+                pass
+
+        thread = threading.Thread(
+            target=hydrate, name=f"modal_or_local-prewarm-{volume_name}", daemon=True
+        )
+        _prewarm_threads[volume_name] = thread
+    thread.start()
+    return thread
+
+
+def register_volume(volume_name: str, volume: modal.Volume):
+    """Use the given handle (e.g. an ephemeral volume or a test double) for volume_name from now on"""
+    with _lock:
+        _volumes[volume_name] = volume
+
+
+def forget_volume(volume_name: Optional[str] = None):
+    """Drop the shared handle for volume_name (or all handles if None) so the next use looks the volume up again"""
+    with _lock:
+        if volume_name is None:
+            _volumes.clear()
+            _prewarm_threads.clear()
+        else:
+            _volumes.pop(volume_name, None)
+            _prewarm_threads.pop(volume_name, None)
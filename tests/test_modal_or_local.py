@@ -1,4 +1,5 @@
 import modal
+import io
 import json
 import os
 from datetime import datetime
@@ -8,6 +9,7 @@ from modal_or_local import setup_image, ModalOrLocal
 # PRW todo - write custom runner for pytest to run this?
 
 image = setup_image()
+numpy_image = image.pip_install("numpy")  # For the tests of the optional numpy support
 app = modal.App("test_modal_or_local")
 
 mocal = ModalOrLocal(
@@ -88,6 +90,178 @@ def test_write_and_read_volume_txt_file():
     )
 
 
+@app.function(image=image, volumes={mocal.volume_mount_dir: mocal.volume})
+def test_read_file_mmap():
+    """Read a file as a memoryview with read_file(mmap=True) and open_mmap() (should be able to run both .local() and .remote())"""
+
+    file_full_path = os.path.join(mocal.volume_mount_dir, "test_read_file_mmap.txt")
+    text_to_encode = "This is some text to map"
+    mocal.write_file(file_full_path, text_to_encode.encode(), force=True)
+
+    view = mocal.read_file(file_full_path, mmap=True)
+    assert view.readonly
+    assert bytes(view) == text_to_encode.encode()
+
+    with mocal.open_mmap(file_full_path) as view:
+        assert bytes(view[:4]) == b"This", f"Expected b'This' but got {bytes(view[:4])}"
+
+    # Remove the test file
+    mocal.remove_file_or_directory(file_full_path)
+
+
+@app.function(image=image, volumes={mocal.volume_mount_dir: mocal.volume})
+def test_read_file_range():
+    """Read byte ranges of a file with read_file_range() (should be able to run both .local() and .remote())"""
+
+    file_full_path = os.path.join(mocal.volume_mount_dir, "test_read_file_range.bin")
+    content = bytes(range(256)) * 10
+    mocal.write_file(file_full_path, content, force=True)
+
+    for offset, length in [(0, 10), (100, 300), (2550, 100), (5000, 10)]:
+        file_range = mocal.read_file_range(file_full_path, offset, length)
+        assert (
+            file_range == content[offset : offset + length]
+        ), f"Range mismatch for {offset=}, {length=}: got {len(file_range)} bytes"
+
+    # Remove the test file
+    mocal.remove_file_or_directory(file_full_path)
+
+
+@app.function(image=image, volumes={mocal.volume_mount_dir: mocal.volume})
+def test_read_file_with_disk_cache():
+    """Read a volume file repeatedly through a DiskCache. Only reads through the volume API (locally) are cached"""
+    from tempfile import mkdtemp
+    from modal_or_local.disk_cache import DiskCache
+
+    cache = DiskCache(cache_dir=mkdtemp(prefix="test_disk_cache_"))
+    mocal_with_cache = ModalOrLocal(
+        volume_name=mocal.volume_name,
+        volume_mount_dir=mocal.volume_mount_dir,
+        cache=cache,
+    )
+
+    file_full_path = os.path.join(
+        mocal.volume_mount_dir, "test_read_file_with_disk_cache.txt"
+    )
+    mocal_with_cache.write_file(file_full_path, b"first version", force=True)
+    for _ in range(3):
+        assert mocal_with_cache.read_file(file_full_path) == b"first version"
+
+    if modal.is_local():
+        stats = cache.stats()
+        assert stats["misses"] == 1 and stats["hits"] == 2, f"Unexpected {stats=}"
+        assert stats["bytes_saved"] == 2 * len(b"first version"), f"Unexpected {stats=}"
+
+    # A changed file must not be served from the cache
+    mocal_with_cache.write_file(file_full_path, b"second, longer version", force=True)
+    assert mocal_with_cache.read_file(file_full_path) == b"second, longer version"
+
+    mocal_with_cache.remove_file_or_directory(file_full_path)
+    cache.clear()
+
+    if modal.is_local():
+        # Least recently used files are evicted once the cached bytes go over max_bytes
+        cache.max_bytes = 30
+        for i in range(3):
+            mocal_with_cache.write_file(file_full_path + f".{i}", b"twelve bytes", force=True)
+            assert mocal_with_cache.read_file(file_full_path + f".{i}") == b"twelve bytes"
+        assert cache.stats()["evictions"] == 1, f"Unexpected {cache.stats()=}"
+        for i in range(3):
+            mocal_with_cache.remove_file_or_directory(file_full_path + f".{i}")
+        cache.clear()
+
+
+@app.function(image=image, volumes={mocal.volume_mount_dir: mocal.volume})
+def test_write_and_read_object():
+    """Write python objects with the object codecs then read them back (should be able to run both .local() and .remote())"""
+
+    print(
+        "Running test_write_and_read_object",
+        "locally" if modal.is_local() else "remotely",
+    )
+
+    test_object = {"a": 1, "b": [1.5, "two"], "buffer": bytearray(b"some bytes" * 1000)}
+
+    # Codec chosen by extension
+    pkl5_file_full_path = os.path.join(
+        mocal.volume_mount_dir, "test_write_and_read_object", "test_object.pkl5"
+    )
+    mocal.write_object(pkl5_file_full_path, test_object)
+    assert mocal.file_or_dir_exists(pkl5_file_full_path)
+    read_object = mocal.read_object(pkl5_file_full_path)
+    assert read_object == test_object, f"Expected {test_object=} but got {read_object=}"
+
+    # Codec passed explicitly for a file without a registered extension
+    bin_file_full_path = os.path.join(
+        mocal.volume_mount_dir, "test_write_and_read_object", "test_object.bin"
+    )
+    mocal.write_object(bin_file_full_path, test_object, codec="pickle5")
+    read_object = mocal.read_object(bin_file_full_path, codec="pickle5")
+    assert read_object == test_object, f"Expected {test_object=} but got {read_object=}"
+
+    try:
+        mocal.read_object(bin_file_full_path)
+        raise AssertionError("Expected ValueError for a file extension with no registered codec")
+    except ValueError:
+        pass
+
+    # Codec only defines what codecs implement
+    from modal_or_local.object_codecs import Codec
+
+    try:
+        Codec()
+        raise AssertionError("Expected a TypeError for the abstract Codec")
+    except TypeError:
+        pass
+
+    # Remove the test dir
+    mocal.remove_file_or_directory(os.path.dirname(pkl5_file_full_path))
+
+    print(
+        "Running test_write_and_read_object",
+        "locally" if modal.is_local() else "remotely",
+        "finished",
+    )
+
+
+@app.function(image=numpy_image, volumes={mocal.volume_mount_dir: mocal.volume})
+def test_write_and_read_array():
+    """Write numpy arrays with write_array() then read them back with read_array(), on the volume and on the local filesystem"""
+    import tempfile
+    import numpy as np
+
+    arrays = {
+        "floats.npy": np.arange(100_000, dtype=np.float32).reshape(1000, 100),
+        "fortran.npy": np.asfortranarray(np.arange(12, dtype=np.int64).reshape(3, 4)),
+        "scalar.npy": np.array(7.5),
+    }
+
+    # On the volume: streamed into a preallocated array through the volume API, memory mapped when mounted
+    temp_dir = os.path.join(mocal.volume_mount_dir, "test_write_and_read_array")
+    for name, array in arrays.items():
+        file_full_path = os.path.join(temp_dir, name)
+        mocal.write_array(file_full_path, array)
+        read_array = mocal.read_array(file_full_path)
+        assert read_array.dtype == array.dtype and read_array.shape == array.shape, f"Unexpected {read_array.dtype=}, {read_array.shape=} for {name}"
+        assert np.array_equal(read_array, array), f"Unexpected content read from {name}"
+        assert isinstance(read_array, np.memmap) == bool(mocal.backend.local_path(file_full_path))
+
+    # On the local filesystem: memory mapped read-only, unless mmap=False
+    mlocal = ModalOrLocal()
+    local_file_full_path = os.path.join(tempfile.mkdtemp(), "floats.npy")
+    mlocal.write_array(local_file_full_path, arrays["floats.npy"])
+    mapped_array = mlocal.read_array(local_file_full_path)
+    assert isinstance(mapped_array, np.memmap) and not mapped_array.flags.writeable
+    assert np.array_equal(mapped_array, arrays["floats.npy"])
+    loaded_array = mlocal.read_array(local_file_full_path, mmap=False)
+    assert not isinstance(loaded_array, np.memmap) and np.array_equal(loaded_array, arrays["floats.npy"])
+
+    # Remove the test dirs
+    del mapped_array
+    mlocal.remove_file_or_directory(os.path.dirname(local_file_full_path))
+    mocal.remove_file_or_directory(temp_dir)
+
+
 @app.function(image=image, volumes={mocal.volume_mount_dir: mocal.volume})
 def test_create_or_remove_dir():
     """Create and remove directory within a volume"""
@@ -105,6 +279,87 @@ def test_create_or_remove_dir():
         assert not mocal.file_or_dir_exists(dir_to_create_full_path)
 
 
+@app.function(image=image, volumes={mocal.volume_mount_dir: mocal.volume})
+def test_batch():
+    """Write, create and remove through a batch session, checking reads in the session see pending changes"""
+    temp_dir = os.path.join(mocal.volume_mount_dir, "test_batch_data")
+    mocal.remove_file_or_directory(temp_dir, dne_ok=True)
+
+    with mocal.batch(memory_limit_bytes=100) as b:
+        for i in range(10):
+            b.write_json_file(os.path.join(temp_dir, f"{i}.json"), {"i": i})
+        b.write_json_file(os.path.join(temp_dir, "0.json"), {"i": "replaced"})
+        b.create_directory(os.path.join(temp_dir, "empty_subdir"))
+        b.write_file(os.path.join(temp_dir, "to_remove.txt"), b"removed before flush")
+        b.remove_file_or_directory(os.path.join(temp_dir, "to_remove.txt"))
+
+        assert b.read_json_file(os.path.join(temp_dir, "0.json")) == {"i": "replaced"}
+        assert not b.file_or_dir_exists(os.path.join(temp_dir, "to_remove.txt"))
+
+    assert mocal.read_json_file(os.path.join(temp_dir, "0.json")) == {"i": "replaced"}
+    assert mocal.read_json_file(os.path.join(temp_dir, "9.json")) == {"i": 9}
+    assert mocal.isdir(os.path.join(temp_dir, "empty_subdir"))
+    assert not mocal.file_or_dir_exists(os.path.join(temp_dir, "to_remove.txt"))
+    assert len(mocal.listdir(temp_dir)) == 11, f"Unexpected listing {mocal.listdir(temp_dir)}"
+
+    # Remove the temp test dir
+    mocal.remove_file_or_directory(temp_dir)
+
+
+@app.function(image=image, volumes={mocal.volume_mount_dir: mocal.volume})
+def test_batch_existing_directory():
+    """Create directories through a batch session where one already holds a tmp.txt, and check no file of the user's is touched"""
+    temp_dir = os.path.join(mocal.volume_mount_dir, "test_batch_existing_directory_data")
+    user_file = os.path.join(temp_dir, "existing", "tmp.txt")
+    mocal.write_file(user_file, b"the user's own tmp.txt")
+
+    with mocal.batch() as b:
+        b.create_directory(os.path.join(temp_dir, "existing"))
+        b.create_directory(os.path.join(temp_dir, "new_subdir"))
+
+    assert mocal.read_file(user_file) == b"the user's own tmp.txt"
+    assert mocal.listdir(os.path.join(temp_dir, "existing")) == ["tmp.txt"]
+    assert mocal.isdir(os.path.join(temp_dir, "new_subdir"))
+    assert mocal.listdir(os.path.join(temp_dir, "new_subdir")) == [], "Expected the placeholder to be removed"
+
+    # Remove the temp test dir
+    mocal.remove_file_or_directory(temp_dir)
+
+
+@app.function(image=image, volumes={mocal.volume_mount_dir: mocal.volume})
+def test_remove_files():
+    """Create files and dirs then remove them (and a path that does not exist) with remove_files()"""
+    temp_dir = os.path.join(mocal.volume_mount_dir, "test_remove_files_data")
+    paths_to_remove = []
+    for i in range(5):
+        full_path = os.path.join(temp_dir, f"file_{i}.txt")
+        mocal.write_file(full_path, f"file {i}".encode())
+        paths_to_remove.append(full_path)
+    subdir_file = os.path.join(temp_dir, "subdir", "in_subdir.txt")
+    mocal.write_file(subdir_file, b"in subdir")
+    paths_to_remove += [
+        os.path.join(temp_dir, "subdir"),
+        subdir_file,
+        os.path.join(temp_dir, "does_not_exist.txt"),
+    ]
+    kept_file = os.path.join(temp_dir, "kept.txt")
+    mocal.write_file(kept_file, b"kept")
+
+    mocal.remove_files(paths_to_remove, workers=4)
+
+    assert mocal.listdir(temp_dir) == ["kept.txt"], f"Unexpected listing {mocal.listdir(temp_dir)}"
+
+    try:
+        mocal.remove_files([os.path.join(temp_dir, "does_not_exist.txt")], dne_ok=False)
+        raise AssertionError("Expected RuntimeError removing a path that does not exist with dne_ok=False")
+    except RuntimeError:
+        pass
+
+    # Remove the temp test dir
+    mocal.remove_files([temp_dir])
+    assert not mocal.file_or_dir_exists(temp_dir)
+
+
 @app.function(image=image, volumes={mocal.volume_mount_dir: mocal.volume})
 def test_listdir():
     """Create files in a temp directory, then read the list of files in the directory"""
@@ -234,6 +489,121 @@ def test_walk():
     mocal.remove_file_or_directory(temp_dir)
 
 
+@app.function(image=image, volumes={mocal.volume_mount_dir: mocal.volume})
+def test_walk_parallel():
+    """Walk a tree with several directories serially and with a thread pool, ordered and unordered, and check the results agree"""
+    temp_dir = os.path.join(mocal.volume_mount_dir, "test_walk_parallel_data")
+    with mocal.batch() as batch:
+        for top in ["a", "b", "c"]:
+            for sub in ["x", "y"]:
+                batch.write_file(os.path.join(temp_dir, top, sub, "file.txt"), f"{top}/{sub}".encode())
+            batch.write_file(os.path.join(temp_dir, top, "top.txt"), top.encode())
+
+    serial_tuples = list(mocal.walk(temp_dir))
+    assert len(serial_tuples) == 10, f"Expected 10 directories but got {serial_tuples=}"
+
+    # Ordered output is the same sequence as the serial walk
+    assert list(mocal.walk(temp_dir, workers=4)) == serial_tuples
+    parallel_mocal = ModalOrLocal(volume_name=mocal.volume_name, volume_mount_dir=mocal.volume_mount_dir, walk_workers=4)
+    assert list(parallel_mocal.walk(temp_dir)) == serial_tuples
+
+    # Unordered output has the same directories in whatever order they were listed
+    assert walk_tuples_equal(list(mocal.walk(temp_dir, workers=4, ordered=False)), serial_tuples)
+
+    serial_entries = [(path, len(dirs), len(files)) for path, dirs, files in mocal.walk_entries(temp_dir)]
+    assert [(path, len(dirs), len(files)) for path, dirs, files in parallel_mocal.walk_entries(temp_dir)] == serial_entries
+
+    # A caller that stops to work on each directory holds the walk back: only max_pending directories are listed ahead of it
+    import threading
+    import time
+
+    from modal_or_local.parallel_walk import parallel_walk
+
+    listed = []
+    listed_lock = threading.Lock()
+
+    def list_dir(path):
+        with listed_lock:
+            listed.append(path)
+        children = [f"{path}/{i}" for i in range(10)] if path.count("/") < 2 else []
+        return [os.path.basename(child) for child in children], [], children
+
+    for ordered in [True, False]:
+        listed.clear()
+        walk = parallel_walk(list_dir, "top", workers=4, ordered=ordered, max_pending=8)
+        next(walk)
+        time.sleep(0.2)
+        assert len(listed) <= 8 + 1, f"Expected the walk to wait for the caller but {len(listed)} directories were listed for {ordered=}"
+        assert len(list(walk)) == 110 and len(listed) == 111
+
+    # Remove the temp test dir
+    mocal.remove_file_or_directory(temp_dir)
+
+
+@app.function(image=image)
+def test_walk_local():
+    """Walk a local tree (with a symlinked directory) serially and in parallel, ordered and unordered, and compare with os.walk()"""
+    import tempfile
+
+    temp_dir = tempfile.mkdtemp()
+    mlocal = ModalOrLocal()
+    for path in ["top.txt", "a/x/1.txt", "a/y/2.txt", "b/3.txt", "c/x/deeper/4.txt"]:
+        mlocal.write_file(os.path.join(temp_dir, path), path.encode())
+    os.symlink(os.path.join(temp_dir, "a"), os.path.join(temp_dir, "b", "link_to_a"))
+
+    expected = list(os.walk(temp_dir))
+    assert list(mlocal.walk(temp_dir)) == expected
+    assert list(mlocal.walk(temp_dir, workers=4)) == expected, "Expected an ordered parallel walk to match os.walk()"
+    assert walk_tuples_equal(list(mlocal.walk(temp_dir, workers=4, ordered=False)), expected)
+
+    def names(entries):
+        return [os.path.basename(entry.path) for entry in entries]
+
+    for workers in [1, 4]:
+        walked = [(path, names(dirs), names(files)) for path, dirs, files in mlocal.walk_entries(temp_dir, workers=workers)]
+        assert walked == expected, f"Expected walk_entries() with {workers=} to match os.walk() but got {walked=}"
+
+    # Entries carry the stat results of the single stat() made for them
+    for path, dirs, files in mlocal.walk_entries(temp_dir):
+        for entry in files:
+            st = os.stat(os.path.join(path, os.path.basename(entry.path)))
+            assert (entry.size, entry.mtime) == (st.st_size, st.st_mtime), f"Unexpected {entry=}"
+    entry = mlocal.get_FileEntry(os.path.join(temp_dir, "b", "3.txt"))
+    assert entry.path == os.path.join(temp_dir, "b", "3.txt").lstrip("/") and entry.size == len(b"b/3.txt")
+    assert mlocal.get_FileEntry(os.path.join(temp_dir, "missing.txt")) is None
+
+    mlocal.remove_file_or_directory(temp_dir)
+
+
+@app.function(image=image, volumes={mocal.volume_mount_dir: mocal.volume})
+def test_walk_prune():
+    """Check that directories removed from dirs are skipped, and that prune=False (one recursive listing on the volume API) walks the same"""
+    temp_dir = os.path.join(mocal.volume_mount_dir, "test_walk_prune_data")
+    with mocal.batch() as batch:
+        for top in ["keep", "skip"]:
+            for sub in ["x", "y"]:
+                batch.write_file(os.path.join(temp_dir, top, sub, "file.txt"), f"{top}/{sub}".encode())
+
+    walked_dirs = []
+    for path, dirs, files in mocal.walk(temp_dir):
+        walked_dirs.append(path)
+        if "skip" in dirs:
+            dirs.remove("skip")
+    assert not any("skip" in path for path in walked_dirs), f"Expected the skip directory to be pruned but got {walked_dirs=}"
+    assert os.path.join(temp_dir, "keep", "y") in walked_dirs
+
+    serial_tuples = list(mocal.walk(temp_dir))
+    assert list(mocal.walk(temp_dir, prune=False)) == serial_tuples
+    serial_entries = [(path, [e.path for e in dirs], [e.size for e in files]) for path, dirs, files in mocal.walk_entries(temp_dir)]
+    unpruned_entries = [
+        (path, [e.path for e in dirs], [e.size for e in files]) for path, dirs, files in mocal.walk_entries(temp_dir, prune=False)
+    ]
+    assert walk_tuples_equal(unpruned_entries, serial_entries)
+
+    # Remove the temp test dir
+    mocal.remove_file_or_directory(temp_dir)
+
+
 def convert_walk_tuple_lists_to_sets(tuples):
     return [(t[0], frozenset(t[1]), frozenset(t[2])) for t in tuples]
 
@@ -246,6 +616,152 @@ def walk_tuples_equal(expected, actual) -> bool:
     return Counter(expected_converted) == Counter(actual_converted)
 
 
+@app.function(image=image, volumes={mocal.volume_mount_dir: mocal.volume})
+def test_concurrency_controller():
+    """Walk, prefetch and remove with a shared ConcurrencyController and check its state is reported through metrics"""
+    from modal_or_local import ModalOrLocalDir
+
+    temp_dir = os.path.join(mocal.volume_mount_dir, "test_concurrency_controller_data")
+    with mocal.batch() as batch:
+        for top in ["a", "b", "c", "d"]:
+            for i in range(5):
+                batch.write_file(os.path.join(temp_dir, top, f"file_{i}.txt"), f"{top}/{i}".encode())
+
+    controlled = ModalOrLocal(volume_name=mocal.volume_name, volume_mount_dir=mocal.volume_mount_dir, concurrency=True, metrics=True)
+    assert list(controlled.walk(temp_dir, workers=4)) == list(mocal.walk(temp_dir))
+
+    mdir = ModalOrLocalDir(dir_full_path=temp_dir, modal_or_local=controlled)
+    mdir.prefetch("**/*.txt", workers=8)
+    assert mdir.read_file("c/file_3.txt") == b"c/3"
+    controlled.remove_files([os.path.join(temp_dir, top) for top in ["a", "b", "c", "d"]])
+    assert not mocal.listdir(temp_dir)
+
+    # One listing per directory, one read per file and one removal per top level directory went through the controller
+    state = controlled.metrics.snapshot()["gauges"]["concurrency"]
+    assert state == controlled.concurrency.snapshot()
+    assert state["calls"] >= 5 + 20 + 4 and state["in_flight"] == 0 and state["errors"] == 0, f"Unexpected {state=}"
+    assert 1 <= state["limit"] <= controlled.concurrency.max_concurrency
+    assert "modal_or_local_concurrency_limit " in controlled.metrics.to_prometheus()
+
+    # An INTERNAL error is retried for a read but not for a call that changes the volume, which may already have taken effect
+    from grpclib import GRPCError, Status
+
+    from modal_or_local.concurrency import ConcurrencyController
+
+    for idempotent, expected_attempts in [(True, 3), (False, 1)]:
+        controller, attempts = ConcurrencyController(retries=2, backoff_seconds=0), []
+
+        def fail():
+            attempts.append(1)
+            raise GRPCError(Status.INTERNAL)
+
+        try:
+            controller.call("remove", fail, idempotent=idempotent)
+            assert False, "Expected a GRPCError"
+        except GRPCError:
+            pass
+        assert len(attempts) == expected_attempts, f"Unexpected {attempts=} for {idempotent=}"
+
+    # Remove the temp test dir
+    mocal.remove_file_or_directory(temp_dir)
+
+
+@app.function(image=image, volumes={mocal.volume_mount_dir: mocal.volume})
+def test_auto_commit():
+    """Write through a ModalOrLocal with auto_commit and check writes to a mounted volume are committed in batches and on exit"""
+    from modal_or_local.commit_coalescer import CommitCoalescer
+
+    temp_dir = os.path.join(mocal.volume_mount_dir, "test_auto_commit_data")
+    committing = ModalOrLocal(
+        volume_name=mocal.volume_name,
+        volume_mount_dir=mocal.volume_mount_dir,
+        auto_commit=CommitCoalescer(max_writes=5, max_bytes=None, max_seconds=None),
+        metrics=True,
+    )
+    with committing:
+        for i in range(12):
+            committing.write_file(os.path.join(temp_dir, f"file_{i}.txt"), str(i).encode())
+        pending = committing.commits.pending_writes
+    state = committing.metrics.snapshot()["gauges"]["commits"]
+
+    if committing.backend.needs_commit:
+        # Mounted while running remotely: a commit every 5 writes, and one for the last 2 when the with block exited
+        assert pending == 2 and state["commits"] == 3 and state["pending_writes"] == 0, f"Unexpected {state=}"
+        assert committing.metrics.snapshot()["rpcs"]["commit"]["calls"] == 3
+    else:
+        # Through the volume API (or locally) every write is visible straight away, so nothing needs committing
+        assert pending == 0 and state["commits"] == 0, f"Unexpected {state=}"
+    assert not committing.flush()
+    assert len(mocal.listdir(temp_dir)) == 12
+
+    # A coalescer with uncommitted writes is kept (with whatever its commit function holds) until the exit flush commits them, and is
+    # only dropped once clean
+    import gc
+    import weakref
+
+    from modal_or_local import commit_coalescer
+
+    commits = []
+    dropped = CommitCoalescer(max_writes=5, max_bytes=None, max_seconds=None)
+    dropped.bind(lambda: commits.append("dropped"))
+    commit_coalescer.flush_at_exit(dropped)
+    dropped.record_write(10)
+    dropped_ref = weakref.ref(dropped)
+    del dropped
+    gc.collect()
+    assert dropped_ref() is not None
+    commit_coalescer._flush_all()
+    assert commits == ["dropped"]
+    gc.collect()
+    assert dropped_ref() is None
+
+    # Remove the temp test dir
+    mocal.remove_file_or_directory(temp_dir)
+
+
+@app.function(image=image, volumes={mocal.volume_mount_dir: mocal.volume})
+def test_reload_policy():
+    """Read through a ModalOrLocal with an on_miss ReloadPolicy and check a mounted volume is reloaded when a path is not found"""
+    from modal_or_local.reload_policy import ReloadPolicy
+
+    temp_dir = os.path.join(mocal.volume_mount_dir, "test_reload_policy_data")
+    reloading = ModalOrLocal(
+        volume_name=mocal.volume_name,
+        volume_mount_dir=mocal.volume_mount_dir,
+        reload_policy=ReloadPolicy("on_miss", min_interval_seconds=0),
+        metrics=True,
+    )
+    missing_file = os.path.join(temp_dir, "missing.txt")
+    assert not reloading.file_or_dir_exists(missing_file)
+    assert reloading.get_FileEntry(missing_file) is None
+
+    if reloading.backend.needs_commit:
+        # Mounted while running remotely: each miss reloads and retries once
+        state = reloading.metrics.snapshot()["gauges"]["reloads"]
+        assert state["reloads"] == 2 and state["misses_retried"] == 2, f"Unexpected {state=}"
+
+        # A recursive listing is streamed, and the miss is still retried when it is raised as the listing starts
+        try:
+            list(reloading.iterdir(os.path.join(temp_dir, "missing_dir"), recursive=True))
+            assert False, "Expected FileNotFoundError"
+        except FileNotFoundError:
+            pass
+        assert reloading.reload_policy.misses_retried == 3
+
+        # Not reloaded while there are uncommitted writes, which a reload would lose
+        reloading.write_file(os.path.join(temp_dir, "written.txt"), b"x")
+        assert not reloading.reload()
+        assert reloading.reload_policy.reloads_skipped == 1
+        reloading.flush()
+        assert reloading.reload()
+
+        # Remove the temp test dir
+        mocal.remove_file_or_directory(temp_dir)
+    else:
+        # Through the volume API (or locally) every read sees the latest commit, so there is nothing to reload
+        assert not reloading.reload() and reloading.reload_policy.reloads == 0
+
+
 @app.function(image=image, volumes={mocal.volume_mount_dir: mocal.volume})
 def test_get_FileEntry():
     """Create a file and dir on the volume, check we can get FileEntry of each"""
@@ -305,6 +821,155 @@ def test_get_mtime():
     # Get the mtime from the new json file and compare to now
 
 
+@app.function(image=image, volumes={mocal.volume_mount_dir: mocal.volume})
+def test_metrics():
+    """Check that operations, bytes and volume RPCs are recorded when metrics are enabled"""
+    mocal_with_metrics = ModalOrLocal(
+        volume_name=mocal.volume_name,
+        volume_mount_dir=mocal.volume_mount_dir,
+        metrics=True,
+    )
+    file_full_path = os.path.join(mocal.volume_mount_dir, "test_metrics.txt")
+    mocal_with_metrics.write_file(file_full_path, b"0123456789")
+    assert mocal_with_metrics.read_file(file_full_path) == b"0123456789"
+
+    snapshot = mocal_with_metrics.metrics.snapshot()
+    branch = mocal_with_metrics.backend_branch()
+    read_stats = snapshot["operations"]["read_file"][branch]
+    write_stats = snapshot["operations"]["write_file"][branch]
+    assert read_stats["calls"] == 1 and read_stats["bytes_read"] == 10, f"Unexpected {read_stats=}"
+    assert write_stats["calls"] == 1 and write_stats["bytes_written"] == 10, f"Unexpected {write_stats=}"
+    if modal.is_local():
+        assert read_stats["rpcs"] == {"read_file": 1}, f"Unexpected {read_stats=}"
+        assert snapshot["rpcs"]["batch_upload"]["bytes_written"] == 10
+
+    assert "modal_or_local_operation_calls_total" in mocal_with_metrics.metrics.to_prometheus()
+    mocal_with_metrics.metrics.reset()
+    assert mocal_with_metrics.metrics.snapshot() == {"operations": {}, "rpcs": {}}
+
+    mocal.remove_file_or_directory(file_full_path)
+
+
+@app.function(image=image, volumes={mocal.volume_mount_dir: mocal.volume})
+def test_backends():
+    """Check the backend chosen for each branch and run the basic operations against an InMemoryBackend"""
+    from modal_or_local.backends import InMemoryBackend
+
+    expected_branch = "volume_api" if modal.is_local() else "mounted_volume"
+    assert mocal.backend_branch() == expected_branch, f"Expected {expected_branch} but got {mocal.backend_branch()}"
+    assert ModalOrLocal().backend_branch() == "local"
+
+    mocal_in_memory = ModalOrLocal(backend=InMemoryBackend())
+    mocal_in_memory.write_json_file("/data/a/x.json", {"x": 1})
+    mocal_in_memory.write_file("/data/a/b/y.txt", b"yyy")
+    mocal_in_memory.create_directory("/data/empty")
+    assert mocal_in_memory.read_json_file("/data/a/x.json") == {"x": 1}
+    assert mocal_in_memory.read_file_range("/data/a/b/y.txt", 1, 5) == b"yy"
+    assert mocal_in_memory.listdir("/data") == ["a", "empty"]
+    assert mocal_in_memory.isdir("/data/a/b") and mocal_in_memory.isfile("/data/a/b/y.txt")
+    assert list(mocal_in_memory.walk("/data")) == [
+        ("/data", ["a", "empty"], []),
+        ("/data/a", ["b"], ["x.json"]),
+        ("/data/a/b", [], ["y.txt"]),
+        ("/data/empty", [], []),
+    ]
+    mocal_in_memory.remove_file_or_directory("/data/a")
+    assert not mocal_in_memory.file_or_dir_exists("/data/a/b/y.txt")
+
+    # StorageBackend only defines what backends implement
+    from modal_or_local.backends import StorageBackend
+
+    try:
+        StorageBackend()
+        raise AssertionError("Expected a TypeError for the abstract StorageBackend")
+    except TypeError:
+        pass
+
+
+@app.function(image=image, volumes={mocal.volume_mount_dir: mocal.volume})
+def test_volume_registry():
+    """Check ModalOrLocals for the same volume share one handle, and that registering or forgetting a handle changes what they use"""
+    from modal_or_local import volume_registry
+    from modal_or_local.fake_volume import FakeVolume
+
+    other = ModalOrLocal(volume_name=mocal.volume_name, volume_mount_dir=mocal.volume_mount_dir)
+    assert other.volume is mocal.volume is volume_registry.get_volume(mocal.volume_name)
+    assert ModalOrLocal().volume is None
+
+    # A registered handle is used by every instance for that name, existing ones included
+    volume_name = "test_volume_registry_volume"
+    fake_volume = FakeVolume()
+    volume_registry.register_volume(volume_name, fake_volume)
+    registered = ModalOrLocal(volume_name=volume_name, volume_mount_dir="/test_volume_registry_mnt")
+    assert registered.volume is fake_volume
+    assert volume_registry.prewarm(volume_name) is volume_registry.prewarm(volume_name), "Expected one prewarm thread per volume"
+
+    # Once forgotten, the next use looks the volume up again (lazily - modal.Volume.from_name makes no RPC until hydrated)
+    volume_registry.forget_volume(volume_name)
+    assert registered.volume is not fake_volume
+    assert registered.volume is ModalOrLocal(volume_name=volume_name, volume_mount_dir="/test_volume_registry_mnt").volume
+    volume_registry.forget_volume(volume_name)
+
+
+@app.function(image=image)
+def test_fake_volume():
+    """Check FakeVolume behaves as the modal.Volume calls ModalOrLocal makes do, including their errors"""
+    from grpclib import GRPCError, Status
+    from modal.volume import FileEntryType
+    from modal_or_local import volume_registry
+    from modal_or_local.fake_volume import FakeVolume
+
+    fake_volume = FakeVolume(read_chunk_size=4)
+    fake_volume.put("/a/b/file.txt", b"0123456789")
+    fake_volume.put("a/top.txt", b"top")
+
+    assert [(e.path, e.type) for e in fake_volume.listdir("a")] == [("a/b", FileEntryType.DIRECTORY), ("a/top.txt", FileEntryType.FILE)]
+    assert sorted(e.path for e in fake_volume.iterdir("/", recursive=True)) == ["a", "a/b", "a/b/file.txt", "a/top.txt"]
+    assert [e.size for e in fake_volume.listdir("a/b/file.txt")] == [10], "Expected listing a file to give its own entry"
+    assert list(fake_volume.read_file("a/b/file.txt")) == [b"0123", b"4567", b"89"]
+    assert fake_volume.bytes_read == 10
+
+    # Errors as the modal client raises them
+    for call, expected in [
+        (lambda: fake_volume.listdir("missing"), GRPCError),
+        (lambda: list(fake_volume.read_file("missing.txt")), FileNotFoundError),
+        (lambda: fake_volume.remove_file("a"), GRPCError),
+    ]:
+        try:
+            call()
+            raise AssertionError(f"Expected {expected.__name__}")
+        except expected as e:
+            if isinstance(e, GRPCError):
+                assert e.status in (Status.NOT_FOUND, Status.FAILED_PRECONDITION), f"Unexpected {e.status=}"
+
+    # Uploads land when the batch exits, and do not overwrite without force
+    with fake_volume.batch_upload() as batch:
+        batch.put_file(io.BytesIO(b"new"), "/c/new.txt")
+        assert not any(e.path == "c" for e in fake_volume.listdir("/"))
+    try:
+        with fake_volume.batch_upload() as batch:
+            batch.put_file(io.BytesIO(b"again"), "/c/new.txt")
+        raise AssertionError("Expected FileExistsError")
+    except FileExistsError:
+        pass
+    with fake_volume.batch_upload(force=True) as batch:
+        batch.put_file(io.BytesIO(b"again"), "/c/new.txt")
+    assert b"".join(fake_volume.read_file("c/new.txt")) == b"again"
+
+    fake_volume.remove_file("a", recursive=True)
+    assert [e.path for e in fake_volume.listdir("/")] == ["c"]
+    assert fake_volume.calls["batch_upload"] == 3 and fake_volume.calls["remove_file"] == 2, f"Unexpected {fake_volume.calls=}"
+
+    if modal.is_local():
+        # Through the volume API a ModalOrLocal works against it as against a real volume
+        volume_registry.register_volume("test_fake_volume_volume", fake_volume)
+        mocal_on_fake = ModalOrLocal(volume_name="test_fake_volume_volume", volume_mount_dir="/test_fake_volume_mnt")
+        mocal_on_fake.write_json_file("/test_fake_volume_mnt/d/x.json", {"x": 1})
+        assert mocal_on_fake.read_json_file("/test_fake_volume_mnt/d/x.json") == {"x": 1}
+        assert mocal_on_fake.listdir("/test_fake_volume_mnt") == ["c", "d"]
+        volume_registry.forget_volume("test_fake_volume_volume")
+
+
 @app.function(image=image, volumes={mocal.volume_mount_dir: mocal.volume})
 def test_get_time_delta():
     mocal_for_local = ModalOrLocal()
@@ -323,12 +988,48 @@ def main():
     test_create_or_remove_dir.remote()
     test_write_and_read_volume_txt_file.local()
     test_write_and_read_volume_txt_file.remote()
+    test_read_file_mmap.local()
+    test_read_file_mmap.remote()
+    test_read_file_range.local()
+    test_read_file_range.remote()
+    test_read_file_with_disk_cache.local()
+    test_read_file_with_disk_cache.remote()
+    test_write_and_read_object.local()
+    test_write_and_read_object.remote()
+    test_write_and_read_array.local()
+    test_write_and_read_array.remote()
+    test_batch.local()
+    test_batch.remote()
+    test_batch_existing_directory.local()
+    test_batch_existing_directory.remote()
+    test_remove_files.local()
+    test_remove_files.remote()
     test_listdir.local()
     test_listdir.remote()
     test_walk.local()
     test_walk.remote()
+    test_walk_parallel.local()
+    test_walk_parallel.remote()
+    test_walk_local.local()
+    test_walk_local.remote()
+    test_walk_prune.local()
+    test_walk_prune.remote()
+    test_concurrency_controller.local()
+    test_concurrency_controller.remote()
+    test_auto_commit.local()
+    test_auto_commit.remote()
+    test_reload_policy.local()
+    test_reload_policy.remote()
     test_get_FileEntry.local()
     test_get_FileEntry.remote()
     test_get_mtime.local()
     test_get_mtime.remote()
+    test_metrics.local()
+    test_metrics.remote()
+    test_backends.local()
+    test_backends.remote()
+    test_volume_registry.local()
+    test_volume_registry.remote()
+    test_fake_volume.local()
+    test_fake_volume.remote()
     test_get_time_delta.local()
@@ -569,6 +569,244 @@ def test_copy():
     )
 
 
+@app.function(
+    image=image,
+    volumes={
+        mvol1.volume_mount_dir: mvol1.volume,
+        mvol2.volume_mount_dir: mvol2.volume,
+    },
+)
+def test_copy_digest():
+    """Copy files between volumes with digests and sidecars, and check a mismatching sidecar is caught. Tests copy_file() verification"""
+    import hashlib
+    import tempfile
+
+    from modal_or_local.modal_or_local_copy import read_sidecar_digest, sidecar_path
+
+    temp_dir_volume_one = os.path.join(mvol1.volume_mount_dir, "test_copy_digest")
+    temp_dir_volume_two = os.path.join(mvol2.volume_mount_dir, "test_copy_digest")
+    content = os.urandom(3 * 1024 * 1024 + 7)
+    source_full_path = os.path.join(temp_dir_volume_one, "data.bin")
+    mvol1.write_file(source_full_path, content)
+
+    # The digest comes from the bytes as they are copied, and is written to a sidecar next to the destination
+    result = copy_file(mvol1, source_full_path, mvol2, temp_dir_volume_two + "/", sidecar=True)
+    expected_digest = hashlib.sha256(content).hexdigest()
+    assert result["bytes"] == len(content) and result["digest"] == expected_digest, f"Unexpected {result=}"
+    assert result["destination"] == os.path.join(temp_dir_volume_two, "data.bin")
+    assert mvol2.read_file(result["destination"]) == content
+    assert read_sidecar_digest(mvol2, result["destination"]) == expected_digest
+
+    # Copying back is checked against that sidecar
+    copy_file(mvol2, result["destination"], mvol1, os.path.join(temp_dir_volume_one, "copied_back.bin"), sidecar=True)
+
+    # A sidecar that does not match the content fails the copy without replacing the existing destination, on every backend
+    mvol2.write_file(sidecar_path(result["destination"]), b"0" * 64 + b"  data.bin\n")
+    mismatch_destination = os.path.join(temp_dir_volume_one, "mismatch.bin")
+    mvol1.write_file(mismatch_destination, b"previous version")
+    try:
+        copy_file(mvol2, result["destination"], mvol1, mismatch_destination, sidecar=True)
+        raise AssertionError("Expected the sidecar mismatch to be caught")
+    except RuntimeError as e:
+        assert "sidecar" in str(e), f"Unexpected error {e}"
+    assert mvol1.read_file(mismatch_destination) == b"previous version"
+    assert sorted(mvol1.listdir(temp_dir_volume_one)) == ["copied_back.bin", "copied_back.bin.sha256", "data.bin", "mismatch.bin"]
+
+    # The same holds for a local destination
+    local_destination = os.path.join(tempfile.mkdtemp(), "mismatch.bin")
+    mlocal.write_file(local_destination, b"previous version")
+    try:
+        copy_file(mvol2, result["destination"], mlocal, local_destination, sidecar=True)
+        raise AssertionError("Expected the sidecar mismatch to be caught")
+    except RuntimeError:
+        pass
+    assert mlocal.read_file(local_destination) == b"previous version"
+    assert mlocal.listdir(os.path.dirname(local_destination)) == ["mismatch.bin"]
+    mlocal.remove_file_or_directory(os.path.dirname(local_destination))
+
+    # Directory copies return a result per file. Sidecars are only skipped (and rewritten) when sidecar is set
+    results = copy_dir(mvol2, temp_dir_volume_two, mvol1, os.path.join(temp_dir_volume_one, "dir_copy"), digest=None)
+    assert [os.path.basename(r["destination"]) for r in results] == ["data.bin", "data.bin.sha256"]
+    assert all(r["digest"] is None for r in results)
+
+    # <name>.sha256 is only a sidecar when <name> is next to it, so a file of the user's such as checksums.sha256 is still copied
+    mvol2.write_file(sidecar_path(result["destination"]), f"{expected_digest}  data.bin\n".encode())
+    mvol2.write_file(os.path.join(temp_dir_volume_two, "checksums.sha256"), b"the user's own checksums")
+    results = copy_dir(mvol2, temp_dir_volume_two, mvol1, os.path.join(temp_dir_volume_one, "sidecar_dir_copy"), sidecar=True)
+    assert sorted(os.path.basename(r["destination"]) for r in results) == ["checksums.sha256", "data.bin"], f"Unexpected {results=}"
+
+    mvol1.remove_file_or_directory(temp_dir_volume_one)
+    mvol2.remove_file_or_directory(temp_dir_volume_two)
+
+
+@app.function(
+    image=image,
+    volumes={
+        mvol1.volume_mount_dir: mvol1.volume,
+        mvol2.volume_mount_dir: mvol2.volume,
+    },
+)
+def test_copy_delta():
+    """Copy a file between volumes with delta=True, change it and copy it again. Tests copy_file(delta=True)"""
+    import tempfile
+
+    from modal_or_local.delta import read_signature
+
+    temp_dir_volume_one = os.path.join(mvol1.volume_mount_dir, "test_copy_delta")
+    temp_dir_volume_two = os.path.join(mvol2.volume_mount_dir, "test_copy_delta")
+    source_full_path = os.path.join(temp_dir_volume_one, "log.bin")
+    destination_full_path = os.path.join(temp_dir_volume_two, "log.bin")
+    content = os.urandom(1024 * 1024)
+    mvol1.write_file(source_full_path, content)
+
+    # The first copy has nothing to reuse, and leaves a block signature next to the destination
+    result = copy_file(mvol1, source_full_path, mvol2, destination_full_path, delta=True, block_size=16 * 1024)
+    assert result["transferred_bytes"] == len(content) and result["reused_bytes"] == 0, f"Unexpected {result=}"
+    assert read_signature(mvol2, destination_full_path, mvol2.get_FileEntry(destination_full_path)) is not None
+
+    # Append to the source and change a few bytes near the start
+    content = content[:100] + b"changed" + content[107:] + os.urandom(5000)
+    mvol1.write_file(source_full_path, content)
+    result = copy_file(mvol1, source_full_path, mvol2, destination_full_path, delta=True, block_size=16 * 1024)
+    assert mvol2.read_file(destination_full_path) == content
+    assert result["bytes"] == len(content)
+    if mvol2.backend.local_path(destination_full_path):
+        # The destination is directly accessible (mounted while running remotely) so only the changed blocks were taken from the source
+        assert result["transferred_bytes"] < 2 * 16 * 1024 + 5000, f"Expected a delta transfer but got {result=}"
+        assert result["reused_bytes"] + result["transferred_bytes"] == len(content)
+    else:
+        # Through the volume API the whole file is uploaded
+        assert result["transferred_bytes"] == len(content)
+
+    # A volume source with an up to date signature is compared with a local destination's. Through the volume API it is streamed only up
+    # to the end of the last changed block, and an unchanged file is not read at all
+    local_dir = tempfile.mkdtemp()
+    local_source, local_destination = os.path.join(local_dir, "source.bin"), os.path.join(local_dir, "destination.bin")
+    mlocal.write_file(local_source, content)
+    copy_file(mlocal, local_source, mvol1, source_full_path, delta=True, block_size=16 * 1024)
+    copy_file(mvol1, source_full_path, mlocal, local_destination, delta=True, block_size=16 * 1024)
+    content = content[:100] + b"changed again" + content[113:3 * 16 * 1024] + b"and again" + content[3 * 16 * 1024 + 9 :]
+    mlocal.write_file(local_source, content)
+    copy_file(mlocal, local_source, mvol1, source_full_path, delta=True, block_size=16 * 1024)
+    metered = ModalOrLocal(volume_name=mvol1.volume_name, volume_mount_dir=mvol1.volume_mount_dir, metrics=True)
+    result = copy_file(metered, source_full_path, mlocal, local_destination, delta=True, block_size=16 * 1024)
+    assert mlocal.read_file(local_destination) == content
+    assert result["reused_bytes"] == len(content) - 2 * 16 * 1024, f"Unexpected {result=}"
+    if metered.backend.local_path(source_full_path):
+        assert result["transferred_bytes"] == 2 * 16 * 1024, f"Unexpected {result=}"
+    else:
+        # One stream (and one read of the signature) up to the end of the second changed block, block 3
+        assert result["transferred_bytes"] == 4 * 16 * 1024, f"Unexpected {result=}"
+        assert metered.metrics.snapshot()["rpcs"]["read_file"]["calls"] == 2
+    result = copy_file(mvol1, source_full_path, mlocal, local_destination, delta=True, block_size=16 * 1024)
+    assert result["transferred_bytes"] == 0 and result["reused_bytes"] == len(content), f"Unexpected {result=}"
+
+    # A delta copy that fails its checks before it is complete leaves the old version and its signature as they were
+    from modal_or_local.modal_or_local_copy import sidecar_path
+
+    mlocal.write_file(local_source, content[:5000] + b"not copied" + content[5010:])
+    mlocal.write_file(sidecar_path(local_source), b"0" * 64 + b"  source.bin\n")
+    signature = mlocal.read_file(local_destination + ".blocksig")
+    try:
+        copy_file(mlocal, local_source, mlocal, local_destination, delta=True, sidecar=True, block_size=16 * 1024)
+        raise AssertionError("Expected the sidecar mismatch to be caught")
+    except RuntimeError as e:
+        assert "sidecar" in str(e), f"Unexpected error {e}"
+    assert mlocal.read_file(local_destination) == content
+    assert mlocal.read_file(local_destination + ".blocksig") == signature
+    assert sorted(mlocal.listdir(local_dir)) == ["destination.bin", "destination.bin.blocksig", "source.bin", "source.bin.sha256"]
+    mlocal.remove_file_or_directory(local_dir)
+
+    mvol1.remove_file_or_directory(temp_dir_volume_one)
+    mvol2.remove_file_or_directory(temp_dir_volume_two)
+
+
+@app.function(
+    image=image,
+    volumes={
+        mvol1.volume_mount_dir: mvol1.volume,
+        mvol2.volume_mount_dir: mvol2.volume,
+    },
+)
+def test_copy_budget():
+    """Copy a directory of large files between volumes with several workers under a transfer budget. Tests copy_dir(workers=...)"""
+    from modal_or_local.transfer_budget import TransferBudget
+
+    temp_dir_volume_one = os.path.join(mvol1.volume_mount_dir, "test_copy_budget")
+    temp_dir_volume_two = os.path.join(mvol2.volume_mount_dir, "test_copy_budget")
+    contents = {f"shard_{i}.bin": os.urandom(3 * 1024 * 1024 + i) for i in range(4)}
+    for name, content in contents.items():
+        mvol1.write_file(os.path.join(temp_dir_volume_one, name), content)
+
+    budget = TransferBudget(max_bytes=2 * 1024 * 1024, max_files=2)
+    destination = ModalOrLocal(volume_name=mvol2.volume_name, volume_mount_dir=mvol2.volume_mount_dir, transfer_budget=budget)
+    results = copy_dir(mvol1, temp_dir_volume_one, destination, temp_dir_volume_two, workers=4)
+
+    # Files are streamed in chunks that fit in the budget, so it is never exceeded however large the files are
+    assert len(results) == len(contents)
+    assert budget.peak_bytes <= 2 * 1024 * 1024 and budget.peak_files <= 2, f"Budget exceeded: {budget.snapshot()}"
+    assert all(result["peak_in_flight_bytes"] <= 2 * 1024 * 1024 for result in results), f"Unexpected {results=}"
+    for result in results:
+        assert mvol2.read_file(result["destination"]) == contents[os.path.basename(result["source"])]
+
+    # Content written past max_memory_bytes is spooled to disk until the upload, and still lands whole
+    spilled_path = os.path.join(temp_dir_volume_two, "spilled.bin")
+    with destination.open_write(spilled_path, max_memory_bytes=1024) as f:
+        for _ in range(4):
+            f.write(contents["shard_0.bin"][:1000])
+        if destination.backend.remote:
+            assert f._rolled, "Expected the upload to be spooled to disk"
+    assert mvol2.read_file(spilled_path) == contents["shard_0.bin"][:1000] * 4
+
+    mvol1.remove_file_or_directory(temp_dir_volume_one)
+    mvol2.remove_file_or_directory(temp_dir_volume_two)
+
+
+@app.function(image=image, volumes={mvol1.volume_mount_dir: mvol1.volume, mvol2.volume_mount_dir: mvol2.volume})
+def test_copy_executor():
+    """Copy a local directory through a process pool executor and check it matches an in-process copy. Tests copy_dir(executor=...)"""
+    import tempfile
+    from modal_or_local.sync_executor import ProcessPoolSyncExecutor, SyncExecutor, plan_copy_dir
+
+    temp_dir = tempfile.mkdtemp()
+    source_dir = os.path.join(temp_dir, "source")
+    for sub_dir in ["", "a", os.path.join("a", "b")]:
+        for i in range(3):
+            mlocal.write_file(os.path.join(source_dir, sub_dir, f"file_{i}.bin"), os.urandom(1000 + i))
+
+    expected = copy_dir(mlocal, source_dir, mlocal, os.path.join(temp_dir, "in_process"))
+    results = copy_dir(mlocal, source_dir, mlocal, os.path.join(temp_dir, "process_pool"), executor=ProcessPoolSyncExecutor(processes=2))
+
+    # Results come back in plan (walk) order whichever process copied each file
+    assert [result["digest"] for result in results] == [result["digest"] for result in expected], f"Unexpected {results=}"
+    for result in results:
+        assert mlocal.read_file(result["destination"]) == mlocal.read_file(result["source"])
+    assert mlocal.isdir(os.path.join(temp_dir, "process_pool", "a", "b"))
+
+    # A Modal function can only run plans between volumes, which it mounts by their mount dirs
+    mvol1.write_file(os.path.join(mvol1.volume_mount_dir, "test_copy_executor", "file.txt"), b"x")
+    plan = plan_copy_dir(mvol1, os.path.join(mvol1.volume_mount_dir, "test_copy_executor"), mvol2, mvol2.volume_mount_dir)
+    assert sorted(plan.volumes()) == sorted([mvol1.volume_mount_dir, mvol2.volume_mount_dir])
+    assert plan.files == [
+        (os.path.join(mvol1.volume_mount_dir, "test_copy_executor", "file.txt"), os.path.join(mvol2.volume_mount_dir, "test_copy_executor", "file.txt"))
+    ]
+    try:
+        plan_copy_dir(mlocal, source_dir, mvol2, mvol2.volume_mount_dir).volumes()
+        assert False, "Expected a ValueError for a plan from the local filesystem"
+    except ValueError:
+        pass
+
+    # SyncExecutor only defines what executors do
+    try:
+        SyncExecutor()
+        assert False, "Expected a TypeError for the abstract SyncExecutor"
+    except TypeError:
+        pass
+
+    mlocal.remove_file_or_directory(temp_dir)
+    mvol1.remove_file_or_directory(os.path.join(mvol1.volume_mount_dir, "test_copy_executor"))
+
+
 #
 # Main - call the tests. Run this using 'modal run test_modal_or_local_copy.py'
 #
@@ -584,3 +822,11 @@ def main():
     test_copy_dir_from_volume_to_local.local()
     test_copy.local()
     test_copy.remote()
+    test_copy_digest.local()
+    test_copy_digest.remote()
+    test_copy_delta.local()
+    test_copy_delta.remote()
+    test_copy_budget.local()
+    test_copy_budget.remote()
+    test_copy_executor.local()
+    test_copy_executor.remote()
@@ -378,9 +378,181 @@ def test_listdir():
     ), f"Expected mdir_on_volume.listdir('subdir', return_full_paths=True) to return ['/test_mnt_dir/test_listdir/subdir/bb.json', '/test_mnt_dir/test_listdir/subdir/aa.json'] but got {mdir_on_volume.listdir('subdir', return_full_paths=True)}"
 
 
+@app.function(image=image, volumes={mocal.volume_mount_dir: mocal.volume})
+def test_prefetch():
+    """Prefetch files on the volume, check reads are served from the prefetched content and that writes replace it"""
+
+    mdir_on_volume = ModalOrLocalDir(
+        dir_full_path=os.path.join(mocal.volume_mount_dir, "test_prefetch"),
+        modal_or_local=mocal,
+    )
+    mdir_on_volume.remove_own_directory(dne_ok=True)
+
+    for i in range(5):
+        mdir_on_volume.write_json_file(os.path.join("subdir", f"{i}.json"), {"i": i})
+    mdir_on_volume.write_file("a.txt", b"a")
+
+    prefetched = mdir_on_volume.prefetch(["a.txt", "**/*.json"], workers=4)
+    assert sorted(prefetched) == ["a.txt"] + [f"subdir/{i}.json" for i in range(5)], f"Unexpected {prefetched=}"
+    json_bytes = len(mdir_on_volume.modal_or_local.read_file(mdir_on_volume.get_full_path("subdir/3.json")))
+    held_bytes = mdir_on_volume._prefetched.bytes
+    assert mdir_on_volume.read_file("a.txt") == b"a"
+    assert mdir_on_volume.read_json_file("subdir/3.json") == {"i": 3}
+    assert mdir_on_volume._prefetched.bytes == held_bytes - 1 - json_bytes, "Expected content to be let go once read"
+
+    # max_bytes bounds what is held across calls, not just within one
+    mdir_on_volume.clear_prefetched()
+    mdir_on_volume.prefetch(["subdir/0.json"], max_bytes=json_bytes)
+    mdir_on_volume.prefetch(["subdir/1.json"], max_bytes=json_bytes)
+    assert mdir_on_volume._prefetched.bytes == json_bytes
+    assert mdir_on_volume.read_json_file("subdir/1.json") == {"i": 1}, "Expected a file over the budget to be read normally"
+    mdir_on_volume.clear_prefetched()
+    assert mdir_on_volume._prefetched.bytes == 0
+
+    mdir_on_volume.write_file("a.txt", b"b")
+    assert mdir_on_volume.read_file("a.txt") == b"b", "Expected a write to replace the prefetched content"
+
+    contents = [json.loads(content) for _, content in mdir_on_volume.iter_files("subdir/*.json", lookahead=2)]
+    assert sorted(c["i"] for c in contents) == list(range(5)), f"Unexpected {contents=}"
+
+    mdir_on_volume.remove_own_directory()
+
+
+@app.function(image=image, volumes={mocal.volume_mount_dir: mocal.volume})
+def test_glob_and_find():
+    """Create a small tree on the volume, then check glob() and find() return the expected entries"""
+
+    mdir_on_volume = ModalOrLocalDir(
+        dir_full_path=os.path.join(mocal.volume_mount_dir, "test_glob_and_find"),
+        modal_or_local=mocal,
+    )
+    mdir_on_volume.remove_own_directory(dne_ok=True)
+
+    # test_glob_and_find/
+    #    ├── a.json
+    #    ├── big.bin (2000 bytes)
+    #    └── subdir
+    #        ├── b.json
+    #        └── deeper
+    #            └── c.json
+    mdir_on_volume.write_json_file("a.json", {"a": 1})
+    mdir_on_volume.write_file("big.bin", b"x" * 2000)
+    mdir_on_volume.write_json_file("subdir/b.json", {"b": 1})
+    mdir_on_volume.write_json_file("subdir/deeper/c.json", {"c": 1})
+
+    def relative_paths(entries):
+        return sorted(os.path.relpath(os.path.join("/", e.path), mdir_on_volume.dir_full_path) for e in entries)
+
+    assert relative_paths(mdir_on_volume.glob("*.json")) == ["a.json"]
+    assert relative_paths(mdir_on_volume.glob("subdir/*.json")) == ["subdir/b.json"]
+    expected = ["a.json", "subdir/b.json", "subdir/deeper/c.json"]
+    for recursive_listing in [True, False]:
+        found = relative_paths(mdir_on_volume.glob("**/*.json", recursive_listing=recursive_listing))
+        assert found == expected, f"Expected {expected} but got {found} with {recursive_listing=}"
+    assert relative_paths(mdir_on_volume.glob("nonexistent/*")) == []
+
+    assert relative_paths(mdir_on_volume.find(min_size=1000)) == ["big.bin"]
+    assert relative_paths(mdir_on_volume.find(name="*.json", type="file")) == expected
+    assert relative_paths(mdir_on_volume.find(type="directory")) == ["subdir", "subdir/deeper"]
+
+    mdir_on_volume.remove_own_directory()
+
+
+@app.function(image=image)
+def test_find_local_relative():
+    """find() and recursive iterdir() on a relative local path, with a symlink loop that must be listed but not followed"""
+    import tempfile
+
+    cwd = os.getcwd()
+    temp_dir = tempfile.mkdtemp()
+    os.chdir(temp_dir)
+    try:
+        mlocal = ModalOrLocal()
+        mlocal.write_file(os.path.join("tree", "a.json"), b"{}")
+        mlocal.write_file(os.path.join("tree", "sub", "b.json"), b"{}")
+        os.symlink("..", os.path.join("tree", "sub", "loop"))
+
+        expected = ["tree/a.json", "tree/sub", "tree/sub/b.json", "tree/sub/loop"]
+        found = sorted(e.path for e in mlocal.iterdir("tree", recursive=True))
+        assert found == expected, f"Expected {expected} but got {found}"
+
+        mdir_local = ModalOrLocalDir(dir_full_path="tree", modal_or_local=mlocal)
+        found = sorted(e.path for e in mdir_local.find(name="*.json"))
+        assert found == ["tree/a.json", "tree/sub/b.json"], f"Unexpected {found=}"
+        # A local directory has a block size, but size filters only match files as on a volume
+        found = sorted(e.path for e in mdir_local.find(min_size=1))
+        assert found == ["tree/a.json", "tree/sub/b.json"], f"Unexpected {found=}"
+
+        # Globs under a relative directory match the same files with either kind of listing
+        from modal_or_local.search import glob_entries
+
+        for recursive_listing in [False, True]:
+            found = sorted(e.path for e in glob_entries(mlocal, "tree", "sub/*.json", recursive_listing=recursive_listing))
+            assert found == ["tree/sub/b.json"], f"Unexpected {found=} for {recursive_listing=}"
+        assert [path for path, _ in mdir_local.iter_files("sub/*.json")] == ["sub/b.json"]
+    finally:
+        os.chdir(cwd)
+        ModalOrLocal().remove_file_or_directory(temp_dir)
+
+
+@app.function(image=image, volumes={mocal.volume_mount_dir: mocal.volume})
+def test_du():
+    """Create files of known sizes on the volume and check the du() totals and breakdown, including after a write"""
+
+    mdir_on_volume = ModalOrLocalDir(
+        dir_full_path=os.path.join(mocal.volume_mount_dir, "test_du"),
+        modal_or_local=mocal,
+    )
+    mdir_on_volume.remove_own_directory(dne_ok=True)
+
+    mdir_on_volume.write_file("a.bin", b"x" * 10)
+    mdir_on_volume.write_file("subdir/b.bin", b"x" * 20)
+    mdir_on_volume.write_file("subdir/deeper/c.bin", b"x" * 30)
+
+    usage = mdir_on_volume.du(depth=1)
+    assert (usage["bytes"], usage["files"], usage["directories"]) == (60, 3, 2), f"Unexpected {usage=}"
+    subdir_usage = usage["children"]["subdir"]
+    assert (subdir_usage["bytes"], subdir_usage["files"]) == (50, 2), f"Unexpected {subdir_usage=}"
+    assert subdir_usage["children"] == {}, "Expected no breakdown below depth 1"
+
+    # A write through the same ModalOrLocal drops the cached result
+    mdir_on_volume.write_file("subdir/d.bin", b"x" * 5)
+    usage = mdir_on_volume.du(depth=1, cached=True)
+    assert usage["bytes"] == 65, f"Expected the cached du() to be invalidated by the write but got {usage=}"
+
+    mdir_on_volume.remove_own_directory()
+
+    # A relative local path is taken from the working directory
+    import tempfile
+
+    cwd = os.getcwd()
+    temp_dir = tempfile.mkdtemp()
+    os.chdir(temp_dir)
+    try:
+        mlocal = ModalOrLocal()
+        mlocal.write_file(os.path.join("tree", "a.bin"), b"x" * 10)
+        mlocal.write_file(os.path.join("tree", "subdir", "b.bin"), b"x" * 20)
+        usage = mlocal.du("tree", depth=1)
+        assert (usage["bytes"], usage["files"], usage["directories"]) == (30, 2, 1), f"Unexpected {usage=}"
+        assert usage["path"] == os.path.join(os.getcwd(), "tree"), f"Unexpected {usage['path']=}"
+        mlocal.write_file(os.path.join("tree", "c.bin"), b"x")
+        assert mlocal.du("tree", depth=1, cached=True)["bytes"] == 31, "Expected a relative write to invalidate the cached du()"
+    finally:
+        os.chdir(cwd)
+        ModalOrLocal().remove_file_or_directory(temp_dir)
+
+
 @app.local_entrypoint()
 def main():
     test_report_changes.local()
     test_report_changes.remote()
     test_copy_changes_from.local()
     test_listdir.local()
+    test_prefetch.local()
+    test_prefetch.remote()
+    test_glob_and_find.local()
+    test_glob_and_find.remote()
+    test_find_local_relative.local()
+    test_find_local_relative.remote()
+    test_du.local()
+    test_du.remote()